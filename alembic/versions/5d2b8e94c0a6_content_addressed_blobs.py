@@ -0,0 +1,112 @@
+"""content_addressed_blobs
+
+Revision ID: 5d2b8e94c0a6
+Revises: a3c5e1f07b21
+Create Date: 2026-10-18 10:41:05.117342
+
+"""
+import hashlib
+import os
+import shutil
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d2b8e94c0a6'
+down_revision: Union[str, Sequence[str], None] = 'a3c5e1f07b21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Каталог загрузок, как его видит тот, кто запускает миграцию
+# (docker-compose монтирует ./backend/uploads в /app/uploads)
+UPLOAD_DIR = os.getenv(
+    "UPLOAD_DIR",
+    os.path.join(os.path.dirname(__file__), "..", "..", "backend", "uploads"),
+)
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _blob_path(sha256: str) -> str:
+    return os.path.join(UPLOAD_DIR, "blobs", sha256[:2], sha256)
+
+
+def _link_or_copy(src: str, dest: str) -> None:
+    # Старый файл не трогаем: если транзакция откатится, строки files останутся рабочими
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('blobs',
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('size_bytes', sa.BigInteger(), nullable=False),
+    sa.Column('refcount', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('sha256')
+    )
+    op.add_column('files', sa.Column('blob_sha256', sa.String(length=64), nullable=True))
+    op.alter_column('files', 'filepath', existing_type=sa.String(length=500), nullable=True)
+
+    # Бэкфилл: каждый существующий файл -> блоб по содержимому.
+    # Строки, чьих файлов уже нет на диске, остаются со старым filepath.
+    conn = op.get_bind()
+    rows = conn.execute(sa.text("SELECT id, filepath FROM files WHERE blob_sha256 IS NULL")).fetchall()
+    refs = {}
+    for file_id, filepath in rows:
+        path = os.path.join(UPLOAD_DIR, os.path.basename(filepath))
+        if not os.path.isfile(path):
+            continue
+        sha256 = _sha256(path)
+        if sha256 not in refs:
+            refs[sha256] = [os.path.getsize(path), 0]
+            if not os.path.exists(_blob_path(sha256)):
+                _link_or_copy(path, _blob_path(sha256))
+        refs[sha256][1] += 1
+        conn.execute(
+            sa.text("UPDATE files SET blob_sha256 = :sha, filepath = NULL WHERE id = :id"),
+            {"sha": sha256, "id": file_id},
+        )
+    for sha256, (size, refcount) in refs.items():
+        conn.execute(
+            sa.text("INSERT INTO blobs (sha256, size_bytes, refcount) VALUES (:sha, :size, :refcount)"),
+            {"sha": sha256, "size": size, "refcount": refcount},
+        )
+    # FK - только после бэкфилла: строки blobs вставляются после обновления files
+    op.create_foreign_key('files_blob_sha256_fkey', 'files', 'blobs', ['blob_sha256'], ['sha256'])
+    # Старые копии в корне UPLOAD_DIR после успешной миграции больше не нужны -
+    # их уберёт ручная чистка (или сборщик мусора хранилища).
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Возвращаем каждой строке собственный файл в корне UPLOAD_DIR
+    conn = op.get_bind()
+    rows = conn.execute(sa.text(
+        "SELECT id, filename, blob_sha256 FROM files WHERE blob_sha256 IS NOT NULL"
+    )).fetchall()
+    for file_id, filename, sha256 in rows:
+        name = f"{file_id}_{os.path.basename(filename)}"
+        if os.path.exists(_blob_path(sha256)):
+            _link_or_copy(_blob_path(sha256), os.path.join(UPLOAD_DIR, name))
+        conn.execute(
+            sa.text("UPDATE files SET filepath = :filepath WHERE id = :id"),
+            {"filepath": f"uploads/{name}", "id": file_id},
+        )
+    op.alter_column('files', 'filepath', existing_type=sa.String(length=500), nullable=False)
+    op.drop_constraint('files_blob_sha256_fkey', 'files', type_='foreignkey')
+    op.drop_column('files', 'blob_sha256')
+    op.drop_table('blobs')
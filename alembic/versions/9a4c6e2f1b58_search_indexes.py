@@ -0,0 +1,45 @@
+"""search_indexes
+
+Revision ID: 9a4c6e2f1b58
+Revises: b6f2d19a7c43
+Create Date: 2026-10-18 15:11:06.402317
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9a4c6e2f1b58'
+down_revision: Union[str, Sequence[str], None] = 'b6f2d19a7c43'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Должны совпадать с выражениями models.LESSON_SEARCH_* / FILE_SEARCH_* - по ним ищет crud.search
+LESSON_TEXT = "coalesce(subject, '') || ' ' || coalesce(teacher, '') || ' ' || coalesce(room, '')"
+FILE_TEXT = "coalesce(filename, '')"
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    op.create_index('ix_lessons_search_tsv', 'lessons', [sa.text(f"to_tsvector('russian', {LESSON_TEXT})")],
+                    postgresql_using='gin')
+    op.create_index('ix_lessons_search_trgm', 'lessons', [sa.text(f"({LESSON_TEXT}) gin_trgm_ops")],
+                    postgresql_using='gin')
+    op.create_index('ix_files_search_tsv', 'files', [sa.text(f"to_tsvector('russian', {FILE_TEXT})")],
+                    postgresql_using='gin')
+    op.create_index('ix_files_search_trgm', 'files', [sa.text(f"({FILE_TEXT}) gin_trgm_ops")],
+                    postgresql_using='gin')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_files_search_trgm', table_name='files')
+    op.drop_index('ix_files_search_tsv', table_name='files')
+    op.drop_index('ix_lessons_search_trgm', table_name='lessons')
+    op.drop_index('ix_lessons_search_tsv', table_name='lessons')
+    # pg_trgm не удаляем - расширение могут использовать и другие
@@ -0,0 +1,30 @@
+"""schedule_date_version
+
+Revision ID: a3c5e1f07b21
+Revises: 39fc20ba225f
+Create Date: 2026-10-18 09:12:31.402118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3c5e1f07b21'
+down_revision: Union[str, Sequence[str], None] = '39fc20ba225f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('schedule_dates', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('schedule_dates', sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('schedule_dates', 'updated_at')
+    op.drop_column('schedule_dates', 'version')
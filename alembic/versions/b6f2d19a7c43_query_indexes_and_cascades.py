@@ -0,0 +1,46 @@
+"""query_indexes_and_cascades
+
+Revision ID: b6f2d19a7c43
+Revises: e47a0b3c2d18
+Create Date: 2026-10-18 14:02:51.730164
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b6f2d19a7c43'
+down_revision: Union[str, Sequence[str], None] = 'e47a0b3c2d18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # lessons.date_id отдельный индекс не нужен: он ведущая колонка в
+    # uq_lessons_date_id_lesson_number (c81f4a6d9e35), загрузка дня идёт по нему.
+
+    # Файлы пар (selectinload в get_schedule_date, get_lesson_files с ORDER BY uploaded_at)
+    op.create_index('ix_files_lesson_id_uploaded_at', 'files', ['lesson_id', 'uploaded_at'])
+    # Проверка FK при удалении блоба и выборки файлов по блобу
+    op.create_index('ix_files_blob_sha256', 'files', ['blob_sha256'])
+
+    # Удаление дня/пары - каскадом в базе, а не построчно из приложения
+    op.drop_constraint('files_lesson_id_fkey', 'files', type_='foreignkey')
+    op.create_foreign_key('files_lesson_id_fkey', 'files', 'lessons', ['lesson_id'], ['id'], ondelete='CASCADE')
+    op.drop_constraint('lessons_date_id_fkey', 'lessons', type_='foreignkey')
+    op.create_foreign_key('lessons_date_id_fkey', 'lessons', 'schedule_dates', ['date_id'], ['id'], ondelete='CASCADE')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('lessons_date_id_fkey', 'lessons', type_='foreignkey')
+    op.create_foreign_key('lessons_date_id_fkey', 'lessons', 'schedule_dates', ['date_id'], ['id'])
+    op.drop_constraint('files_lesson_id_fkey', 'files', type_='foreignkey')
+    op.create_foreign_key('files_lesson_id_fkey', 'files', 'lessons', ['lesson_id'], ['id'])
+
+    op.drop_index('ix_files_blob_sha256', table_name='files')
+    op.drop_index('ix_files_lesson_id_uploaded_at', table_name='files')
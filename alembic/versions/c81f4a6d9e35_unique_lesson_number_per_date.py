@@ -0,0 +1,46 @@
+"""unique_lesson_number_per_date
+
+Revision ID: c81f4a6d9e35
+Revises: 5d2b8e94c0a6
+Create Date: 2026-10-18 12:03:44.659021
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c81f4a6d9e35'
+down_revision: Union[str, Sequence[str], None] = '5d2b8e94c0a6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Дубли (date_id, lesson_number) сливаем в пару с наименьшим id, файлы переносим к ней
+    op.execute("""
+        WITH ranked AS (
+            SELECT id, min(id) OVER (PARTITION BY date_id, lesson_number) AS keep_id
+            FROM lessons
+            WHERE date_id IS NOT NULL
+        )
+        UPDATE files SET lesson_id = ranked.keep_id
+        FROM ranked
+        WHERE files.lesson_id = ranked.id AND ranked.id <> ranked.keep_id
+    """)
+    op.execute("""
+        DELETE FROM lessons l
+        USING lessons k
+        WHERE l.date_id = k.date_id
+          AND l.lesson_number = k.lesson_number
+          AND l.id > k.id
+    """)
+    op.create_unique_constraint('uq_lessons_date_id_lesson_number', 'lessons', ['date_id', 'lesson_number'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('uq_lessons_date_id_lesson_number', 'lessons', type_='unique')
@@ -0,0 +1,44 @@
+"""background_jobs
+
+Revision ID: d3e8b1f04a96
+Revises: 9a4c6e2f1b58
+Create Date: 2026-10-18 17:42:19.518733
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3e8b1f04a96'
+down_revision: Union[str, Sequence[str], None] = '9a4c6e2f1b58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'jobs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=50), nullable=False),
+        sa.Column('payload', sa.JSON(), nullable=False),
+        sa.Column('status', sa.String(length=20), server_default='pending', nullable=False),
+        sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('run_at', sa.DateTime(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.Column('last_error', sa.String(length=1000), nullable=True),
+        sa.Column('result', sa.JSON(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    # Очередь берёт только ждущие задачи - частичный индекс остаётся маленьким
+    op.create_index('ix_jobs_pending_run_at', 'jobs', ['run_at'], postgresql_where=sa.text("status = 'pending'"))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_jobs_pending_run_at', table_name='jobs')
+    op.drop_table('jobs')
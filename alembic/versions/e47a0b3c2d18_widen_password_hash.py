@@ -0,0 +1,36 @@
+"""widen_password_hash
+
+Revision ID: e47a0b3c2d18
+Revises: c81f4a6d9e35
+Create Date: 2026-10-18 13:27:10.284530
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e47a0b3c2d18'
+down_revision: Union[str, Sequence[str], None] = 'c81f4a6d9e35'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.alter_column('users', 'password_hash',
+               existing_type=sa.String(length=64),
+               type_=sa.String(length=255),
+               existing_nullable=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # bcrypt-хэши в 64 символа не влезут - такие пользователи должны будут сменить пароль
+    op.execute("UPDATE users SET password_hash = NULL WHERE length(password_hash) > 64")
+    op.alter_column('users', 'password_hash',
+               existing_type=sa.String(length=255),
+               type_=sa.String(length=64),
+               existing_nullable=True)
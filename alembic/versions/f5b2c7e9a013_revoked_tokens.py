@@ -0,0 +1,36 @@
+"""revoked_tokens
+
+Revision ID: f5b2c7e9a013
+Revises: d3e8b1f04a96
+Create Date: 2026-10-18 21:14:06.402871
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f5b2c7e9a013'
+down_revision: Union[str, Sequence[str], None] = 'd3e8b1f04a96'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'revoked_tokens',
+        sa.Column('token_hash', sa.String(length=64), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('token_hash'),
+    )
+    # Сборка мусора удаляет истёкшие отзывы по этому индексу
+    op.create_index('ix_revoked_tokens_expires_at', 'revoked_tokens', ['expires_at'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_revoked_tokens_expires_at', table_name='revoked_tokens')
+    op.drop_table('revoked_tokens')
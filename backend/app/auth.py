@@ -1,10 +1,71 @@
 import jwt
-from datetime import datetime, timedelta
-from fastapi import HTTPException, status
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+from fastapi import Depends, HTTPException, Query, status
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from . import cache, crud, database
 
-SECRET_KEY = "secret"
+SECRET_KEY = os.getenv("SECRET_KEY", "secret")
+# После ротации старые ключи (через запятую) ещё принимаются, пока не истекут их токены
+PREVIOUS_SECRET_KEYS: List[str] = [k for k in os.getenv("PREVIOUS_SECRET_KEYS", "").split(",") if k]
 ALGORITHM = "HS256"
 
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+# Билет для GET /schedule/stream?ticket=: EventSource не умеет заголовки, а URL оседает в логах
+# прокси и истории браузера - поэтому в URL не сам токен, а билет на STREAM_TICKET_TTL секунд
+STREAM_TICKET_TTL = int(os.getenv("STREAM_TICKET_TTL", "60"))
+STREAM_SCOPE = "stream"
+
+security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
+
+
+class _ExpiringCache:
+    """LRU, у каждой записи свой срок (для токена - его exp)"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, expires_at: float):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def pop(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+
+_verified_tokens = _ExpiringCache(TOKEN_CACHE_SIZE)  # sha256(token) -> user_id
+# Отзывы хранятся в таблице revoked_tokens - её видят все воркеры, в том числе запущенные
+# после отзыва: незнакомый воркеру токен сверяется с ней перед тем, как попасть в кэш.
+# Уже запущенным воркерам отзыв рассылается через cache_backend, здесь - те, что пришли
+_revoked = {}  # sha256(token) -> exp
+
+
+def _token_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
 def create_token(user_id: int) -> str:
     payload = {
         "user_id": user_id,
@@ -12,12 +73,137 @@ def create_token(user_id: int) -> str:
     }
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
-def verify_token(token: str) -> int:
+
+def _decode(token: str) -> dict:
+    error = None
+    for key in [SECRET_KEY, *PREVIOUS_SECRET_KEYS]:
+        try:
+            return jwt.decode(token, key, algorithms=[ALGORITHM])
+        except jwt.InvalidSignatureError as e:
+            error = e
+    raise error
+
+
+def _revoked_error() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Токен отозван")
+
+
+async def _revoked_in_db(key: str) -> bool:
+    # Всегда primary: реплика могла ещё не получить только что записанный отзыв
+    async with database.sessionmaker() as db:
+        return await crud.is_token_revoked(db, key)
+
+
+async def verify_token(token: str) -> int:
+    """user_id из токена. Проверенные токены кэшируются до их exp - подпись, JSON и
+    проверку отзыва в базе делаем раз на воркер, а не на каждый запрос поллящего клиента"""
+    key = _token_key(token)
+    user_id = _verified_tokens.get(key)
+    if user_id is not None:
+        return user_id
+    if key in _revoked:
+        raise _revoked_error()
+
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload["user_id"]
-    except jwt.PyJWTError:
+        payload = _decode(token)
+        user_id = payload["user_id"]
+    except (jwt.PyJWTError, KeyError):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Неверный токен"
         )
+    if "scope" in payload:
+        # Билет ленты изменений - не токен, с ним в API не пускаем
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Неверный токен")
+    exp = float(payload.get("exp", time.time() + 60))
+    if await _revoked_in_db(key):
+        _revoked[key] = exp
+        raise _revoked_error()
+    # Отзыв мог прийти, пока ждали базу - тогда в кэш не кладём
+    if key in _revoked:
+        raise _revoked_error()
+    _verified_tokens.set(key, user_id, exp)
+    return user_id
+
+
+def create_stream_ticket(user_id: int) -> str:
+    payload = {
+        "user_id": user_id,
+        "scope": STREAM_SCOPE,
+        "exp": datetime.utcnow() + timedelta(seconds=STREAM_TICKET_TTL)
+    }
+    return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def verify_stream_ticket(ticket: str) -> int:
+    try:
+        payload = _decode(ticket)
+        if payload.get("scope") != STREAM_SCOPE:
+            raise KeyError("scope")
+        return payload["user_id"]
+    except (jwt.PyJWTError, KeyError):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Неверный билет")
+
+
+async def revoke_token(token: str):
+    """Отозвать токен: запись в revoked_tokens (для всех воркеров, включая будущие)
+    и рассылка запущенным воркерам через бэкенд инвалидаций из cache"""
+    try:
+        exp = float(jwt.decode(token, options={"verify_signature": False}).get("exp", 0))
+    except jwt.PyJWTError:
+        return
+    key = _token_key(token)
+    async with database.sessionmaker() as db:
+        expires_at = datetime.fromtimestamp(exp, timezone.utc).replace(tzinfo=None)
+        await crud.revoke_token(db, key, expires_at)
+    await cache.cache_backend.publish({"kind": "token", "revoke": key, "exp": exp})
+
+
+def rotate_key(new_secret: str):
+    """Новый ключ подписи в этом процессе; прежний остаётся в PREVIOUS_SECRET_KEYS для проверки.
+    В проде ключи задаются SECRET_KEY / PREVIOUS_SECRET_KEYS при перезапуске воркеров"""
+    global SECRET_KEY
+    PREVIOUS_SECRET_KEYS.insert(0, SECRET_KEY)
+    SECRET_KEY = new_secret
+    _verified_tokens.clear()
+
+
+async def flush_caches():
+    """Сбросить кэш проверенных токенов во всех воркерах (например, после смены ключей)"""
+    await cache.cache_backend.publish({"kind": "token", "flush": True})
+
+
+def _apply_token_message(message: dict):
+    if message.get("kind") != "token":
+        return
+    if message.get("flush"):
+        _verified_tokens.clear()
+    if "revoke" in message:
+        _revoked[message["revoke"]] = message["exp"]
+        _verified_tokens.pop(message["revoke"])
+        # Отозванные токены после exp и так не пройдут проверку - список не растёт бесконечно
+        now = time.time()
+        for key in [k for k, exp in _revoked.items() if exp <= now]:
+            del _revoked[key]
+
+
+cache.cache_backend.subscribe(_apply_token_message)
+
+
+async def current_user_id(credentials: HTTPAuthorizationCredentials = Depends(security)) -> int:
+    """Зависимость: id пользователя по Bearer-токену (FastAPI вызывает её раз на запрос)"""
+    return await verify_token(credentials.credentials)
+
+
+async def stream_user_id(
+    ticket: Optional[str] = Query(None),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+) -> int:
+    """Как current_user_id, но вместо заголовка можно ?ticket= (create_stream_ticket) -
+    EventSource не умеет заголовки"""
+    if credentials is not None:
+        return await verify_token(credentials.credentials)
+    if ticket:
+        return verify_stream_ticket(ticket)
+    raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Нет токена")
+
@@ -0,0 +1,375 @@
+"""Кэш готовых ответов расписания (LRU + TTL) и рассылка инвалидаций между воркерами.
+
+Сами данные всегда лежат в памяти процесса. Бэкенд (CACHE_BACKEND) отвечает только
+за то, чтобы сброс записи дошёл до всех воркеров uvicorn:
+- memory   - один процесс, инвалидации доставляются локально;
+- postgres - LISTEN/NOTIFY на соединении из движка asyncpg (database.lifespan).
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from datetime import date
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_NOTIFY_CHANNEL = os.getenv("CACHE_NOTIFY_CHANNEL", "cache_invalidation")
+# Как часто проверять соединение LISTEN (обрыв без FIN асинк-драйвер сам не заметит), сек.
+CACHE_LISTEN_CHECK_INTERVAL = float(os.getenv("CACHE_LISTEN_CHECK_INTERVAL", "30"))
+# Пауза перед повторным подключением LISTEN, дальше x2 за попытку, но не больше 30 сек.
+CACHE_RECONNECT_DELAY = float(os.getenv("CACHE_RECONNECT_DELAY", "1"))
+# NOTIFY берёт payload короче 8000 байт (по умолчанию в Postgres), с запасом
+NOTIFY_PAYLOAD_LIMIT = 7900
+# Сбросить кэш расписания целиком и попросить клиентов ленты перечитать свои дни
+RESYNC_ALL = {"kind": "schedule", "all": True, "event": {"type": "resync"}}
+
+SCHEDULE_CACHE_ENABLED = os.getenv("SCHEDULE_CACHE_ENABLED", "1").lower() not in ("0", "false", "no", "off")
+SCHEDULE_CACHE_SIZE = int(os.getenv("SCHEDULE_CACHE_SIZE", "512"))
+SCHEDULE_CACHE_TTL = float(os.getenv("SCHEDULE_CACHE_TTL", "300"))
+
+
+class ScheduleCache:
+    """Ответы GET /schedule/{date} по ключу-дате (в main - payload + ETag + Last-Modified).
+
+    Кроме самой даты помним её date_id и id всех её пар: пишущие пути в crud
+    знают только их и по ним сбрасывают нужный день.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, enabled: bool = True):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.enabled = enabled
+        self._entries = OrderedDict()  # date -> (expires_at, date_id, lesson_ids, value)
+        self._by_date_id = {}
+        self._by_lesson_id = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def generation(self) -> int:
+        """Снимок счётчика инвалидаций - берём ДО чтения из базы и отдаём в set()"""
+        return self._generation
+
+    def get(self, key: date):
+        if not self.enabled:
+            return None
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] < time.monotonic():
+            self._drop(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[3]
+
+    def set(self, key: date, date_id: int, lesson_ids: list, value, generation: Optional[int] = None):
+        if not self.enabled:
+            return
+        # Пока читали из базы, кто-то что-то поменял - такой ответ мог устареть
+        if generation is not None and generation != self._generation:
+            return
+        if key in self._entries:
+            self._drop(key)
+
+        self._entries[key] = (time.monotonic() + self.ttl, date_id, lesson_ids, value)
+        self._by_date_id[date_id] = key
+        for lesson_id in lesson_ids:
+            self._by_lesson_id[lesson_id] = key
+
+        while len(self._entries) > self.maxsize:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def invalidate(self, key: date):
+        self._generation += 1
+        if key in self._entries:
+            self._drop(key)
+
+    def invalidate_date_id(self, date_id: int):
+        self._generation += 1
+        key = self._by_date_id.get(date_id)
+        if key is not None:
+            self._drop(key)
+
+    def invalidate_lesson(self, lesson_id: int):
+        self._generation += 1
+        key = self._by_lesson_id.get(lesson_id)
+        if key is not None:
+            self._drop(key)
+
+    def clear(self):
+        self._generation += 1
+        self._entries.clear()
+        self._by_date_id.clear()
+        self._by_lesson_id.clear()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _drop(self, key: date):
+        _, date_id, lesson_ids, _ = self._entries.pop(key)
+        if self._by_date_id.get(date_id) == key:
+            del self._by_date_id[date_id]
+        for lesson_id in lesson_ids:
+            if self._by_lesson_id.get(lesson_id) == key:
+                del self._by_lesson_id[lesson_id]
+
+
+class InMemoryBackend:
+    """Инвалидации внутри одного процесса - для локального запуска и тестов"""
+
+    def __init__(self):
+        self._handlers = []
+
+    def subscribe(self, handler: Callable[[dict], None]):
+        self._handlers.append(handler)
+
+    async def start(self, engine=None):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, message: dict):
+        self._deliver(message)
+
+    def _deliver(self, message: dict):
+        for handler in self._handlers:
+            handler(message)
+
+
+class PostgresNotifyBackend(InMemoryBackend):
+    """Инвалидации между воркерами через Postgres LISTEN/NOTIFY.
+
+    Своё сообщение применяем сразу локально, остальным воркерам оно приходит
+    через NOTIFY. По умолчанию слушаем на соединении из пула движка; для тестов
+    можно передать connect - фабрику соединения с интерфейсом asyncpg
+    (add_listener / remove_listener / add_termination_listener / execute / close).
+
+    Соединение LISTEN может оборваться (рестарт Postgres, pgbouncer, сеть) - тогда
+    переподключаемся с растущей паузой. Что пришло за время обрыва, потеряно, поэтому
+    после переподключения кэш расписания этого воркера сбрасывается целиком, а клиенты
+    ленты изменений получают resync (сообщение {"kind": "schedule", "all": True, ...}),
+    а кэш проверенных токенов сбрасывается ({"kind": "token", "flush": True}).
+
+    Большой список дат (импорт) режется на несколько NOTIFY по NOTIFY_PAYLOAD_LIMIT;
+    если и так не влезает - уходит {"all": True} с resync.
+    """
+
+    def __init__(self, channel: str, connect: Optional[Callable] = None):
+        super().__init__()
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+        self._connect = connect
+        self._engine = None
+        self._conn = None
+        self._sa_conn = None
+        self._lock = asyncio.Lock()
+        self._lost = asyncio.Event()
+        self._watcher = None
+        self.reconnects = 0
+
+    async def start(self, engine=None):
+        self._engine = engine
+        self._lost = asyncio.Event()
+        await self._listen()
+        self._watcher = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+        await self._close(broken=False)
+
+    async def _listen(self):
+        if self._connect is not None:
+            conn = await self._connect()
+        else:
+            self._sa_conn = await self._engine.connect()
+            raw = await self._sa_conn.get_raw_connection()
+            conn = raw.driver_connection
+        conn.add_termination_listener(self._on_terminate)
+        await conn.add_listener(self.channel, self._on_notify)
+        self._conn = conn
+
+    async def _close(self, broken: bool):
+        conn, sa_conn = self._conn, self._sa_conn
+        self._conn = self._sa_conn = None
+        if conn is None:
+            return
+        try:
+            conn.remove_termination_listener(self._on_terminate)
+            if not broken:
+                await conn.remove_listener(self.channel, self._on_notify)
+            if sa_conn is not None:
+                if broken:
+                    await sa_conn.invalidate()  # оборванное соединение в пул не возвращаем
+                await sa_conn.close()
+            else:
+                await conn.close()
+        except Exception:
+            logger.debug("Соединение LISTEN закрылось с ошибкой", exc_info=True)
+
+    def _on_terminate(self, connection):
+        if connection is self._conn:
+            self._lost.set()
+
+    async def _alive(self) -> bool:
+        try:
+            async with self._lock:
+                await self._conn.execute("SELECT 1")
+            return True
+        except Exception:
+            return False
+
+    async def _watch(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._lost.wait(), CACHE_LISTEN_CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                if await self._alive():
+                    continue
+            await self._reconnect()
+
+    async def _reconnect(self):
+        logger.warning("Соединение LISTEN %s потеряно, переподключаемся", self.channel)
+        await self._close(broken=True)
+        delay = CACHE_RECONNECT_DELAY
+        while True:
+            try:
+                await self._listen()
+                break
+            except Exception as e:
+                await self._close(broken=True)
+                logger.warning("LISTEN %s: не удалось подключиться (%r), повтор через %.1f с", self.channel, e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+        self._lost.clear()
+        self.reconnects += 1
+        logger.info("LISTEN %s восстановлен", self.channel)
+        # Пока соединения не было, чужие инвалидации могли пройти мимо. Отзывы токенов
+        # тоже: сбрасываем кэш проверенных - каждый токен заново сверится с revoked_tokens
+        self._deliver(dict(RESYNC_ALL))
+        self._deliver({"kind": "token", "flush": True})
+
+    async def publish(self, message: dict):
+        self._deliver(message)
+        if self._conn is None:
+            return  # переподключаемся - другие воркеры догонят по TTL
+        try:
+            # Одно соединение и для LISTEN, и для NOTIFY - запросы по нему не параллелим
+            async with self._lock:
+                for payload in self._payloads(message):
+                    await self._conn.execute("SELECT pg_notify($1, $2)", self.channel, payload)
+        except Exception:
+            # Другие воркеры догонят по TTL; если умерло соединение - его поднимет _watch
+            logger.exception("Не удалось разослать инвалидацию %s", message)
+
+    def _payloads(self, message: dict) -> list:
+        """JSON для NOTIFY, каждый короче NOTIFY_PAYLOAD_LIMIT байт"""
+        message = {"origin": self.origin, **message}
+        payload = json.dumps(message)
+        if len(payload.encode()) < NOTIFY_PAYLOAD_LIMIT:
+            return [payload]
+
+        # Первый кусок несёт всё остальное (date, date_id, ...), следующие - только dates и event:
+        # каждая дата попадает ровно в один кусок, и событие по ней подписчики получат один раз
+        dates = message.pop("dates", [])
+        tail = {key: message[key] for key in ("origin", "kind", "event") if key in message}
+        payloads, chunk, head = [], [], message
+        size = len(json.dumps({**head, "dates": []}).encode())
+        for day in dates:
+            item = len(json.dumps(day).encode()) + 2  # ', '
+            if chunk and size + item >= NOTIFY_PAYLOAD_LIMIT:
+                payloads.append(json.dumps({**head, "dates": chunk}))
+                chunk, head = [], tail
+                size = len(json.dumps({**head, "dates": []}).encode())
+            chunk.append(day)
+            size += item
+        if chunk or not payloads:
+            payloads.append(json.dumps({**head, "dates": chunk}))
+
+        if any(len(p.encode()) >= NOTIFY_PAYLOAD_LIMIT for p in payloads):
+            if message.get("kind") != "schedule":
+                raise ValueError(f"Сообщение не влезает в NOTIFY: {len(payload.encode())} байт")
+            logger.warning("Инвалидация не влезает в NOTIFY (%s байт) - сбрасываем всё", len(payload.encode()))
+            return [json.dumps({"origin": self.origin, **RESYNC_ALL})]
+        return payloads
+
+    def _on_notify(self, connection, pid, channel, payload):
+        message = json.loads(payload)
+        if message.pop("origin", None) == self.origin:
+            return
+        self._deliver(message)
+
+
+def make_backend(name: str):
+    if name == "memory":
+        return InMemoryBackend()
+    if name == "postgres":
+        return PostgresNotifyBackend(CACHE_NOTIFY_CHANNEL)
+    raise ValueError(f"Неизвестный CACHE_BACKEND: {name!r}")
+
+
+schedule_cache = ScheduleCache(SCHEDULE_CACHE_SIZE, SCHEDULE_CACHE_TTL, SCHEDULE_CACHE_ENABLED)
+cache_backend = make_backend(CACHE_BACKEND)
+
+
+def _apply_schedule_invalidation(message: dict):
+    if message.get("kind") != "schedule":
+        return
+    if message.get("all"):
+        schedule_cache.clear()
+    if "date" in message:
+        schedule_cache.invalidate(date.fromisoformat(message["date"]))
+    for day in message.get("dates", ()):
+        schedule_cache.invalidate(date.fromisoformat(day))
+    if "date_id" in message:
+        schedule_cache.invalidate_date_id(message["date_id"])
+    if "lesson_id" in message:
+        schedule_cache.invalidate_lesson(message["lesson_id"])
+
+
+cache_backend.subscribe(_apply_schedule_invalidation)
+
+
+async def invalidate_schedule(day: Optional[date] = None, date_id: Optional[int] = None,
+                              lesson_id: Optional[int] = None, days: Optional[list] = None,
+                              event: Optional[dict] = None):
+    """Сбросить день (или дни) расписания во всех воркерах - вызывать ПОСЛЕ commit.
+
+    event - что именно поменялось; по тому же сообщению его получит лента изменений (events)
+    """
+    message = {"kind": "schedule"}
+    if day is not None:
+        message["date"] = day.isoformat()
+    if days:
+        message["dates"] = [d.isoformat() for d in days]
+    if event is not None:
+        message["event"] = event
+    if date_id is not None:
+        message["date_id"] = date_id
+    if lesson_id is not None:
+        message["lesson_id"] = lesson_id
+    await cache_backend.publish(message)
@@ -0,0 +1,90 @@
+"""Условные запросы: ETag / If-None-Match и Last-Modified / If-Modified-Since"""
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request
+
+
+def http_date(dt: datetime) -> str:
+    """datetime -> 'Wed, 21 Oct 2015 07:28:00 GMT' (наивное время считаем UTC)"""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return format_datetime(dt.astimezone(timezone.utc), usegmt=True)
+
+
+def parse_http_date(value: str) -> Optional[datetime]:
+    try:
+        dt = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+# Сжатый ответ - другое представление, и сильный ETag у него должен быть свой (RFC 9110, 8.8.3).
+# CompressionMiddleware дописывает к тегу суффикс кодировки: "abc" -> "abc-br"
+ETAG_CODING_SUFFIXES = ("-br", "-gzip")
+
+
+def encoded_etag(etag: str, coding: str) -> str:
+    """ETag представления, сжатого coding (br, gzip)"""
+    if not etag.endswith('"'):
+        return etag
+    return f'{etag[:-1]}-{coding}"'
+
+
+def _base_tag(tag: str) -> str:
+    tag = tag.strip().removeprefix("W/")
+    for suffix in ETAG_CODING_SUFFIXES:
+        if tag.endswith(suffix + '"'):
+            return tag[:-len(suffix) - 1] + '"'
+    return tag
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """Слабое сравнение для If-None-Match: W/ и суффикс сжатия не учитываем, '*' совпадает со всем"""
+    if header.strip() == "*":
+        return True
+    etag = _base_tag(etag)
+    return any(_base_tag(tag) == etag for tag in header.split(","))
+
+
+def holds_encoded(header: str, etag: str) -> bool:
+    """Есть ли в If-None-Match сжатый вариант etag - значит, представление сжимается"""
+    etag = _base_tag(etag)
+    for tag in header.split(","):
+        tag = tag.strip().removeprefix("W/")
+        if tag != _base_tag(tag) and _base_tag(tag) == etag:
+            return True
+    return False
+
+
+def has_validators(request: Request) -> bool:
+    return "if-none-match" in request.headers or "if-modified-since" in request.headers
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime] = None) -> bool:
+    """Можно ли ответить 304. If-None-Match главнее If-Modified-Since (RFC 9110, 13.2.2)"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    since = parse_http_date(if_modified_since)
+    if since is None:
+        return False
+    if last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    # В заголовке точность до секунды
+    return last_modified.replace(microsecond=0) <= since
+
+
+def validator_headers(etag: str, last_modified: Optional[datetime] = None) -> dict:
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
@@ -1,26 +1,95 @@
-print("🚨 LOADED CORRECT CRUDE.PY!!!")
-from sqlalchemy import select, and_
+from sqlalchemy import select, update, delete, func, and_, or_, literal, literal_column, null, text, union_all
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import joinedload, load_only
+from sqlalchemy.orm.attributes import set_committed_value
 from . import models
-from fastapi import UploadFile  # ✅ Фикс импорта
-import hashlib
+from . import cache, storage, passwords, jobs
+from collections import defaultdict
 import os
-from datetime import datetime
+import re
+
+# Пустых пар в новом дне (по сетке timetable.LESSON_TIMES)
+DEFAULT_LESSONS = 8
+
+
+def _insert(db: AsyncSession, model):
+    """INSERT с поддержкой ON CONFLICT под диалект сессии (Postgres, SQLite для локальных прогонов)"""
+    if db.get_bind().dialect.name == "sqlite":
+        return sqlite.insert(model)
+    return postgresql.insert(model)
+
+
+def _unique_violation(e: IntegrityError) -> bool:
+    """Нарушен именно UNIQUE (а не FK/NOT NULL): 23505 у Postgres, текст ошибки у SQLite"""
+    code = getattr(e.orig, "pgcode", None) or getattr(e.orig, "sqlstate", None)
+    return code == "23505" or "UNIQUE constraint failed" in str(e.orig)
+
+
+async def _acquire_blob(db: AsyncSession, sha256: str, size: int, count: int = 1):
+    """+count ссылок на блоб (создаёт строку, если такого содержимого ещё не было)"""
+    # До commit блоб не удалит задача unlink_blob - если его как раз освободили
+    await jobs.lock_blob(db, sha256)
+    stmt = _insert(db, models.Blob).values(sha256=sha256, size_bytes=size, refcount=count)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.Blob.sha256],
+        set_={"refcount": models.Blob.refcount + count},
+    )
+    await db.execute(stmt)
+
+
+async def _release_files(db: AsyncSession, files):
+    """-1 ссылка на блоб за каждый (уже удалённый в сессии или каскадом) файл.
+
+    Файлы без ссылок удаляются с диска задачами в той же транзакции (jobs) -
+    только если она закоммитится. После commit - jobs.worker.wake().
+    """
+    counts = defaultdict(int)
+    for file in files:
+        if file.blob_sha256:
+            counts[file.blob_sha256] += 1
+        elif file.filepath:
+            jobs.enqueue(db, "unlink_file", {"name": os.path.basename(file.filepath)})
+    
+    for sha256, n in counts.items():
+        stmt = (
+            update(models.Blob)
+            .where(models.Blob.sha256 == sha256)
+            .values(refcount=models.Blob.refcount - n)
+            .returning(models.Blob.refcount)
+            .execution_options(synchronize_session=False)
+        )
+        remaining = (await db.execute(stmt)).scalar_one_or_none()
+        if remaining is not None and remaining <= 0:
+            await db.execute(
+                delete(models.Blob).where(models.Blob.sha256 == sha256).execution_options(synchronize_session=False)
+            )
+            jobs.enqueue(db, "unlink_blob", {"sha256": sha256})
+
+
+async def revoke_token(db: AsyncSession, token_hash: str, expires_at):
+    """Запомнить отзыв токена в базе (повторный отзыв того же токена - не ошибка)"""
+    stmt = _insert(db, models.RevokedToken).values(token_hash=token_hash, expires_at=expires_at)
+    await db.execute(stmt.on_conflict_do_nothing(index_elements=["token_hash"]))
+    await db.commit()
+
+
+async def is_token_revoked(db: AsyncSession, token_hash: str) -> bool:
+    stmt = select(models.RevokedToken.token_hash).where(models.RevokedToken.token_hash == token_hash)
+    return (await db.execute(stmt)).first() is not None
 
 
 async def create_user(db: AsyncSession, username: str, name: str, password: str):
-    """Создать пользователя - ЧИСТЫЙ SHA256"""
+    """Создать пользователя - bcrypt в пуле потоков (см. passwords)"""
     stmt = select(models.User).where(models.User.username == username)
     result = await db.execute(stmt)
     if result.scalar_one_or_none():
         raise ValueError("Пользователь уже существует")
     
-    # 🔥 ОДИНАКОВЫЙ SHA256 ДЛЯ ВСЕГО
-    password_hash = hashlib.sha256(password.encode('utf-8')).hexdigest()
+    password_hash = await passwords.hash_password(password)
     
     user = models.User(username=username, name=name, password_hash=password_hash)
-    print(f"🔥 CREATE DEBUG: '{password}' -> '{password_hash}'")
-
     db.add(user)
     await db.commit()
     await db.refresh(user)
@@ -28,7 +97,7 @@ async def create_user(db: AsyncSession, username: str, name: str, password: str)
 
 
 async def authenticate_user(db: AsyncSession, username: str, password: str):
-    """Аутентификация - ТОТ ЖЕ SHA256"""
+    """Аутентификация. Старый SHA-256 хэш при удачном входе заменяется на bcrypt"""
     stmt = select(models.User).where(models.User.username == username)
     result = await db.execute(stmt)
     user = result.scalar_one_or_none()
@@ -36,41 +105,67 @@ async def authenticate_user(db: AsyncSession, username: str, password: str):
     if not user:
         raise ValueError("Пользователь не найден")
     
-    # 🔥 ТОТ ЖЕ SHA256
-    sha256_hash = hashlib.sha256(password.encode('utf-8')).hexdigest()
+    ok, new_hash = await passwords.verify_password(password, user.password_hash)
+    if not ok:
+        raise ValueError("Неверный пароль")
     
-    print(f"🔥 LOGIN DEBUG: DB='{user.password_hash[:10]}...', INPUT='{sha256_hash[:10]}...'")
-    if user.password_hash == sha256_hash:
+    if new_hash:
+        user.password_hash = new_hash
+        await db.commit()
+    return user
 
-        return user
-    
-    raise ValueError("Неверный пароль")
 
+async def create_file(db: AsyncSession, user_id: int, lesson_id: int, file: storage.ReceivedFile):
+    """Прикрепить файл из storage.receive_form: ссылка на блоб по sha256 (см. storage)"""
+    result = (await create_files(db, user_id, lesson_id, [file]))[0]
+    if isinstance(result, Exception):
+        raise result
+    return result
 
-async def create_file(db: AsyncSession, user_id: int, lesson_id: int, file: UploadFile):
-    """Загрузить файл"""
-    os.makedirs("/app/uploads", exist_ok=True)
-    
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    filename = f"{timestamp}_{file.filename}"
-    filepath = f"uploads/{filename}"
-    full_path = f"/app/uploads/{filename}"
-    
-    content = await file.read()
-    with open(full_path, "wb") as buffer:
-        buffer.write(content)
+
+async def create_files(db: AsyncSession, user_id: int, lesson_id: int, files: list) -> list:
+    """Прикрепить к паре файлы из storage.receive_form (уже на диске) - одной транзакцией.
+
+    По каждому файлу - models.File или ошибка (storage.FileTooLarge), такие просто не сохраняются.
+    При сбое базы не сохраняется ничего, временные файлы удаляются.
+    """
+    results = [file.result for file in files]
+    stored = [r for r in results if isinstance(r, storage.StoredUpload)]
+    if not stored:
+        return results
     
-    db_file = models.File(
-        user_id=user_id,
-        lesson_id=lesson_id,
-        filename=file.filename,
-        filepath=filepath,
-        size_bytes=len(content)
-    )
-    db.add(db_file)
+    try:
+        counts, sizes = defaultdict(int), {}
+        for upload in stored:
+            counts[upload.sha256] += 1
+            sizes[upload.sha256] = upload.size
+        # Блокировки блобов - всегда по порядку sha256, чтобы пачки не ждали друг друга по кругу
+        for sha256 in sorted(counts):
+            await _acquire_blob(db, sha256, sizes[sha256], counts[sha256])
+        
+        for i, (file, result) in enumerate(zip(files, results)):
+            if isinstance(result, storage.StoredUpload):
+                results[i] = models.File(
+                    user_id=user_id,
+                    lesson_id=lesson_id,
+                    blob_sha256=result.sha256,
+                    filename=file.filename,
+                    size_bytes=result.size
+                )
+        db_files = [r for r in results if isinstance(r, models.File)]
+        db.add_all(db_files)
+        day = await touch_lesson_date(db, lesson_id)
+        # Блобы кладём до commit: при сбое останутся лишние файлы (их уберёт jobs.gc), но не строки без файла
+        await storage.place_blobs(stored)
+    except BaseException:
+        await storage.discard_all(stored)
+        raise
     await db.commit()
-    await db.refresh(db_file)
-    return db_file
+    await cache.invalidate_schedule(day=day, lesson_id=lesson_id, event={
+        "type": "file", "action": "created", "lesson_id": lesson_id,
+        "file_ids": [f.id for f in db_files],
+    })
+    return results
 
 
 async def get_file(db: AsyncSession, file_id: int):
@@ -85,10 +180,327 @@ async def get_lessons_by_date(db: AsyncSession, date_id: int):
     return result.scalars().all()
 
 
-async def get_recent_dates(db: AsyncSession, limit: int = 30):
-    stmt = select(models.ScheduleDate).order_by(models.ScheduleDate.date.desc()).limit(limit)
+async def get_schedule_date(db: AsyncSession, target_date):
+    """Дата + пары (по lesson_number) + id файлов за два запроса, без N+1"""
+    stmt = (
+        select(models.ScheduleDate)
+        .where(models.ScheduleDate.date == target_date)
+        .options(
+            joinedload(models.ScheduleDate.lessons)
+            .selectinload(models.Lesson.files)
+            .load_only(models.File.id)
+        )
+        .execution_options(populate_existing=True)
+    )
     result = await db.execute(stmt)
-    return result.scalars().all()
+    return result.unique().scalar_one_or_none()
+
+
+async def get_schedule_range(db: AsyncSession, date_from, date_to):
+    """Все даты диапазона с парами и id файлов - всегда два запроса, сколько бы дней ни было"""
+    stmt = (
+        select(models.ScheduleDate)
+        .where(models.ScheduleDate.date.between(date_from, date_to))
+        .order_by(models.ScheduleDate.date)
+        .options(joinedload(models.ScheduleDate.lessons))
+        .execution_options(populate_existing=True)
+    )
+    dates = (await db.execute(stmt)).unique().scalars().all()
+    
+    # Файлы всего диапазона одним запросом, раскладываем по парам сами. Без ORDER BY:
+    # запрос идёт от дат к парам и файлам по индексам, а общий порядок по uploaded_at
+    # стоил бы сортировки во временном B-дереве - сортируем каждую пару уже здесь
+    files_stmt = (
+        select(models.File)
+        .join(models.File.lesson)
+        .join(models.Lesson.schedule_date)
+        .where(models.ScheduleDate.date.between(date_from, date_to))
+        .options(load_only(models.File.id, models.File.lesson_id, models.File.uploaded_at))
+    )
+    files_by_lesson = defaultdict(list)
+    for f in (await db.execute(files_stmt)).scalars():
+        files_by_lesson[f.lesson_id].append(f)
+    
+    for schedule_date in dates:
+        for lesson in schedule_date.lessons:
+            files = sorted(files_by_lesson.get(lesson.id, []), key=lambda f: (f.uploaded_at, f.id), reverse=True)
+            set_committed_value(lesson, "files", files)
+    return dates
+
+
+async def get_schedule_version(db: AsyncSession, target_date):
+    """Только id/version/updated_at даты - для дешёвой проверки If-None-Match"""
+    stmt = select(
+        models.ScheduleDate.id, models.ScheduleDate.version, models.ScheduleDate.updated_at
+    ).where(models.ScheduleDate.date == target_date)
+    result = await db.execute(stmt)
+    return result.one_or_none()
+
+
+async def touch_schedule_date(db: AsyncSession, date_id: int):
+    """Поднять version/updated_at дня. Вызывать в той же транзакции, что и само изменение.
+    Возвращает дату дня - для инвалидации и ленты изменений"""
+    stmt = (
+        update(models.ScheduleDate)
+        .where(models.ScheduleDate.id == date_id)
+        .values(version=models.ScheduleDate.version + 1, updated_at=func.now())
+        .returning(models.ScheduleDate.date)
+        .execution_options(synchronize_session=False)
+    )
+    return (await db.execute(stmt)).scalar_one_or_none()
+
+
+async def touch_lesson_date(db: AsyncSession, lesson_id: int):
+    """То же, но по id пары"""
+    date_id = select(models.Lesson.date_id).where(models.Lesson.id == lesson_id).scalar_subquery()
+    stmt = (
+        update(models.ScheduleDate)
+        .where(models.ScheduleDate.id == date_id)
+        .values(version=models.ScheduleDate.version + 1, updated_at=func.now())
+        .returning(models.ScheduleDate.date)
+        .execution_options(synchronize_session=False)
+    )
+    return (await db.execute(stmt)).scalar_one_or_none()
+
+
+async def get_or_create_schedule_date(db: AsyncSession, target_date, seed_lessons: bool = False) -> tuple:
+    """id дня, созданного при необходимости без гонок: INSERT ... ON CONFLICT DO NOTHING RETURNING.
+
+    seed_lessons - если в дне нет пар, добавить DEFAULT_LESSONS пустых одним многострочным INSERT.
+    Сам делает commit и инвалидацию, если что-то создал. Возвращает (date_id, создано ли что-то).
+    """
+    stmt = (
+        _insert(db, models.ScheduleDate)
+        .values(date=target_date, notes="")
+        .on_conflict_do_nothing(index_elements=[models.ScheduleDate.date])
+        .returning(models.ScheduleDate.id)
+    )
+    date_id = (await db.execute(stmt)).scalar_one_or_none()
+    created = date_id is not None
+    if not created:
+        # День уже был (или его только что создал параллельный запрос)
+        date_id = (await db.execute(
+            select(models.ScheduleDate.id).where(models.ScheduleDate.date == target_date)
+        )).scalar_one()
+    
+    seeded = False
+    if seed_lessons:
+        empty = created or (await db.execute(
+            select(models.Lesson.id).where(models.Lesson.date_id == date_id).limit(1)
+        )).first() is None
+        if empty:
+            stmt = (
+                _insert(db, models.Lesson)
+                .values([
+                    {"date_id": date_id, "lesson_number": i, "subject": f"Пара {i}", "teacher": "", "room": ""}
+                    for i in range(1, DEFAULT_LESSONS + 1)
+                ])
+                # Параллельный запрос успел засеять - его пары и остаются
+                .on_conflict_do_nothing(index_elements=[models.Lesson.date_id, models.Lesson.lesson_number])
+                .returning(models.Lesson.id)
+            )
+            seeded = len((await db.execute(stmt)).all()) > 0
+            if seeded and not created:
+                await touch_schedule_date(db, date_id)
+    
+    if created or seeded:
+        await db.commit()
+        await cache.invalidate_schedule(day=target_date, event={
+            "type": "date", "action": "seeded" if seeded else "created", "date_id": date_id,
+        })
+    return date_id, created or seeded
+
+
+async def import_lessons(db: AsyncSession, records: list) -> dict:
+    """Один батч импорта: upsert дат и пар многострочными INSERT ... ON CONFLICT, один commit.
+
+    records - dict'ы из timetable.iter_import. Неизменившиеся пары не трогаем (skipped).
+    """
+    # Внутри батча побеждает последняя строка с тем же (дата, номер)
+    by_key = {(r["date"], r["lesson_number"]): r for r in records}
+    days = {day for day, _ in by_key}
+    
+    stmt = (
+        _insert(db, models.ScheduleDate)
+        .values([{"date": day, "notes": ""} for day in days])
+        .on_conflict_do_nothing(index_elements=[models.ScheduleDate.date])
+        .returning(models.ScheduleDate.id)
+    )
+    dates_created = len((await db.execute(stmt)).all())
+    date_ids = dict((await db.execute(
+        select(models.ScheduleDate.date, models.ScheduleDate.id).where(models.ScheduleDate.date.in_(days))
+    )).all())
+    
+    existing = {
+        (row.date_id, row.lesson_number): (row.subject or "", row.teacher or "", row.room or "")
+        for row in await db.execute(
+            select(
+                models.Lesson.date_id, models.Lesson.lesson_number,
+                models.Lesson.subject, models.Lesson.teacher, models.Lesson.room,
+            ).where(models.Lesson.date_id.in_(date_ids.values()))
+        )
+    }
+    
+    rows = []
+    created = updated = skipped = 0
+    for (day, number), r in by_key.items():
+        key = (date_ids[day], number)
+        values = (r["subject"], r["teacher"], r["room"])
+        if key not in existing:
+            created += 1
+        elif existing[key] != values:
+            updated += 1
+        else:
+            skipped += 1
+            continue
+        rows.append({"date_id": key[0], "lesson_number": number,
+                     "subject": values[0], "teacher": values[1], "room": values[2]})
+    skipped += len(records) - len(by_key)
+    
+    touched = sorted({row["date_id"] for row in rows})
+    if rows:
+        stmt = _insert(db, models.Lesson).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[models.Lesson.date_id, models.Lesson.lesson_number],
+            set_={
+                "subject": stmt.excluded.subject,
+                "teacher": stmt.excluded.teacher,
+                "room": stmt.excluded.room,
+            },
+        )
+        await db.execute(stmt)
+        touched_days = (await db.execute(
+            update(models.ScheduleDate)
+            .where(models.ScheduleDate.id.in_(touched))
+            .values(version=models.ScheduleDate.version + 1, updated_at=func.now())
+            .returning(models.ScheduleDate.date)
+            .execution_options(synchronize_session=False)
+        )).scalars().all()
+    await db.commit()
+    if touched:
+        await cache.invalidate_schedule(days=touched_days, event={"type": "import"})
+    return {"dates_created": dates_created, "created": created, "updated": updated, "skipped": skipped}
+
+
+def schedule_export_query(date_from, date_to):
+    """Пары диапазона в порядке (дата, номер) для потоковой выгрузки.
+
+    План: диапазон по уникальному индексу schedule_dates.date, пары - по уникальному
+    (date_id, lesson_number), он же даёт нужный порядок внутри дня.
+    """
+    return (
+        select(
+            models.Lesson.id, models.ScheduleDate.date, models.Lesson.lesson_number,
+            models.Lesson.subject, models.Lesson.teacher, models.Lesson.room,
+        )
+        .join(models.Lesson, models.Lesson.date_id == models.ScheduleDate.id)
+        .where(models.ScheduleDate.date.between(date_from, date_to))
+        .order_by(models.ScheduleDate.date, models.Lesson.lesson_number)
+    )
+
+
+async def stream_schedule_rows(db: AsyncSession, date_from, date_to, partition_size: int = 1000):
+    """Серверный курсор (AsyncSession.stream): отдаёт партии строк, память не растёт с диапазоном"""
+    stmt = schedule_export_query(date_from, date_to).execution_options(yield_per=partition_size)
+    result = await db.stream(stmt)
+    async for partition in result.partitions():
+        yield partition
+
+
+async def get_dates_page(db: AsyncSession, limit: int = 30, before=None, date_from=None, date_to=None,
+                         aggregate: bool = False):
+    """Страница дней от новых к старым, keyset-курсор по date (before - последняя дата прошлой страницы).
+
+    aggregate - к каждому дню число пар, файлов и их суммарный размер, одним GROUP BY по странице.
+    """
+    D = models.ScheduleDate
+    page = select(D.id, D.date, D.notes, D.version, D.updated_at)
+    if before is not None:
+        page = page.where(D.date < before)
+    if date_from is not None:
+        page = page.where(D.date >= date_from)
+    if date_to is not None:
+        page = page.where(D.date <= date_to)
+    page = page.order_by(D.date.desc()).limit(limit)
+    if not aggregate:
+        return (await db.execute(page)).all()
+    
+    page = page.subquery("page")
+    stmt = (
+        select(
+            page,
+            func.count(models.Lesson.id.distinct()).label("lessons"),
+            func.count(models.File.id).label("files"),
+            func.coalesce(func.sum(models.File.size_bytes), 0).label("bytes"),
+        )
+        .outerjoin(models.Lesson, models.Lesson.date_id == page.c.id)
+        .outerjoin(models.File, models.File.lesson_id == models.Lesson.id)
+        .group_by(*page.c)
+        .order_by(page.c.date.desc())
+    )
+    return (await db.execute(stmt)).all()
+
+
+def search_words(query: str) -> list:
+    # Регистр не трогаем: to_tsquery приводит сам, а lower() в SQLite не знает кириллицы
+    return re.findall(r"\w+", query)
+
+
+async def search(db: AsyncSession, query: str, kind: str = "all", date_from=None, date_to=None,
+                 limit: int = 20, offset: int = 0):
+    """Пары (предмет/преподаватель/аудитория) и файлы по имени, от самых релевантных.
+
+    Postgres: слова и их префиксы через tsvector, опечатки и куски слов - через pg_trgm
+    (word_similarity), обе ветки по GIN-индексам из models. Другие базы - ILIKE по словам.
+    """
+    words = search_words(query)
+    postgres = db.get_bind().dialect.name == "postgresql"
+    if postgres:
+        tsquery = func.to_tsquery(text("'russian'"), " & ".join(f"{w}:*" for w in words))
+    
+    def branch(document, tsvector, *columns, joins):
+        if postgres:
+            # Скобки обязательны: у <% и || одинаковый приоритет
+            match = or_(tsvector.op("@@")(tsquery), literal(query).op("<%")(document.self_group()))
+            rank = func.ts_rank(tsvector, tsquery) + func.word_similarity(query, document)
+        else:
+            match = and_(*(document.ilike(f"%{w}%") for w in words))
+            rank = literal(0.0)
+        stmt = select(*columns, rank.label("rank"))
+        for target, on in joins:
+            stmt = stmt.join(target, on)
+        stmt = stmt.where(match)
+        if date_from is not None:
+            stmt = stmt.where(models.ScheduleDate.date >= date_from)
+        if date_to is not None:
+            stmt = stmt.where(models.ScheduleDate.date <= date_to)
+        return stmt
+    
+    L, F, D = models.Lesson, models.File, models.ScheduleDate
+    branches = []
+    if kind in ("all", "lessons"):
+        branches.append(branch(
+            models.LESSON_SEARCH_TEXT, models.LESSON_SEARCH_TSV,
+            literal_column("'lesson'").label("type"), L.id.label("id"), D.date, L.id.label("lesson_id"),
+            L.lesson_number, L.subject, L.teacher, L.room, null().label("filename"),
+            joins=[(D, L.date_id == D.id)],
+        ))
+    if kind in ("all", "files"):
+        branches.append(branch(
+            models.FILE_SEARCH_TEXT, models.FILE_SEARCH_TSV,
+            literal_column("'file'").label("type"), F.id.label("id"), D.date, L.id.label("lesson_id"),
+            L.lesson_number, L.subject, L.teacher, L.room, F.filename,
+            joins=[(L, F.lesson_id == L.id), (D, L.date_id == D.id)],
+        ))
+    
+    results = (union_all(*branches) if len(branches) > 1 else branches[0]).subquery("results")
+    stmt = (
+        select(results)
+        .order_by(results.c.rank.desc(), results.c.date.desc(), results.c.type, results.c.id)
+        .limit(limit)
+        .offset(offset)
+    )
+    return (await db.execute(stmt)).all()
 
 
 async def get_lesson_files(db: AsyncSession, lesson_id: int):
@@ -100,6 +512,11 @@ async def get_lesson_files(db: AsyncSession, lesson_id: int):
 async def create_lesson(db: AsyncSession, date_id: int, lesson_number: int, subject: str = "", teacher: str = "", room: str = ""):
 
         
+    # Сначала день: заодно проверяем, что он есть - иначе FK-ошибка выглядела бы как дубль пары
+    day = await touch_schedule_date(db, int(date_id))
+    if day is None:
+        await db.rollback()
+        raise LookupError(f"День с id={date_id} не найден")
     lesson = models.Lesson(
         date_id=int(date_id),
         lesson_number=int(lesson_number),
@@ -108,8 +525,17 @@ async def create_lesson(db: AsyncSession, date_id: int, lesson_number: int, subj
         room=room
     )
     db.add(lesson)
-    await db.commit()
+    try:
+        await db.commit()
+    except IntegrityError as e:
+        await db.rollback()
+        if not _unique_violation(e):
+            raise
+        raise ValueError(f"Пара №{lesson_number} на эту дату уже есть")
     await db.refresh(lesson)
+    await cache.invalidate_schedule(day=day, date_id=lesson.date_id, event={
+        "type": "lesson", "action": "created", "lesson_id": lesson.id, "lesson_number": lesson.lesson_number,
+    })
     return lesson
 
 
@@ -132,8 +558,13 @@ async def update_lesson(db: AsyncSession, lesson_id: int, subject: str = None, t
     if room is not None:
         lesson.room = room
     
+    day = await touch_schedule_date(db, lesson.date_id)
     await db.commit()
     await db.refresh(lesson)
+    await cache.invalidate_schedule(day=day, lesson_id=lesson_id, event={
+        "type": "lesson", "action": "updated", "lesson_id": lesson_id,
+        "subject": lesson.subject or "", "teacher": lesson.teacher or "", "room": lesson.room or "",
+    })
     return lesson
 
 
@@ -142,27 +573,36 @@ async def delete_file(db: AsyncSession, file_id: int):
     if not file:
         raise ValueError("Файл не найден")
     
-    full_path = f"/app/{file.filepath}"
-    if os.path.exists(full_path):
-        os.remove(full_path)
-    
+    lesson_id = file.lesson_id
     await db.delete(file)
+    await _release_files(db, [file])
+    day = await touch_lesson_date(db, lesson_id)
     await db.commit()
+    jobs.worker.wake()
+    await cache.invalidate_schedule(day=day, lesson_id=lesson_id, event={
+        "type": "file", "action": "deleted", "lesson_id": lesson_id, "file_id": file_id,
+    })
     return {"message": "Файл удалён"}
 
 
 async def delete_lesson(db: AsyncSession, lesson_id: int):
     lesson = await get_lesson(db, lesson_id)
     
-    files = await get_lesson_files(db, lesson_id)
-    for file in files:
-        full_path = f"/app/{file.filepath}"
-        if os.path.exists(full_path):
-            os.remove(full_path)
-        await db.delete(file)
+    # Строки files удалит ON DELETE CASCADE - здесь нужны только ссылки на блобы
+    files = (await db.execute(
+        select(models.File.blob_sha256, models.File.filepath).where(models.File.lesson_id == lesson_id)
+    )).all()
     
+    date_id = lesson.date_id
     await db.delete(lesson)
+    await db.flush()
+    await _release_files(db, files)
+    day = await touch_schedule_date(db, date_id)
     await db.commit()
+    jobs.worker.wake()
+    await cache.invalidate_schedule(day=day, date_id=date_id, event={
+        "type": "lesson", "action": "deleted", "lesson_id": lesson_id,
+    })
     return {"message": "Пара и файлы удалены"}
 
     
\ No newline at end of file
@@ -1,30 +1,173 @@
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 from contextlib import asynccontextmanager
+from collections import OrderedDict
+from typing import Optional
+import itertools
+import logging
 import os
+import time
+from . import cache, metrics, passwords
+
+logger = logging.getLogger(__name__)
 
 class Base(DeclarativeBase):  # ✅ Base сразу!
     pass
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Настройки движка. SQL-эхо по умолчанию выключено - под нагрузкой логирование каждого запроса дорого
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() in ("1", "true", "yes")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # сек. ожидания свободного соединения
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # сек., -1 - не пересоздавать
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# Кэш подготовленных запросов asyncpg на соединение; 0 - за pgbouncer в режиме transaction
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+# Таймауты запроса: на стороне клиента (сек.) и statement_timeout на сервере (мс), 0 - без ограничения
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "30"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+
+# Реплики только для чтения, через запятую. Пусто - всё читается с DATABASE_URL
+DATABASE_REPLICA_URLS = [u.strip() for u in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if u.strip()]
+# Столько секунд после своей записи пользователь читает с primary - реплика могла не догнать
+READ_YOUR_WRITES_WINDOW = float(os.getenv("READ_YOUR_WRITES_WINDOW", "5"))
+
+
+def engine_options(url: str) -> dict:
+    """Аргументы create_async_engine для url. У SQLite (бенчмарк, локальные опыты) свой пул -
+    размеры пула и настройки asyncpg к нему не относятся"""
+    options = {"echo": DB_ECHO}
+    if url.startswith("sqlite"):
+        # Писатель у SQLite один: остальные ждут блокировку до timeout, а не падают с "database is locked"
+        options["connect_args"] = {"timeout": 30}
+        return options
+
+    options.update(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+    if "+asyncpg" in url:
+        connect_args = {
+            # Кэш SQLAlchemy поверх asyncpg и кэш самого asyncpg - размер задаём обоим
+            "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+        }
+        if DB_COMMAND_TIMEOUT > 0:
+            connect_args["command_timeout"] = DB_COMMAND_TIMEOUT
+        if DB_STATEMENT_TIMEOUT_MS > 0:
+            connect_args["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
+        options["connect_args"] = connect_args
+    return options
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    # Без foreign_keys SQLite не выполняет ON DELETE CASCADE, WAL - читатели не ждут писателя
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+
+def make_engine(url: str):
+    engine = create_async_engine(url, **engine_options(url))
+    if url.startswith("sqlite"):
+        event.listen(engine.sync_engine, "connect", _sqlite_pragmas)
+    return engine
+
+
+class SessionRouter:
+    """Куда читать: реплики по кругу, но primary, если пользователь только что писал.
+
+    Отметки о записи рассылаются через cache.cache_backend, так что «липкость»
+    работает и когда следующий запрос попал в другой воркер.
+    """
+
+    def __init__(self, window: float, maxsize: int = 10000):
+        self.window = window
+        self.maxsize = maxsize
+        self._last_write = OrderedDict()  # user_id -> monotonic()
+        self._last_any_write = float("-inf")
+        self._replicas = []
+        self._cycle = None
+
+    def configure(self, replicas: list):
+        self._replicas = list(replicas)
+        self._cycle = itertools.cycle(self._replicas) if self._replicas else None
+
+    @property
+    def enabled(self) -> bool:
+        return self._cycle is not None
+
+    def mark_write(self, user_id: Optional[int] = None):
+        now = time.monotonic()
+        self._last_any_write = now
+        if user_id is None:
+            return
+        self._last_write[user_id] = now
+        self._last_write.move_to_end(user_id)
+        while len(self._last_write) > self.maxsize:
+            self._last_write.popitem(last=False)
+
+    def is_sticky(self, user_id: Optional[int]) -> bool:
+        last = self._last_write.get(user_id)
+        return last is not None and time.monotonic() - last < self.window
+
+    def replicas_may_lag(self) -> bool:
+        """Кто-то писал меньше window секунд назад - реплика может отдать старое"""
+        return time.monotonic() - self._last_any_write < self.window
+
+    def reader(self, user_id: Optional[int] = None):
+        """sessionmaker для чтения"""
+        if self._cycle is None or self.is_sticky(user_id):
+            return sessionmaker
+        return next(self._cycle)
+
+    def apply_message(self, message: dict):
+        if message.get("kind") == "write":
+            self.mark_write(message.get("user_id"))
+
+
+router = SessionRouter(READ_YOUR_WRITES_WINDOW)
+cache.cache_backend.subscribe(router.apply_message)
+
 engine = None
 sessionmaker = None
+replica_engines = []
 
 @asynccontextmanager
 async def lifespan(app):
     global engine, sessionmaker
-    print("🚀 STARTUP: Создаём asyncpg engine...")
-    engine = create_async_engine(DATABASE_URL, echo=True)
+    logger.info("Создаём engine (пул %s+%s)", DB_POOL_SIZE, DB_MAX_OVERFLOW)
+    engine = make_engine(DATABASE_URL)
     sessionmaker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    replica_engines[:] = [make_engine(url) for url in DATABASE_REPLICA_URLS]
+    router.configure([
+        async_sessionmaker(e, class_=AsyncSession, expire_on_commit=False, info={"replica": True})
+        for e in replica_engines
+    ])
+    for e in [engine, *replica_engines]:
+        metrics.instrument_engine(e)
     
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)  # ✅ Теперь Base существует!
-        print("✅ ТАБЛИЦЫ СОЗДАНЫ!")
+        logger.info("Таблицы созданы")
+    
+    await cache.cache_backend.start(engine)
     
     yield
     
-    print("🔌 SHUTDOWN...")
+    logger.info("Остановка")
+    await cache.cache_backend.stop()
+    passwords.shutdown()
+    router.configure([])
+    for replica in replica_engines:
+        await replica.dispose()
     await engine.dispose()
 
 async def get_db():
@@ -32,3 +175,39 @@ async def get_db():
         raise Exception("Database not initialized!")
     async with sessionmaker() as session:
         yield session
+
+
+def is_replica(session: AsyncSession) -> bool:
+    return session.info.get("replica", False)
+
+
+async def read_db(user_id: Optional[int] = None):
+    """Сессия для чтения: реплика или primary (см. SessionRouter)"""
+    if sessionmaker is None:
+        raise Exception("Database not initialized!")
+    async with router.reader(user_id)() as session:
+        yield session
+
+
+async def write_db(user_id: Optional[int] = None):
+    """Сессия primary для изменяющих запросов + отметка о записи для read-your-writes"""
+    if sessionmaker is None:
+        raise Exception("Database not initialized!")
+    router.mark_write(user_id)
+    try:
+        async with sessionmaker() as session:
+            yield session
+    finally:
+        # Окно отсчитываем от конца запроса и сообщаем остальным воркерам
+        if router.enabled:
+            await cache.cache_backend.publish({"kind": "write", "user_id": user_id})
+
+
+@asynccontextmanager
+async def primary_session(session: AsyncSession):
+    """Та же сессия, если она и так на primary, иначе - новая сессия primary"""
+    if not is_replica(session):
+        yield session
+        return
+    async with sessionmaker() as primary:
+        yield primary
@@ -0,0 +1,220 @@
+"""Отдача файлов пар: Range (в т.ч. несколько диапазонов), условные запросы, zero-copy.
+
+DOWNLOAD_MODE:
+- direct - байты отдаёт сам воркер (локальный запуск без nginx);
+- accel  - воркер только проверяет доступ и отвечает X-Accel-Redirect, файл
+           с тома загрузок отдаёт nginx (location ACCEL_REDIRECT_PREFIX в nginx.conf).
+"""
+import mimetypes
+import os
+import re
+import uuid
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from fastapi import Request, Response
+
+from . import conditional
+
+DOWNLOAD_MODE = os.getenv("DOWNLOAD_MODE", "direct")
+ACCEL_REDIRECT_PREFIX = os.getenv("ACCEL_REDIRECT_PREFIX", "/protected-uploads/")
+
+CHUNK_SIZE = 256 * 1024
+# Больше диапазонов в одном запросе не обслуживаем - отдаём файл целиком (RFC 9110 это разрешает)
+MAX_RANGES = 16
+
+_RANGE_RE = re.compile(r"^\s*(\d*)\s*-\s*(\d*)\s*$")
+
+
+def file_etag(size: int, sha256: Optional[str], mtime: float) -> str:
+    """Сильный валидатор: размер + хэш содержимого (у старых файлов без блоба - размер + mtime)"""
+    if sha256:
+        return f'"{size:x}-{sha256}"'
+    return f'"{size:x}-{int(mtime):x}"'
+
+
+def content_disposition(filename: str) -> str:
+    # ASCII-имя для старых клиентов + filename* с кириллицей для остальных (RFC 6266)
+    fallback = filename.encode("ascii", "ignore").decode().replace('"', "") or "file"
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
+
+
+def parse_range(header: str, size: int) -> Optional[List[Tuple[int, int]]]:
+    """'bytes=0-99,-500' -> [(0, 99), (size-500, size-1)].
+
+    None - заголовок не разобрать или диапазонов слишком много (отдаём весь файл),
+    [] - ни один диапазон не попадает в файл (416). Пересекающиеся и соседние
+    диапазоны склеиваются (RFC 9110, 14.2): 'bytes=0-,0-,0-' - один раз весь файл,
+    а не MAX_RANGES его копий в multipart/byteranges.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+    parts = spec.split(",")
+    if len(parts) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for part in parts:
+        match = _RANGE_RE.match(part)
+        if not match or match.groups() == ("", ""):
+            return None
+        first, last = match.groups()
+        if first == "":
+            # Суффикс: последние N байт
+            length = int(last)
+            if length == 0:
+                continue
+            ranges.append((max(size - length, 0), size - 1))
+            continue
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start >= size:
+            continue
+        end = int(last) if last else size - 1
+        ranges.append((start, min(end, size - 1)))
+    return _coalesce(ranges)
+
+
+def _coalesce(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class RangeFileResponse(Response):
+    """Файл целиком или его диапазоны.
+
+    Если сервер поддерживает ASGI-расширение http.response.zerocopysend, байты
+    уходят через sendfile, иначе читаем кусками в пуле потоков.
+    """
+
+    def __init__(self, path: str, ranges: List[Tuple[int, int]], size: int, status_code: int,
+                 headers: dict, media_type: str):
+        self.path = path
+        self.ranges = ranges
+        self.file_size = size
+        self.status_code = status_code
+        self.background = None
+        self.body = b""
+        self.parts = []
+
+        if len(ranges) > 1:
+            boundary = uuid.uuid4().hex
+            headers["Content-Type"] = f"multipart/byteranges; boundary={boundary}"
+            length = 0
+            for start, end in ranges:
+                head = (
+                    f"--{boundary}\r\nContent-Type: {media_type}\r\n"
+                    f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+                ).encode("latin-1")
+                self.parts.append((head, start, end))
+                length += len(head) + (end - start + 1) + 2
+            self.tail = f"--{boundary}--\r\n".encode("latin-1")
+            length += len(self.tail)
+        else:
+            start, end = ranges[0]
+            headers["Content-Type"] = media_type
+            if status_code == 206:
+                headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            self.parts.append((b"", start, end))
+            self.tail = b""
+            length = end - start + 1
+        headers["Content-Length"] = str(length)
+        self.init_headers(headers)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"] == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        zerocopy = "http.response.zerocopysend" in scope.get("extensions", {})
+        multipart = len(self.parts) > 1
+        async with await anyio.open_file(self.path, "rb") as f:
+            for head, start, end in self.parts:
+                if head:
+                    await send({"type": "http.response.body", "body": head, "more_body": True})
+                count = end - start + 1
+                if zerocopy:
+                    await send({
+                        "type": "http.response.zerocopysend",
+                        "file": f.wrapped,
+                        "offset": start,
+                        "count": count,
+                        "more_body": True,
+                    })
+                else:
+                    await f.seek(start)
+                    while count > 0:
+                        chunk = await f.read(min(CHUNK_SIZE, count))
+                        if not chunk:
+                            break
+                        count -= len(chunk)
+                        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                if multipart:
+                    await send({"type": "http.response.body", "body": b"\r\n", "more_body": True})
+        await send({"type": "http.response.body", "body": self.tail, "more_body": False})
+
+
+def _if_range_matches(value: str, etag: str, last_modified: datetime) -> bool:
+    value = value.strip()
+    if value.startswith('"') or value.startswith("W/"):
+        # If-Range требует сильного сравнения
+        return value == etag
+    since = conditional.parse_http_date(value)
+    return since is not None and last_modified.replace(microsecond=0) == since.replace(microsecond=0)
+
+
+def file_response(request: Request, path: str, filename: str, sha256: Optional[str] = None,
+                  uploaded_at: Optional[datetime] = None) -> Response:
+    """Ответ на скачивание: 200 / 206 / 304 / 416 по заголовкам запроса"""
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = file_etag(size, sha256, stat.st_mtime)
+    last_modified = uploaded_at or datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
+    if last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+    headers = {
+        "ETag": etag,
+        "Last-Modified": conditional.http_date(last_modified),
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": content_disposition(filename),
+    }
+    if conditional.is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    ranges = None
+    range_header = request.headers.get("range")
+    if range_header and size > 0:
+        if_range = request.headers.get("if-range")
+        if if_range is None or _if_range_matches(if_range, etag, last_modified):
+            ranges = parse_range(range_header, size)
+    if ranges == []:
+        headers["Content-Range"] = f"bytes */{size}"
+        return Response(status_code=416, headers=headers)
+
+    if not ranges:
+        if size == 0:
+            return Response(status_code=200, headers=headers, media_type=media_type)
+        return RangeFileResponse(path, [(0, size - 1)], size, 200, headers, media_type)
+    return RangeFileResponse(path, ranges, size, 206, headers, media_type)
+
+
+def accel_response(relpath: str, filename: str) -> Response:
+    """Пустой ответ с X-Accel-Redirect: тело, Range и If-Modified-Since обслуживает nginx"""
+    media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    headers = {
+        "X-Accel-Redirect": ACCEL_REDIRECT_PREFIX + quote(relpath),
+        "Content-Disposition": content_disposition(filename),
+    }
+    return Response(headers=headers, media_type=media_type)
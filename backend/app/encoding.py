@@ -0,0 +1,187 @@
+"""Кодирование ответов: JSON через orjson и сжатие gzip/brotli.
+
+JSONResponse кодирует payload сразу orjson'ом, а готовые bytes (закэшированное
+расписание) отдаёт как есть. Эндпоинты, которые возвращают её сами, обходят
+jsonable_encoder FastAPI: payload там и так из str/int/None.
+
+CompressionMiddleware (чистый ASGI) сжимает ответы с текстовым/JSON телом
+от COMPRESSION_MIN_SIZE байт, выбирая br или gzip по Accept-Encoding клиента.
+Не трогает SSE (text/event-stream - сжатие копило бы события в буфере),
+206 и любые ответы с Accept-Ranges (скачивание файлов: Range считается
+по исходным байтам), X-Accel-Redirect и уже сжатое. У сжатого ответа к ETag
+дописывается суффикс кодировки (conditional.encoded_etag) - conditional.etag_matches
+его снимает, так что If-None-Match с любым из вариантов даёт 304. Тела у 304 нет,
+поэтому суффикс ему ставим, если клиент прислал сжатый вариант тега: значит,
+200 на этот запрос тоже был бы сжат, и ETag должен совпасть с тем, что в кэше.
+"""
+import gzip
+import os
+import zlib
+
+import brotli
+import orjson
+from starlette.datastructures import MutableHeaders
+from starlette.responses import JSONResponse as StarletteJSONResponse
+
+from . import conditional
+
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "1").lower() not in ("0", "false", "no", "off")
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+# gzip 5 и brotli 4 - примерно одна цена по CPU, brotli при этом жмёт JSON заметно лучше
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "5"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+COMPRESSIBLE_TYPES = (b"application/json", b"text/", b"application/javascript", b"application/xml")
+
+
+def dumps(payload) -> bytes:
+    return orjson.dumps(payload)
+
+
+class JSONResponse(StarletteJSONResponse):
+    def render(self, content) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
+
+
+def choose_encoding(accept_encoding: str):
+    """br или gzip по Accept-Encoding (с учётом q=0), None - не сжимать"""
+    allowed = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        allowed[name.strip()] = q
+    for name in ("br", "gzip"):
+        if allowed.get(name, allowed.get("*", 0.0)) > 0:
+            return name
+    return None
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._brotli = None
+            self._zlib = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31 - заголовок gzip
+
+    def compress(self, data: bytes) -> bytes:
+        return self._brotli.process(data) if self._brotli else self._zlib.compress(data)
+
+    def finish(self) -> bytes:
+        return self._brotli.finish() if self._brotli else self._zlib.flush()
+
+
+def compress(encoding: str, data: bytes) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, GZIP_LEVEL, mtime=0)
+
+
+def _mark_encoded(headers: MutableHeaders, encoding: str):
+    headers["Content-Encoding"] = encoding
+    if "etag" in headers:
+        headers["ETag"] = conditional.encoded_etag(headers["etag"], encoding)
+
+
+def _compressible(status: int, headers: MutableHeaders) -> bool:
+    if not 200 <= status < 300 or status in (204, 206):
+        return False
+    if "content-encoding" in headers or "accept-ranges" in headers or "x-accel-redirect" in headers:
+        return False
+    content_type = headers.get("content-type", "").encode("latin-1").lower()
+    if content_type.startswith(b"text/event-stream"):
+        return False
+    return content_type.startswith(COMPRESSIBLE_TYPES) or b"+json" in content_type
+
+
+class CompressionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not COMPRESSION_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+        encoding = choose_encoding(accept_encoding) if accept_encoding else None
+        if_none_match = None
+        for name, value in scope["headers"]:
+            if name == b"if-none-match":
+                if_none_match = value.decode("latin-1")
+                break
+
+        start = None
+        compressor = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, compressor, passthrough
+            kind = message["type"]
+            if kind == "http.response.start":
+                headers = MutableHeaders(raw=message["headers"])
+                if message["status"] == 304 and if_none_match and "etag" in headers \
+                        and conditional.holds_encoded(if_none_match, headers["etag"]):
+                    headers.add_vary_header("Accept-Encoding")
+                    if encoding is not None:
+                        headers["ETag"] = conditional.encoded_etag(headers["etag"], encoding)
+                    passthrough = True
+                    await send(message)
+                    return
+                if _compressible(message["status"], headers):
+                    headers.add_vary_header("Accept-Encoding")
+                    if encoding is not None:
+                        # Решаем по первому куску тела
+                        start = message
+                        return
+                passthrough = True
+                await send(message)
+                return
+
+            if kind != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            headers = MutableHeaders(raw=start["headers"]) if start is not None else None
+
+            if start is not None and not more_body:
+                # Весь ответ одним куском (JSONResponse) - сжимаем целиком, если стоит того
+                if len(body) >= COMPRESSION_MIN_SIZE:
+                    body = compress(encoding, body)
+                    _mark_encoded(headers, encoding)
+                    headers["Content-Length"] = str(len(body))
+                    message = {**message, "body": body}
+                await send(start)
+                start = None
+                await send(message)
+                return
+
+            if start is not None:
+                # Поток (диапазон расписания, выгрузки): длина заранее неизвестна - жмём на лету
+                del headers["Content-Length"]
+                _mark_encoded(headers, encoding)
+                await send(start)
+                start = None
+                compressor = _Compressor(encoding)
+
+            data = compressor.compress(body)
+            if not more_body:
+                data += compressor.finish()
+            if data or not more_body:
+                await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,129 @@
+"""Лента изменений расписания для GET /schedule/stream (Server-Sent Events).
+
+Источник - те же сообщения об инвалидации, что рассылает cache.cache_backend после
+commit в crud: с бэкендом postgres они через LISTEN/NOTIFY доходят до каждого воркера,
+а воркер раздаёт их своим подписчикам на нужные даты.
+
+У каждого клиента своя ограниченная очередь. Медленный клиент не тормозит запись:
+если очередь переполнилась, накопленное выбрасывается и клиенту уходит одно событие
+resync - перезагрузить подписанные дни целиком. Тот же resync получают все клиенты
+воркера, если он мог пропустить изменения (обрыв LISTEN, см. cache.PostgresNotifyBackend).
+"""
+import asyncio
+import json
+import os
+from collections import defaultdict
+from typing import Iterable
+
+from . import cache
+
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "64"))
+EVENTS_MAX_CLIENTS = int(os.getenv("EVENTS_MAX_CLIENTS", "5000"))
+# Комментарий-пинг раз в столько секунд, чтобы прокси не закрывали простаивающее соединение
+EVENTS_KEEPALIVE = float(os.getenv("EVENTS_KEEPALIVE", "25"))
+# Дат в одной подписке
+EVENTS_MAX_DATES = 62
+
+
+class Subscription:
+    __slots__ = ("dates", "queue", "dropped")
+
+    def __init__(self, dates: frozenset, size: int):
+        self.dates = dates
+        self.queue = asyncio.Queue(size)
+        self.dropped = 0
+
+    def put(self, event: dict):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Клиент не успевает читать - вместо хвоста событий просим перечитать дни
+            self.dropped += self.queue.qsize()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync", "dates": sorted(self.dates)})
+
+
+class Broadcaster:
+    """Подписки воркера по датам (ISO-строки)"""
+
+    def __init__(self, queue_size: int = EVENTS_QUEUE_SIZE, max_clients: int = EVENTS_MAX_CLIENTS):
+        self.queue_size = queue_size
+        self.max_clients = max_clients
+        self._by_date = defaultdict(set)
+        self.clients = 0
+        self.published = 0
+
+    def full(self) -> bool:
+        return self.clients >= self.max_clients
+
+    def subscribe(self, dates: Iterable[str]) -> Subscription:
+        subscription = Subscription(frozenset(dates), self.queue_size)
+        for day in subscription.dates:
+            self._by_date[day].add(subscription)
+        self.clients += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        for day in subscription.dates:
+            subscribers = self._by_date.get(day)
+            if subscribers is None:
+                continue
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._by_date[day]
+        self.clients -= 1
+
+    def publish(self, day: str, event: dict):
+        for subscription in self._by_date.get(day, ()):
+            subscription.put({**event, "date": day})
+            self.published += 1
+
+    def publish_all(self, event: dict):
+        """Событие всем подписчикам сразу - каждому со списком его дат"""
+        subscriptions = set()
+        for subscribers in self._by_date.values():
+            subscriptions.update(subscribers)
+        for subscription in subscriptions:
+            subscription.put({**event, "dates": sorted(subscription.dates)})
+            self.published += 1
+
+    def apply_message(self, message: dict):
+        if message.get("kind") != "schedule" or "event" not in message:
+            return
+        if message.get("all"):
+            self.publish_all(message["event"])
+            return
+        days = list(message.get("dates", ()))
+        if "date" in message:
+            days.append(message["date"])
+        for day in days:
+            self.publish(day, message["event"])
+
+    def stats(self) -> dict:
+        return {"clients": self.clients, "dates": len(self._by_date), "published": self.published}
+
+
+broadcaster = Broadcaster()
+cache.cache_backend.subscribe(broadcaster.apply_message)
+
+
+def format_sse(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+async def stream(dates: Iterable[str]):
+    """Тело ответа text/event-stream. Подписка живёт ровно столько, сколько генератор:
+    отключение клиента отменяет его, и finally её снимает"""
+    subscription = broadcaster.subscribe(dates)
+    try:
+        yield "retry: 3000\n\n" + format_sse({"type": "ready", "dates": sorted(subscription.dates)})
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), EVENTS_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            yield format_sse(event)
+    finally:
+        broadcaster.unsubscribe(subscription)
@@ -0,0 +1,296 @@
+"""Фоновые задачи в таблице jobs: удаление файлов с диска и сборка мусора в UPLOAD_DIR.
+
+Задача ставится в той же транзакции, что и изменение в базе (enqueue), и
+выполняется только если та закоммитилась. Каждый воркер uvicorn крутит свой
+Worker: берёт задачи по одной через SELECT ... FOR UPDATE SKIP LOCKED, так что
+воркеры не мешают друг другу, а задача упавшего процесса вернётся в очередь
+вместе с откатом его транзакции. Ошибка - повтор с растущей задержкой, после
+JOBS_MAX_ATTEMPTS попыток задача остаётся в статусе failed (GET /jobs/stats,
+POST /jobs/{id}/retry).
+
+Обработчики идемпотентны: повторный запуск той же задачи ничего не ломает.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, func, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from . import models, storage
+
+logger = logging.getLogger(__name__)
+
+JOBS_ENABLED = os.getenv("JOBS_ENABLED", "1").lower() not in ("0", "false", "no", "off")
+JOBS_POLL_INTERVAL = float(os.getenv("JOBS_POLL_INTERVAL", "5"))
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "5"))
+JOBS_RETRY_DELAY = float(os.getenv("JOBS_RETRY_DELAY", "10"))  # сек., дальше x2 за попытку, максимум час
+# Сборка мусора в UPLOAD_DIR раз в столько секунд на весь кластер; 0 - не запускать
+JOBS_GC_INTERVAL = float(os.getenv("JOBS_GC_INTERVAL", "3600"))
+# Файлы моложе этого GC не трогает: загрузка кладёт блоб на диск до commit
+JOBS_GC_GRACE = float(os.getenv("JOBS_GC_GRACE", "3600"))
+# Выполненные задачи хранятся столько дней, упавшие - пока их не перезапустят
+JOBS_KEEP_DONE_DAYS = float(os.getenv("JOBS_KEEP_DONE_DAYS", "7"))
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def enqueue(db: AsyncSession, kind: str, payload: dict, delay: float = 0):
+    """Поставить задачу в транзакции db - выполнится после её commit (см. worker.wake)"""
+    now = _now()
+    db.add(models.Job(kind=kind, payload=payload, run_at=now + timedelta(seconds=delay), created_at=now))
+
+
+async def lock_blob(db: AsyncSession, sha256: str):
+    """Блокировка блоба до конца транзакции (Postgres). Её держат create_file от ссылки на блоб
+    до commit и unlink_blob от проверки до удаления - файл не удалится из-под новой загрузки"""
+    if db.get_bind().dialect.name != "postgresql":
+        return  # SQLite и так пускает одного писателя за раз
+    await db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": int(sha256[:15], 16)})
+
+
+# --- Обработчики: async (db, payload) -> результат для jobs.result ---
+
+async def unlink_blob(db: AsyncSession, payload: dict):
+    """Удалить блоб с диска, если на него так и не появилось ссылки"""
+    sha256 = payload["sha256"]
+    await lock_blob(db, sha256)
+    if await db.get(models.Blob, sha256) is not None:
+        return {"kept": True}  # то же содержимое успели загрузить заново
+    await run_in_threadpool(storage.unlink, storage.blob_path(sha256))
+    return {"kept": False}
+
+
+async def _legacy_names(db: AsyncSession) -> set:
+    rows = await db.execute(select(models.File.filepath).where(models.File.filepath.is_not(None)))
+    return {os.path.basename(filepath) for filepath in rows.scalars()}
+
+
+async def unlink_file(db: AsyncSession, payload: dict):
+    """Удалить старый файл (без блоба) из UPLOAD_DIR, если на него не ссылается ни одна строка"""
+    name = os.path.basename(payload["name"])
+    if name in await _legacy_names(db):
+        return {"kept": True}
+    await run_in_threadpool(storage.unlink, os.path.join(storage.UPLOAD_DIR, name))
+    return {"kept": False}
+
+
+async def gc(db: AsyncSession, payload: dict):
+    """Сверка UPLOAD_DIR с базой: на лишние файлы ставит unlink-задачи, недописанные
+    загрузки удаляет, блобы без файла на диске считает (и пишет в лог), старые задачи
+    и истёкшие отзывы токенов чистит"""
+    listing = await run_in_threadpool(storage.scan_uploads, JOBS_GC_GRACE)
+    report = {"orphan_blobs": 0, "orphan_files": 0, "stale_uploads": 0, "missing_blobs": 0, "pruned_jobs": 0,
+              "pruned_revocations": 0}
+
+    for path in listing.stale_uploads:
+        await run_in_threadpool(storage.unlink, path)
+    report["stale_uploads"] = len(listing.stale_uploads)
+
+    for prefix, (on_disk, old) in listing.blobs.items():
+        known = set((await db.execute(
+            select(models.Blob.sha256)
+            .where(models.Blob.sha256 >= prefix, models.Blob.sha256 < prefix + "g")
+        )).scalars())
+        for sha256 in sorted(old - known):
+            enqueue(db, "unlink_blob", {"sha256": sha256})
+            report["orphan_blobs"] += 1
+        # Мог появиться уже после обхода каталога - проверяем ещё раз
+        missing = [sha256 for sha256 in known - on_disk if not os.path.exists(storage.blob_path(sha256))]
+        if missing:
+            report["missing_blobs"] += len(missing)
+            logger.warning("Блобы без файла на диске: %s", ", ".join(sorted(missing)[:20]))
+
+    if listing.legacy:
+        legacy = await _legacy_names(db)
+        for name in sorted(set(listing.legacy) - legacy):
+            enqueue(db, "unlink_file", {"name": name})
+            report["orphan_files"] += 1
+
+    result = await db.execute(
+        delete(models.Job)
+        .where(models.Job.status == "done", models.Job.finished_at < _now() - timedelta(days=JOBS_KEEP_DONE_DAYS))
+        .execution_options(synchronize_session=False)
+    )
+    report["pruned_jobs"] = result.rowcount
+    result = await db.execute(
+        delete(models.RevokedToken)
+        .where(models.RevokedToken.expires_at < _now())
+        .execution_options(synchronize_session=False)
+    )
+    report["pruned_revocations"] = result.rowcount
+    logger.info("Сборка мусора в %s: %s", storage.UPLOAD_DIR, report)
+    return report
+
+
+HANDLERS = {
+    "unlink_blob": unlink_blob,
+    "unlink_file": unlink_file,
+    "gc": gc,
+}
+
+
+def retry_delay(attempts: int) -> float:
+    return min(JOBS_RETRY_DELAY * 2 ** (attempts - 1), 3600)
+
+
+class Worker:
+    def __init__(self):
+        self._sessionmaker = None
+        self._task = None
+        self._wake = asyncio.Event()
+        self._next_gc_check = 0.0
+        self.processed = defaultdict(int)  # kind -> выполнено этим процессом
+        self.errors = defaultdict(int)  # kind -> неудачных попыток
+        self.last_error = None
+
+    def start(self, sessionmaker):
+        if not JOBS_ENABLED:
+            return
+        self._sessionmaker = sessionmaker
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def wake(self):
+        """Есть новые задачи (после commit) - не ждать следующего опроса"""
+        self._wake.set()
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                await self._maybe_schedule_gc()
+                while await self.run_one():
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Очередь задач: ошибка опроса")
+            try:
+                await asyncio.wait_for(self._wake.wait(), JOBS_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _maybe_schedule_gc(self):
+        if not JOBS_GC_INTERVAL or time.monotonic() < self._next_gc_check:
+            return
+        self._next_gc_check = time.monotonic() + min(JOBS_GC_INTERVAL, 300)
+        async with self._sessionmaker() as db:
+            last = (await db.execute(select(func.max(models.Job.created_at)).where(models.Job.kind == "gc"))).scalar()
+            if last is None or last <= _now() - timedelta(seconds=JOBS_GC_INTERVAL):
+                enqueue(db, "gc", {})
+                await db.commit()
+
+    async def run_one(self) -> bool:
+        """Выполнить одну готовую задачу. False - очередь пуста"""
+        async with self._sessionmaker() as db:
+            job = (await db.execute(
+                select(models.Job)
+                .where(models.Job.status == "pending", models.Job.run_at <= _now())
+                .order_by(models.Job.run_at, models.Job.id)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )).scalar_one_or_none()
+            if job is None:
+                return False
+
+            job_id, kind, attempts = job.id, job.kind, job.attempts + 1
+            try:
+                handler = HANDLERS.get(kind)
+                if handler is None:
+                    raise ValueError(f"Неизвестный тип задачи: {kind}")
+                result = await handler(db, job.payload)
+            except Exception as e:
+                await db.rollback()
+                await self._record_failure(db, job_id, kind, attempts, e)
+                return True
+
+            job.status = "done"
+            job.attempts = attempts
+            job.finished_at = _now()
+            job.result = result
+            await db.commit()
+            self.processed[kind] += 1
+            return True
+
+    async def _record_failure(self, db: AsyncSession, job_id: int, kind: str, attempts: int, error: Exception):
+        self.errors[kind] += 1
+        self.last_error = f"{kind} #{job_id}: {error!r}"[:1000]
+        values = {"attempts": attempts, "last_error": repr(error)[:1000]}
+        if attempts >= JOBS_MAX_ATTEMPTS:
+            values.update(status="failed", finished_at=_now())
+            logger.error("Задача %s #%s не выполнена за %s попыток: %r", kind, job_id, attempts, error)
+        else:
+            values["run_at"] = _now() + timedelta(seconds=retry_delay(attempts))
+            logger.warning("Задача %s #%s, попытка %s: %r", kind, job_id, attempts, error)
+        await db.execute(
+            update(models.Job)
+            .where(models.Job.id == job_id, models.Job.status == "pending")
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None,
+            "processed": dict(self.processed),
+            "errors": dict(self.errors),
+            "last_error": self.last_error,
+        }
+
+
+worker = Worker()
+
+
+async def queue_stats(db: AsyncSession, failed_limit: int = 20) -> dict:
+    """Состояние очереди в базе (на весь кластер) + последние упавшие задачи"""
+    rows = await db.execute(
+        select(models.Job.kind, models.Job.status, func.count()).group_by(models.Job.kind, models.Job.status)
+    )
+    counts = defaultdict(dict)
+    for kind, status, count in rows:
+        counts[kind][status] = count
+    oldest = (await db.execute(
+        select(func.min(models.Job.run_at)).where(models.Job.status == "pending", models.Job.run_at <= _now())
+    )).scalar()
+    failed = (await db.execute(
+        select(models.Job).where(models.Job.status == "failed")
+        .order_by(models.Job.finished_at.desc()).limit(failed_limit)
+    )).scalars()
+    return {
+        "counts": dict(counts),
+        "oldest_ready_seconds": round((_now() - oldest).total_seconds(), 1) if oldest else 0,
+        "failed": [
+            {"id": j.id, "kind": j.kind, "payload": j.payload, "attempts": j.attempts,
+             "last_error": j.last_error, "finished_at": j.finished_at.isoformat()}
+            for j in failed
+        ],
+    }
+
+
+async def retry(db: AsyncSession, job_id: int) -> bool:
+    """Вернуть упавшую задачу в очередь с нуля попыток"""
+    result = await db.execute(
+        update(models.Job)
+        .where(models.Job.id == job_id, models.Job.status == "failed")
+        .values(status="pending", attempts=0, run_at=_now(), finished_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount > 0
@@ -1,18 +1,30 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, Query, Request, Response
+from fastapi.security import HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from datetime import date
-import re
-from . import database, models, auth, crud
-
-from fastapi.responses import FileResponse
+from datetime import date, datetime, timezone
+from . import database, models, auth, crud, conditional, storage, downloads, timetable, events, metrics, encoding, schemas, jobs
+from .cache import schedule_cache
+
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
+import hashlib
 import os
+from typing import List, NamedTuple
+
 
 
+@asynccontextmanager
+async def lifespan(app):
+    """База + фоновые задачи (удаление файлов, сборка мусора) в каждом воркере"""
+    async with database.lifespan(app):
+        jobs.worker.start(database.sessionmaker)
+        yield
+        await jobs.worker.stop()
 
-app = FastAPI(title="Расписание ВГУ", lifespan=database.lifespan)
+
+app = FastAPI(title="Расписание ВГУ", lifespan=lifespan, default_response_class=encoding.JSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -20,37 +32,98 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
+# +1 МБ на заголовки частей multipart
+app.add_middleware(storage.MaxBodySizeMiddleware, max_size=storage.MAX_UPLOAD_SIZE + 1024 * 1024)
+# Внутри метрик: в байты ответа идёт то, что ушло в сеть
+app.add_middleware(encoding.CompressionMiddleware)
+# Снаружи всех - чтобы в метрики попадали и отказы 413
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Строк импорта на одну транзакцию (и один многострочный INSERT)
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+IMPORT_MAX_ERRORS = 100
+
+# Ограничение ширины GET /schedule?from=&to= и порог, после которого ответ отдаётся потоком
+MAX_SCHEDULE_RANGE_DAYS = int(os.getenv("MAX_SCHEDULE_RANGE_DAYS", "366"))
+SCHEDULE_STREAM_THRESHOLD_DAYS = int(os.getenv("SCHEDULE_STREAM_THRESHOLD_DAYS", "31"))
+# Максимум дней на страницу GET /dates и результатов на страницу GET /search
+DATES_MAX_LIMIT = 366
+SEARCH_MAX_LIMIT = 100
+# Файлов в одной пакетной загрузке POST /upload
+UPLOAD_MAX_FILES = int(os.getenv("UPLOAD_MAX_FILES", "100"))
+
+get_db = database.get_db
+
+async def get_read_db(user_id: int = Depends(auth.current_user_id)) -> AsyncSession:
+    """Чтение: реплика, а сразу после своей записи - primary"""
+    async for session in database.read_db(user_id):
+        yield session
 
-security = HTTPBearer()
-
-async def get_db() -> AsyncSession:
-    async with database.sessionmaker() as session:
+async def get_write_db(user_id: int = Depends(auth.current_user_id)) -> AsyncSession:
+    """Изменения: всегда primary"""
+    async for session in database.write_db(user_id):
         yield session
 
 def parse_date(date_str: str) -> date:
     """Парсит ЛЮБОЙ формат: DD.MM.YYYY, YYYY-MM-DD, YYYY.MM.DD"""
-    date_str = date_str.strip()
-    
-    # YYYY-MM-DD (ISO)
     try:
-        return date.fromisoformat(date_str)
-    except ValueError:
-        pass
-    
-    # DD.MM.YYYY
-    match = re.match(r'(\d{1,2})\.(\d{1,2})\.(\d{4})', date_str)
-    if match:
-        day, month, year = map(int, match.groups())
-        return date(year, month, day)
-    
-    # YYYY.MM.DD
-    match = re.match(r'(\d{4})\.(\d{1,2})\.(\d{1,2})', date_str)
-    if match:
-        year, month, day = map(int, match.groups())
-        return date(year, month, day)
-    
-    raise HTTPException(400, f"Неверный формат даты: '{date_str}'. Используй DD.MM.YYYY, YYYY-MM-DD или YYYY.MM.DD")
+        return timetable.parse_day(date_str)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+def schedule_to_dict(schedule_date: models.ScheduleDate) -> dict:
+    """Ответ расписания из уже загруженных пар и файлов (см. crud.get_schedule_date)"""
+    return {
+        "date": schedule_date.date.isoformat(),
+        "notes": schedule_date.notes or "",
+        "lessons": [
+            {
+                "id": l.id,
+                "lesson_number": l.lesson_number,
+                "subject": l.subject or "",
+                "teacher": l.teacher or "",
+                "room": l.room or "",
+                "files": [f.id for f in l.files]
+            } for l in schedule_date.lessons
+        ]
+    }
+
+def schedule_etag(date_id: int, version: int) -> str:
+    return f'"{date_id}-{version}"'
+
+class ScheduleEntry(NamedTuple):
+    """Ответ дня для кэша: JSON закодирован один раз, попадание в кэш его не сериализует"""
+    body: bytes
+    etag: str
+    last_modified: datetime
+    lessons: int
+
+def schedule_entry(schedule_date: models.ScheduleDate) -> ScheduleEntry:
+    return ScheduleEntry(
+        encoding.dumps(schedule_to_dict(schedule_date)),
+        schedule_etag(schedule_date.id, schedule_date.version),
+        schedule_date.updated_at,
+        len(schedule_date.lessons),
+    )
+
+def remember_schedule(target_date: date, schedule_date: models.ScheduleDate, generation: int) -> ScheduleEntry:
+    """schedule_entry + кладём его в кэш расписания"""
+    entry = schedule_entry(schedule_date)
+    lesson_ids = [l.id for l in schedule_date.lessons]
+    schedule_cache.set(target_date, schedule_date.id, lesson_ids, entry, generation)
+    return entry
+
+def conditional_json(payload, etag: str, last_modified=None, request: Request = None) -> Response:
+    """JSON (или уже закодированный bytes) с ETag/Last-Modified, либо 304 если у клиента актуальная копия"""
+    headers = conditional.validator_headers(etag, last_modified)
+    if request is not None and conditional.is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    return encoding.JSONResponse(payload, headers=headers)
+
+def schedule_response(entry: ScheduleEntry, request: Request = None) -> Response:
+    return conditional_json(entry.body, entry.etag, entry.last_modified, request)
 
 @app.get("/")
 async def root():
@@ -86,177 +159,401 @@ async def login(
         raise HTTPException(401, "Неверные данные")
 
 
-@app.get("/schedule/{date_str}")
+@app.post("/logout")
+async def logout(credentials: HTTPAuthorizationCredentials = Depends(auth.security)):
+    """Выйти: токен отзывается во всех воркерах"""
+    await auth.verify_token(credentials.credentials)
+    await auth.revoke_token(credentials.credentials)
+    return {"message": "Токен отозван"}
+
+@app.get("/schedule", responses={200: {"model": List[schemas.ScheduleOut]}})
+async def get_schedule_range(
+    date_from: str = Query(..., alias="from"),
+    date_to: str = Query(..., alias="to"),
+    user_id: int = Depends(auth.current_user_id),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Расписание за диапазон дат (неделя, месяц, семестр)"""
+    start = parse_date(date_from)
+    end = parse_date(date_to)
+    
+    if start > end:
+        raise HTTPException(400, "Дата 'from' позже даты 'to'")
+    days = (end - start).days + 1
+    if days > MAX_SCHEDULE_RANGE_DAYS:
+        raise HTTPException(400, f"Слишком широкий диапазон: {days} дн., максимум {MAX_SCHEDULE_RANGE_DAYS}")
+    
+    dates = await crud.get_schedule_range(db, start, end)
+    if days <= SCHEDULE_STREAM_THRESHOLD_DAYS:
+        return encoding.JSONResponse([schedule_to_dict(d) for d in dates])
+    
+    # Длинный диапазон: данные уже в памяти, но JSON кодируем и отдаём по одному дню
+    async def stream():
+        yield b"["
+        for i, d in enumerate(dates):
+            yield (b"," if i else b"") + encoding.dumps(schedule_to_dict(d))
+        yield b"]"
+    
+    return StreamingResponse(stream(), media_type="application/json")
+
+def export_range(date_from: str, date_to: str) -> tuple:
+    start = parse_date(date_from)
+    end = parse_date(date_to)
+    if start > end:
+        raise HTTPException(400, "Дата 'from' позже даты 'to'")
+    return start, end
+
+async def export_chunks(start: date, end: date, render, user_id: int):
+    """Партии строк выгрузки -> куски ответа. Своя сессия: зависимость get_db
+    закрывается раньше, чем StreamingResponse дочитает курсор"""
+    async with database.router.reader(user_id)() as session:
+        async for rows in crud.stream_schedule_rows(session, start, end):
+            yield render(rows)
+
+@app.get("/schedule/export.ics")
+async def export_schedule_ics(
+    date_from: str = Query(..., alias="from"),
+    date_to: str = Query(..., alias="to"),
+    user_id: int = Depends(auth.current_user_id)
+):
+    """Выгрузка расписания в iCal для календарей - потоком, любой диапазон"""
+    start, end = export_range(date_from, date_to)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    
+    async def body():
+        yield timetable.ics_header()
+        async for chunk in export_chunks(start, end, lambda rows: "".join(
+            timetable.ics_event(r.id, r.date, r.lesson_number, r.subject, r.teacher, r.room, stamp) for r in rows
+        ), user_id):
+            yield chunk
+        yield timetable.ics_footer()
+    
+    headers = {"Content-Disposition": f'attachment; filename="schedule_{start}_{end}.ics"'}
+    return StreamingResponse(body(), media_type="text/calendar; charset=utf-8", headers=headers)
+
+@app.get("/schedule/export.csv")
+async def export_schedule_csv(
+    date_from: str = Query(..., alias="from"),
+    date_to: str = Query(..., alias="to"),
+    user_id: int = Depends(auth.current_user_id)
+):
+    """Выгрузка расписания в CSV (колонки как у импорта) - потоком, любой диапазон"""
+    start, end = export_range(date_from, date_to)
+    
+    async def body():
+        # BOM - чтобы Excel сразу открыл кириллицу
+        yield "\ufeff" + ",".join(timetable.EXPORT_COLUMNS) + "\r\n"
+        async for chunk in export_chunks(start, end, timetable.csv_rows, user_id):
+            yield chunk
+    
+    headers = {"Content-Disposition": f'attachment; filename="schedule_{start}_{end}.csv"'}
+    return StreamingResponse(body(), media_type="text/csv; charset=utf-8", headers=headers)
+
+@app.post("/schedule/stream/ticket")
+async def schedule_stream_ticket(user_id: int = Depends(auth.current_user_id)):
+    """Короткоживущий билет для GET /schedule/stream?ticket= - сам токен в URL не кладём"""
+    return {"ticket": auth.create_stream_ticket(user_id), "expires_in": auth.STREAM_TICKET_TTL}
+
+@app.get("/schedule/stream")
+async def schedule_stream(
+    dates: str = Query(..., description="Даты через запятую"),
+    user_id: int = Depends(auth.stream_user_id)
+):
+    """Лента изменений пар, файлов и дней (SSE) вместо опроса.
+
+    События: lesson / file / date / import с полем date, resync - перечитать дни целиком.
+    """
+    days = sorted({parse_date(d).isoformat() for d in dates.split(",") if d.strip()})
+    if not days:
+        raise HTTPException(400, "Нужна хотя бы одна дата")
+    if len(days) > events.EVENTS_MAX_DATES:
+        raise HTTPException(400, f"Слишком много дат, максимум {events.EVENTS_MAX_DATES}")
+    if events.broadcaster.full():
+        raise HTTPException(503, "Слишком много подписчиков, попробуйте позже")
+    
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(events.stream(days), media_type="text/event-stream", headers=headers)
+
+@app.get("/schedule/{date_str}", responses={200: {"model": schemas.ScheduleOut}})
 async def get_schedule(
     date_str: str,
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: AsyncSession = Depends(get_db)
+    request: Request,
+    user_id: int = Depends(auth.current_user_id),
+    db: AsyncSession = Depends(get_read_db)
 ):
-    auth.verify_token(credentials.credentials)
     target_date = parse_date(date_str)
     
+    cached = schedule_cache.get(target_date)
+    if cached is not None:
+        return schedule_response(cached, request)
+    generation = schedule_cache.generation()
+    
+    # Клиент прислал свою версию - сверяем её без загрузки пар
+    if conditional.has_validators(request):
+        current = await crud.get_schedule_version(db, target_date)
+        if current is not None:
+            etag = schedule_etag(current.id, current.version)
+            if conditional.is_not_modified(request, etag, current.updated_at):
+                return Response(status_code=304, headers=conditional.validator_headers(etag, current.updated_at))
+    
     # Найди/создай дату
-    stmt = select(models.ScheduleDate).where(models.ScheduleDate.date == target_date)
-    result = await db.execute(stmt)
-    schedule_date = result.scalar_one_or_none()
+    schedule_date = await crud.get_schedule_date(db, target_date)
     
     if not schedule_date:
-        schedule_date = models.ScheduleDate(date=target_date)
-        db.add(schedule_date)
-        await db.commit()
-        await db.refresh(schedule_date)
-    
-    # Получи уроки
-    lessons = await crud.get_lessons_by_date(db, schedule_date.id)
+        # Реплика могла ещё не получить этот день - проверяем и создаём на primary
+        async with database.primary_session(db) as primary:
+            await crud.get_or_create_schedule_date(primary, target_date)
+            generation = schedule_cache.generation()
+            schedule_date = await crud.get_schedule_date(primary, target_date)
+    elif database.is_replica(db) and database.router.replicas_may_lag():
+        # Недавняя запись могла не доехать до реплики - в общий кэш такое не кладём
+        return schedule_response(schedule_entry(schedule_date), request)
     
-    return {
-        "date": target_date.isoformat(),
-        "notes": schedule_date.notes or "",
-        "lessons": [
-            {
-                "id": l.id,
-                "lesson_number": l.lesson_number,
-                "subject": l.subject or "",
-                "teacher": l.teacher or "",
-                "room": l.room or "",
-                "files": [f.id for f in await crud.get_lesson_files(db, l.id)]
-            } for l in lessons
-        ]
+    return schedule_response(remember_schedule(target_date, schedule_date, generation), request)
+
+@app.get("/cache/stats")
+async def get_cache_stats(
+    user_id: int = Depends(auth.current_user_id)
+):
+    """Счётчики кэша расписания: попадания, промахи, вытеснения (+ подписчики ленты изменений)"""
+    return {**schedule_cache.stats(), "stream": events.broadcaster.stats()}
+
+@app.get("/metrics")
+async def get_metrics():
+    """Метрики воркера в формате Prometheus. Снаружи закрыто в nginx - скрейпить backend:8000 напрямую"""
+    stats = schedule_cache.stats()
+    stream = events.broadcaster.stats()
+    pool = database.engine.pool if database.engine is not None else None
+    extra = {
+        "schedule_cache_hits": ("Schedule cache hits", stats["hits"]),
+        "schedule_cache_misses": ("Schedule cache misses", stats["misses"]),
+        "schedule_cache_entries": ("Schedule cache entries", stats["size"]),
+        "schedule_stream_clients": ("SSE subscribers", stream["clients"]),
     }
+    worker = jobs.worker.stats()
+    extra["jobs_processed"] = ("Background jobs done by this worker", sum(worker["processed"].values()))
+    extra["jobs_errors"] = ("Failed background job attempts in this worker", sum(worker["errors"].values()))
+    if pool is not None and hasattr(pool, "overflow"):
+        extra["db_pool_checked_out"] = ("DB connections in use", pool.checkedout())
+        extra["db_pool_overflow"] = ("DB overflow connections", pool.overflow())
+    return PlainTextResponse(metrics.render(extra), media_type="text/plain; version=0.0.4")
+
+@app.get("/jobs/stats")
+async def get_jobs_stats(
+    user_id: int = Depends(auth.current_user_id),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Очередь фоновых задач: сколько ждёт/сделано/упало по типам, упавшие задачи, счётчики воркера"""
+    return {**await jobs.queue_stats(db), "worker": jobs.worker.stats()}
+
+@app.post("/jobs/{job_id}/retry")
+async def retry_job(
+    job_id: int,
+    user_id: int = Depends(auth.current_user_id),
+    db: AsyncSession = Depends(get_write_db)
+):
+    """Перезапустить упавшую задачу"""
+    if not await jobs.retry(db, job_id):
+        raise HTTPException(404, "Упавшая задача не найдена")
+    jobs.worker.wake()
+    return {"message": "Задача снова в очереди"}
 
 @app.get("/files/{file_id}")
 async def get_file_info(
     file_id: int,
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: AsyncSession = Depends(get_db)
+    user_id: int = Depends(auth.current_user_id),
+    db: AsyncSession = Depends(get_read_db)
 ):
-    auth.verify_token(credentials.credentials)
     file = await crud.get_file(db, file_id)
     if not file:
         raise HTTPException(404, "Файл не найден")
     return {
         "id": file.id,
         "filename": file.filename,
-        "filepath": file.filepath,
+        "filepath": storage.file_relpath(file),
         "size": file.size_bytes,
         "download_url": f"/static/{file.filename}"
     }
 
 @app.get("/dates")
 async def get_dates(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: AsyncSession = Depends(get_db)
+    request: Request,
+    limit: int = Query(30, ge=1, le=DATES_MAX_LIMIT),
+    before: str = Query(None),
+    date_from: str = Query(None, alias="from"),
+    date_to: str = Query(None, alias="to"),
+    aggregate: bool = Query(False),
+    user_id: int = Depends(auth.current_user_id),
+    db: AsyncSession = Depends(get_read_db)
 ):
-    auth.verify_token(credentials.credentials)
-    dates = await crud.get_recent_dates(db)
-    return [{"date": d.date.isoformat(), "notes": d.notes or ""} for d in dates]
-
-
-
-
-@app.get("/files/download/{file_id}")
-async def download_file(
-    file_id: int,
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: AsyncSession = Depends(get_db)
-):
-    """Скачать файл"""
-    try:
-        user_id = auth.verify_token(credentials.credentials)
-    except:
-        raise HTTPException(status_code=403, detail="Неверный токен")
-    
-    # Получаем файл
-    file = await crud.get_file(db, file_id)
-    if not file or file.user_id != user_id:
-        raise HTTPException(status_code=404, detail="Файл не найден")
+    """Дни от новых к старым, по limit штук.
+
+    Следующая страница - ?before=<X-Next-Cursor>. from/to ограничивают диапазон (месяц календаря),
+    aggregate=true добавляет к дням число пар, файлов и байт вложений.
+    """
+    dates = await crud.get_dates_page(
+        db, limit,
+        before=parse_date(before) if before else None,
+        date_from=parse_date(date_from) if date_from else None,
+        date_to=parse_date(date_to) if date_to else None,
+        aggregate=aggregate,
+    )
     
-    # Правильный путь
-    filename = os.path.basename(file.filepath)  # "2025-03-19_18-33-13.png"
-    file_path = f"/app/uploads/{filename}"
+    headers = {}
+    if len(dates) == limit:
+        headers["X-Next-Cursor"] = dates[-1].date.isoformat()
     
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="Файл отсутствует на диске")
+    # ETag списка - из версий входящих в него дней (файлы и пары их тоже поднимают),
+    # сериализуем только если он сменился
+    versions = ",".join(f"{d.id}:{d.version}" for d in dates)
+    etag = f'"{hashlib.sha1(f"{int(aggregate)}|{versions}".encode()).hexdigest()}"'
+    last_modified = max((d.updated_at for d in dates), default=None)
+    headers.update(conditional.validator_headers(etag, last_modified))
+    if conditional.is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
     
-    # FileResponse с ASCII именем
-    return FileResponse(
-        path=file_path,
-        filename="file.png",  # Без кириллицы!
-        media_type='application/octet-stream',
-        headers={"Content-Disposition": 'attachment; filename="file.png"'}
+    if aggregate:
+        payload = [{
+            "date": d.date.isoformat(), "notes": d.notes or "",
+            "lessons": d.lessons, "files": d.files, "bytes": int(d.bytes),
+        } for d in dates]
+    else:
+        payload = [{"date": d.date.isoformat(), "notes": d.notes or ""} for d in dates]
+    return encoding.JSONResponse(payload, headers=headers)
+
+
+@app.get("/search")
+async def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    type: str = Query("all", pattern="^(all|lessons|files)$"),
+    date_from: str = Query(None, alias="from"),
+    date_to: str = Query(None, alias="to"),
+    limit: int = Query(20, ge=1, le=SEARCH_MAX_LIMIT),
+    offset: int = Query(0, ge=0),
+    user_id: int = Depends(auth.current_user_id),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Поиск по предметам, преподавателям, аудиториям и именам файлов (с префиксами и опечатками)"""
+    if not crud.search_words(q):
+        raise HTTPException(400, "Пустой запрос")
+    rows = await crud.search(
+        db, q, kind=type,
+        date_from=parse_date(date_from) if date_from else None,
+        date_to=parse_date(date_to) if date_to else None,
+        limit=limit + 1, offset=offset,
     )
-
-
-
-@app.post("/schedule/{date_str}")
+    results = [
+        {
+            "type": r.type,
+            "id": r.id,
+            "date": r.date.isoformat(),
+            "lesson_id": r.lesson_id,
+            "lesson_number": r.lesson_number,
+            "subject": r.subject or "",
+            "teacher": r.teacher or "",
+            "room": r.room or "",
+            "filename": r.filename,
+            "rank": round(float(r.rank), 4),
+        } for r in rows[:limit]
+    ]
+    return encoding.JSONResponse({"results": results, "next_offset": offset + limit if len(rows) > limit else None})
+
+@app.post("/schedule/import")
+async def import_schedule(
+    file: UploadFile = File(...),
+    format: str = Form(None),
+    user_id: int = Depends(auth.current_user_id),
+    db: AsyncSession = Depends(get_write_db)
+):
+    """Импорт семестра из CSV / JSON (массив или NDJSON) / iCal.
+
+    Поля: date, lesson_number, subject, teacher, room. Файл разбирается потоково,
+    пары пишутся батчами по IMPORT_BATCH_SIZE, каждый батч - своя транзакция.
+    """
+    fmt = (format or timetable.detect_format(file.filename, file.content_type) or "").lower()
+    if fmt not in timetable.FORMATS:
+        raise HTTPException(400, f"Неизвестный формат, нужен один из: {', '.join(timetable.FORMATS)}")
+    
+    report = {"dates_created": 0, "created": 0, "updated": 0, "skipped": 0, "errors": []}
+    records = timetable.iter_import(file.file, fmt)
+    row = 0
+    while True:
+        # Чтение и разбор файла - в пуле потоков, event loop свободен
+        batch = await run_in_threadpool(timetable.read_batch, records, IMPORT_BATCH_SIZE)
+        if not batch:
+            break
+        valid = []
+        for item in batch:
+            row += 1
+            if isinstance(item, timetable.ImportRowError):
+                report["skipped"] += 1
+                if len(report["errors"]) < IMPORT_MAX_ERRORS:
+                    report["errors"].append({"row": row, "error": str(item)})
+            else:
+                valid.append(item)
+        if valid:
+            result = await crud.import_lessons(db, valid)
+            for key, value in result.items():
+                report[key] += value
+    return report
+
+@app.post("/schedule/{date_str}", responses={200: {"model": schemas.ScheduleOut}})
 async def create_or_get_schedule(
     date_str: str,
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: AsyncSession = Depends(get_db)
+    user_id: int = Depends(auth.current_user_id),
+    db: AsyncSession = Depends(get_write_db)
 ):
     """Создать/получить расписание с 8 пустыми парами"""
-    auth.verify_token(credentials.credentials)
     target_date = parse_date(date_str)
     
-    # Найти/создать дату
-    stmt = select(models.ScheduleDate).where(models.ScheduleDate.date == target_date)
-    result = await db.execute(stmt)
-    schedule_date = result.scalar_one_or_none()
-    
-    if not schedule_date:
-        schedule_date = models.ScheduleDate(date=target_date, notes="")
-        db.add(schedule_date)
-        await db.commit()
-        await db.refresh(schedule_date)
+    cached = schedule_cache.get(target_date)
+    if cached is not None and cached.lessons:
+        return schedule_response(cached)
     
-    # Создать 8 стандартных пар если пусто
-    lessons_count = (await db.execute(
-        select(models.Lesson).where(models.Lesson.date_id == schedule_date.id)
-    )).scalars().all()
+    # Найти/создать дату и 8 пустых пар - без гонок, за пару запросов
+    await crud.get_or_create_schedule_date(db, target_date, seed_lessons=True)
+    generation = schedule_cache.generation()
+    schedule_date = await crud.get_schedule_date(db, target_date)
     
-    if not lessons_count:
-        for i in range(1, 9):
-            lesson = models.Lesson(
-                date_id=schedule_date.id,
-                lesson_number=i,
-                subject=f"Пара {i}",
-                teacher="",
-                room=""
-            )
-            db.add(lesson)
-        await db.commit()
-    
-    lessons = await crud.get_lessons_by_date(db, schedule_date.id)
-    
-    return {
-        "date": target_date.isoformat(),
-        "notes": schedule_date.notes or "",
-        "lessons": [
-            {
-                "id": l.id,
-                "lesson_number": l.lesson_number,
-                "subject": l.subject or "",
-                "teacher": l.teacher or "",
-                "room": l.room or "",
-                "files": [f.id for f in await crud.get_lesson_files(db, l.id)]
-            } for l in lessons
-        ]
-    }
+    return schedule_response(remember_schedule(target_date, schedule_date, generation))
+
+def upload_form_schema(properties: dict) -> dict:
+    """Описание multipart-тела для /docs: сами эндпоинты загрузки читают тело через storage.receive_form"""
+    schema = {"type": "object", "properties": properties, "required": list(properties)}
+    return {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": schema}}}}
 
-@app.post("/lessons/{lesson_id}/files")
+async def receive_upload_form(request: Request, file_field: str, max_files: int) -> storage.UploadForm:
+    """Тело формы - прямо из запроса во временные файлы в UPLOAD_DIR, без копии от FastAPI"""
+    try:
+        return await storage.receive_form(request, file_field, max_files)
+    except storage.UploadFormError as e:
+        raise HTTPException(400, str(e))
+
+@app.post("/lessons/{lesson_id}/files",
+          openapi_extra=upload_form_schema({"file": {"type": "string", "format": "binary"}}))
 async def upload_lesson_file(
     lesson_id: int,
-    file: UploadFile = File(...),
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: AsyncSession = Depends(get_db)
+    request: Request,
+    user_id: int = Depends(auth.current_user_id),
+    db: AsyncSession = Depends(get_write_db)
 ):
     """Загрузить файл К КОНКРЕТНОЙ ПАРЕ"""
-    user_id = auth.verify_token(credentials.credentials)
-    lesson = await crud.get_lesson(db, lesson_id)
-    if not lesson:
-        raise HTTPException(404, "Пара не найдена")
+    form = await receive_upload_form(request, "file", 1)
+    try:
+        if not form.files:
+            raise HTTPException(400, "Нет файла в поле file")
+        try:
+            await crud.get_lesson(db, lesson_id)
+        except ValueError:
+            raise HTTPException(404, "Пара не найдена")
+    except BaseException:
+        await storage.discard_all(form.stored())
+        raise
     
-    db_file = await crud.create_file(db, user_id, lesson_id, file)
+    try:
+        db_file = await crud.create_file(db, user_id, lesson_id, form.files[0])
+    except storage.FileTooLarge as e:
+        raise HTTPException(413, str(e))
     return {
         "id": db_file.id,
         "filename": db_file.filename,
@@ -264,17 +561,59 @@ async def upload_lesson_file(
         "message": "Файл прикреплён к паре!"
     }
 
+@app.post("/upload", openapi_extra=upload_form_schema({
+    "lesson_id": {"type": "integer"},
+    "files": {"type": "array", "items": {"type": "string", "format": "binary"}},
+}))
+async def upload_files(
+    request: Request,
+    user_id: int = Depends(auth.current_user_id),
+    db: AsyncSession = Depends(get_write_db)
+):
+    """Загрузить несколько файлов к паре за один запрос. Результат - по каждому файлу"""
+    form = await receive_upload_form(request, "files", UPLOAD_MAX_FILES)
+    files = form.files
+    try:
+        try:
+            lesson_id = int(form.fields.get("lesson_id", ""))
+        except ValueError:
+            raise HTTPException(422, "lesson_id - номер пары")
+        if not files:
+            raise HTTPException(400, "Нет файлов в поле files")
+        try:
+            await crud.get_lesson(db, lesson_id)
+        except ValueError:
+            raise HTTPException(404, "Пара не найдена")
+    except BaseException:
+        await storage.discard_all(form.stored())
+        raise
+    
+    results = await crud.create_files(db, user_id, lesson_id, files)
+    uploaded = [
+        {"id": r.id, "filename": r.filename, "size": r.size_bytes}
+        if isinstance(r, models.File) else
+        {"filename": f.filename, "error": str(r)}
+        for f, r in zip(files, results)
+    ]
+    failed = sum(1 for r in results if not isinstance(r, models.File))
+    return {
+        "lesson_id": lesson_id,
+        "uploaded": len(results) - failed,
+        "failed": failed,
+        "files": uploaded,
+        "message": "Файлы прикреплены к паре!" if not failed else "Не все файлы загружены",
+    }
+
 @app.put("/lessons/{lesson_id}")
 async def update_lesson_info(
     lesson_id: int,
     subject: str = Form(None),
     teacher: str = Form(None),
     room: str = Form(None),
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: AsyncSession = Depends(get_db)
+    user_id: int = Depends(auth.current_user_id),
+    db: AsyncSession = Depends(get_write_db)
 ):
     """Обновить информацию о паре"""
-    auth.verify_token(credentials.credentials)
     lesson = await crud.update_lesson(db, lesson_id, subject, teacher, room)
     return {
         "id": lesson.id,
@@ -286,37 +625,33 @@ async def update_lesson_info(
 @app.get("/files/download/{file_id}")
 async def download_file(
     file_id: int,
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: AsyncSession = Depends(get_db)
+    request: Request,
+    user_id: int = Depends(auth.current_user_id),
+    db: AsyncSession = Depends(get_read_db)
 ):
-    """Скачать файл (доступно всем авторизованным!)"""
-    auth.verify_token(credentials.credentials)  # Только проверка токена
+    """Скачать файл (доступно всем авторизованным!). Поддерживает Range, If-None-Match, If-Range"""
     
     file = await crud.get_file(db, file_id)
     if not file:
         raise HTTPException(404, "Файл не найден")
     
-    filename = os.path.basename(file.filepath)
-    file_path = f"/app/uploads/{filename}"
+    if downloads.DOWNLOAD_MODE == "accel":
+        return downloads.accel_response(storage.upload_relpath(file), file.filename)
+    
+    file_path = storage.file_path(file)
     
     if not os.path.exists(file_path):
         raise HTTPException(404, "Файл отсутствует")
     
-    return FileResponse(
-        path=file_path,
-        filename="file.png",
-        media_type='application/octet-stream',
-        headers={"Content-Disposition": 'attachment; filename="file.png"'}
-    )
+    return downloads.file_response(request, file_path, file.filename, file.blob_sha256, file.uploaded_at)
 
 @app.delete("/files/{file_id}")
 async def delete_file_endpoint(
     file_id: int,
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: AsyncSession = Depends(get_db)
+    user_id: int = Depends(auth.current_user_id),
+    db: AsyncSession = Depends(get_write_db)
 ):
     """Удалить файл"""
-    auth.verify_token(credentials.credentials)
     try:
         result = await crud.delete_file(db, file_id)
         return result
@@ -326,11 +661,10 @@ async def delete_file_endpoint(
 @app.delete("/lessons/{lesson_id}")
 async def delete_lesson_endpoint(
     lesson_id: int,
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: AsyncSession = Depends(get_db)
+    user_id: int = Depends(auth.current_user_id),
+    db: AsyncSession = Depends(get_write_db)
 ):
     """Удалить пару + ВСЕ файлы"""
-    auth.verify_token(credentials.credentials)
     try:
         result = await crud.delete_lesson(db, lesson_id)
         return result
@@ -345,13 +679,17 @@ async def create_lesson(
     subject: str = Form(None),
     teacher: str = Form(None),
     room: str = Form(None),
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: AsyncSession = Depends(get_db)):
+    user_id: int = Depends(auth.current_user_id),
+    db: AsyncSession = Depends(get_write_db)):
 
     """добавить новую пару"""
-    auth.verify_token(credentials.credentials)
     
-    lesson = await crud.create_lesson(db, date_id, lesson_number, subject, teacher, room)
+    try:
+        lesson = await crud.create_lesson(db, date_id, lesson_number, subject, teacher, room)
+    except LookupError as e:
+        raise HTTPException(404, str(e))
+    except ValueError as e:
+        raise HTTPException(409, str(e))
     return {
         "id": lesson.id,
         "lesson_number": lesson.lesson_number,
@@ -370,18 +708,9 @@ async def get_date_id(
     """Получить/создать ID даты по строке даты"""
     target_date = parse_date(date_str)
     
-    # Твой код из get_schedule
-    stmt = select(models.ScheduleDate).where(models.ScheduleDate.date == target_date)
-    result = await db.execute(stmt)
-    schedule_date = result.scalar_one_or_none()
-    
-    if not schedule_date:
-        schedule_date = models.ScheduleDate(date=target_date)
-        db.add(schedule_date)
-        await db.commit()
-        await db.refresh(schedule_date)
+    date_id, _ = await crud.get_or_create_schedule_date(db, target_date)
     
     return {
         "date": target_date.isoformat(),
-        "date_id": schedule_date.id
+        "date_id": date_id
     }
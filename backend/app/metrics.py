@@ -0,0 +1,219 @@
+"""Метрики запросов для Prometheus (GET /metrics) и лог медленных запросов.
+
+MetricsMiddleware (чистый ASGI) меряет каждый запрос: время, статус, байты тела
+запроса и ответа. События движка SQLAlchemy (instrument_engine) добавляют к
+текущему запросу число SQL-запросов и время в базе - запрос находится через
+contextvar, greenlet'ы SQLAlchemy наследуют контекст задачи.
+
+Метрики живут в памяти процесса: при нескольких воркерах uvicorn каждый отдаёт
+свои. Без prometheus_client: тут нужны только счётчики и одна гистограмма.
+"""
+import bisect
+import contextvars
+import logging
+import os
+import time
+from collections import defaultdict
+from typing import Optional
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() not in ("0", "false", "no", "off")
+# Запросы дольше стольких секунд пишутся в лог вместе с их SQL; 0 - не писать
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "0"))
+SLOW_LOG_MAX_STATEMENTS = 50
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_time", "statements")
+
+    def __init__(self, keep_statements: bool):
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = [] if keep_statements else None
+
+
+_current: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("request_stats", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.series = {}  # labels -> [counts по бакетам..., sum, count]
+
+    def observe(self, labels: tuple, value: float):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * len(self.buckets) + [0.0, 0]
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+
+class Registry:
+    def __init__(self):
+        self.latency = Histogram()
+        self.requests = defaultdict(int)  # (method, route, status)
+        self.db_queries = defaultdict(int)  # (route,)
+        self.db_seconds = defaultdict(float)
+        self.request_bytes = defaultdict(int)
+        self.response_bytes = defaultdict(int)
+        self.in_flight = 0
+
+    def record(self, method: str, route: str, status: int, duration: Optional[float], stats: RequestStats,
+               received: int, sent: int):
+        self.requests[(method, route, str(status))] += 1
+        if duration is not None:
+            self.latency.observe((method, route), duration)
+        key = (route,)
+        if stats.queries:
+            self.db_queries[key] += stats.queries
+            self.db_seconds[key] += stats.db_time
+        if received:
+            self.request_bytes[key] += received
+        if sent:
+            self.response_bytes[key] += sent
+
+
+registry = Registry()
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    def escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{n}="{escape(v)}"' for n, v in zip(names, values))
+
+
+def _counter(lines: list, name: str, help_text: str, names: tuple, series: dict, kind: str = "counter"):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+    for values, value in sorted(series.items()):
+        lines.append(f"{name}{{{_labels(names, values)}}} {value}")
+
+
+def render(extra: Optional[dict] = None) -> str:
+    """Текстовый формат Prometheus 0.0.4. extra - простые gauge вида {имя: (описание, значение)}"""
+    r = registry
+    lines = []
+    _counter(lines, "http_requests_total", "HTTP requests", ("method", "route", "status"), r.requests)
+
+    lines.append("# HELP http_request_duration_seconds HTTP request latency (streams excluded)")
+    lines.append("# TYPE http_request_duration_seconds histogram")
+    for values, series in sorted(r.latency.series.items()):
+        labels = _labels(("method", "route"), values)
+        cumulative = 0
+        for bound, count in zip(r.latency.buckets, series):
+            cumulative += count
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {series[-1]}')
+        lines.append(f"http_request_duration_seconds_sum{{{labels}}} {series[-2]}")
+        lines.append(f"http_request_duration_seconds_count{{{labels}}} {series[-1]}")
+
+    _counter(lines, "db_queries_total", "SQL statements executed", ("route",), r.db_queries)
+    _counter(lines, "db_query_seconds_total", "Time spent in SQL statements", ("route",), r.db_seconds)
+    _counter(lines, "http_request_body_bytes_total", "Request body bytes received (uploads)",
+             ("route",), r.request_bytes)
+    _counter(lines, "http_response_body_bytes_total", "Response body bytes sent (downloads)",
+             ("route",), r.response_bytes)
+
+    lines.append("# HELP http_requests_in_flight HTTP requests in progress")
+    lines.append("# TYPE http_requests_in_flight gauge")
+    lines.append(f"http_requests_in_flight {r.in_flight}")
+    for name, (help_text, value) in (extra or {}).items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# --- SQLAlchemy ---
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    if stats is None:
+        return
+    elapsed = time.perf_counter() - context._metrics_started
+    stats.queries += 1
+    stats.db_time += elapsed
+    if stats.statements is not None and len(stats.statements) < SLOW_LOG_MAX_STATEMENTS:
+        stats.statements.append((elapsed, statement))
+
+
+def instrument_engine(engine):
+    """Считать SQL-запросы движка (AsyncEngine или обычного) в метрики текущего HTTP-запроса"""
+    if not METRICS_ENABLED:
+        return
+    sync_engine = getattr(engine, "sync_engine", engine)
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# --- ASGI ---
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(keep_statements=SLOW_REQUEST_SECONDS > 0)
+        token = _current.set(stats)
+        started = time.perf_counter()
+        received = sent = 0
+        status = 500
+        streaming = False
+
+        async def receive_wrapper():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            nonlocal sent, status, streaming
+            kind = message["type"]
+            if kind == "http.response.start":
+                status = message["status"]
+                for name, value in message.get("headers", ()):
+                    if name == b"content-type" and value.startswith(b"text/event-stream"):
+                        streaming = True
+            elif kind == "http.response.body":
+                sent += len(message.get("body", b""))
+            elif kind == "http.response.zerocopysend":
+                sent += message.get("count") or 0
+            await send(message)
+
+        registry.in_flight += 1
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            registry.in_flight -= 1
+            _current.reset(token)
+            duration = time.perf_counter() - started
+            route = scope.get("route")
+            route = getattr(route, "path", None) or "unmatched"
+            # Время SSE-подписки - это время жизни соединения, в гистограмме задержек ему не место
+            registry.record(scope["method"], route, status, None if streaming else duration, stats, received, sent)
+            if SLOW_REQUEST_SECONDS and duration >= SLOW_REQUEST_SECONDS and not streaming:
+                _log_slow(scope["method"], route, status, duration, stats)
+
+
+def _log_slow(method: str, route: str, status: int, duration: float, stats: RequestStats):
+    statements = "\n".join(f"  {elapsed * 1000:.1f} ms: {' '.join(sql.split())[:500]}"
+                           for elapsed, sql in stats.statements)
+    logger.warning("Медленный запрос %s %s -> %s: %.3f с, SQL: %d шт. / %.3f с\n%s",
+                   method, route, status, duration, stats.queries, stats.db_time, statements)
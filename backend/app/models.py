@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, BigInteger, Date, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, BigInteger, Date, DateTime, UniqueConstraint, Index, DDL, JSON, event, text
+from sqlalchemy.dialects import postgresql  # noqa: F401 - регистрирует func.to_tsvector / to_tsquery
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 import app.database as database
@@ -10,7 +11,7 @@ class User(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String(100), nullable=False)
     username = Column(String(50), unique=True)
-    password_hash = Column(String(64))  # ✅ ДОБАВЬ!
+    password_hash = Column(String(255))  # bcrypt; старые - SHA-256 hex, см. passwords
     files = relationship("File", back_populates="user")
 
 class ScheduleDate(Base):
@@ -18,27 +19,120 @@ class ScheduleDate(Base):
     id = Column(Integer, primary_key=True)
     date = Column(Date, unique=True, nullable=False)
     notes = Column(String(500))
-    lessons = relationship("Lesson", back_populates="schedule_date")
+    # Растёт при каждом изменении пар/файлов/заметок дня через crud - из него ETag
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    updated_at = Column(DateTime, nullable=False, server_default=func.now())
+    # passive_deletes: пары и их файлы удаляет ON DELETE CASCADE в базе
+    lessons = relationship("Lesson", back_populates="schedule_date", order_by="Lesson.lesson_number",
+                           passive_deletes=True)
 
 class Lesson(Base):
     __tablename__ = "lessons"
+    __table_args__ = (
+        # Одна пара с данным номером в день - на нём же держится upsert импорта
+        UniqueConstraint("date_id", "lesson_number", name="uq_lessons_date_id_lesson_number"),
+    )
     id = Column(Integer, primary_key=True)
-    date_id = Column(Integer, ForeignKey("schedule_dates.id"))
+    date_id = Column(Integer, ForeignKey("schedule_dates.id", ondelete="CASCADE"))
     lesson_number = Column(Integer, nullable=False)
     subject = Column(String(100))
     teacher = Column(String(100))
     room = Column(String(20))
     schedule_date = relationship("ScheduleDate", back_populates="lessons")  # ✅ ДОБАВЛЕНО!
-    files = relationship("File", back_populates="lesson")
+    # lesson_id впереди - selectinload (lesson_id IN ...) берёт порядок из ix_files_lesson_id_uploaded_at,
+    # без него SQLite сортирует файлы всех пар во временном B-дереве
+    files = relationship("File", back_populates="lesson", passive_deletes=True,
+                         order_by="[File.lesson_id.desc(), File.uploaded_at.desc(), File.id.desc()]")
+
+class Blob(Base):
+    """Содержимое файла на диске по sha256, одно на все одинаковые загрузки"""
+    __tablename__ = "blobs"
+    sha256 = Column(String(64), primary_key=True)
+    size_bytes = Column(BigInteger, nullable=False)
+    refcount = Column(Integer, nullable=False, default=0, server_default="0")
+    created_at = Column(DateTime, server_default=func.now())
+    files = relationship("File", back_populates="blob")
 
 class File(Base):
     __tablename__ = "files"
+    __table_args__ = (
+        # Файлы пары по порядку загрузки - get_lesson_files и selectinload дня
+        Index("ix_files_lesson_id_uploaded_at", "lesson_id", "uploaded_at"),
+        Index("ix_files_blob_sha256", "blob_sha256"),
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"))
-    lesson_id = Column(Integer, ForeignKey("lessons.id"))
+    lesson_id = Column(Integer, ForeignKey("lessons.id", ondelete="CASCADE"))
+    blob_sha256 = Column(String(64), ForeignKey("blobs.sha256"))
     filename = Column(String(255), nullable=False)
-    filepath = Column(String(500), nullable=False)
+    filepath = Column(String(500))  # только у старых файлов без блоба
     size_bytes = Column(BigInteger)
     uploaded_at = Column(DateTime, server_default=func.now())
     user = relationship("User", back_populates="files")
     lesson = relationship("Lesson", back_populates="files")  # ✅ ИСПРАВЛЕНО!
+    blob = relationship("Blob", back_populates="files")
+
+class Job(Base):
+    """Фоновая задача (см. jobs): удаление с диска, сборка мусора в UPLOAD_DIR"""
+    __tablename__ = "jobs"
+    __table_args__ = (
+        # Очередь - только ждущие задачи, выполненные в индекс не попадают
+        Index("ix_jobs_pending_run_at", "run_at",
+              postgresql_where=text("status = 'pending'"), sqlite_where=text("status = 'pending'")),
+    )
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(50), nullable=False)
+    payload = Column(JSON, nullable=False)
+    status = Column(String(20), nullable=False, default="pending", server_default="pending")  # pending/done/failed
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    run_at = Column(DateTime, nullable=False)  # не раньше - для повторов с задержкой
+    created_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime)
+    last_error = Column(String(1000))
+    result = Column(JSON)
+
+
+class RevokedToken(Base):
+    """Отозванный токен (POST /logout) - общий для всех воркеров, в том числе запущенных позже.
+    Строку можно удалить после expires_at: такой токен не пройдёт проверку и так"""
+    __tablename__ = "revoked_tokens"
+    __table_args__ = (
+        Index("ix_revoked_tokens_expires_at", "expires_at"),
+    )
+    token_hash = Column(String(64), primary_key=True)  # sha256 токена, сам токен не храним
+    expires_at = Column(DateTime, nullable=False)  # exp токена, UTC
+
+
+# --- Поиск (GET /search) ---
+# Выражения ниже совпадают с индексами посимвольно - иначе Postgres индекс не возьмёт.
+# Константы - text(), а не параметры, по той же причине.
+
+def _search_text(*columns):
+    document = func.coalesce(columns[0], text("''"))
+    for column in columns[1:]:
+        document = document.concat(text("' '")).concat(func.coalesce(column, text("''")))
+    return document
+
+
+def _tsvector(document):
+    # russian: русские слова стеммятся русским стеммером, латиница - английским
+    return func.to_tsvector(text("'russian'"), document)
+
+
+LESSON_SEARCH_TEXT = _search_text(Lesson.subject, Lesson.teacher, Lesson.room)
+LESSON_SEARCH_TSV = _tsvector(LESSON_SEARCH_TEXT)
+FILE_SEARCH_TEXT = _search_text(File.filename)
+FILE_SEARCH_TSV = _tsvector(FILE_SEARCH_TEXT)
+
+# Полнотекст (слова и префиксы) - GIN по tsvector, опечатки и части слов - GIN pg_trgm
+Index("ix_lessons_search_tsv", LESSON_SEARCH_TSV, postgresql_using="gin").ddl_if(dialect="postgresql")
+Index("ix_lessons_search_trgm", LESSON_SEARCH_TEXT.label("search_text"), postgresql_using="gin",
+      postgresql_ops={"search_text": "gin_trgm_ops"}).ddl_if(dialect="postgresql")
+Index("ix_files_search_tsv", FILE_SEARCH_TSV, postgresql_using="gin").ddl_if(dialect="postgresql")
+Index("ix_files_search_trgm", FILE_SEARCH_TEXT.label("search_text"), postgresql_using="gin",
+      postgresql_ops={"search_text": "gin_trgm_ops"}).ddl_if(dialect="postgresql")
+
+event.listen(
+    Base.metadata, "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
@@ -0,0 +1,71 @@
+"""Хэши паролей: bcrypt (passlib) в отдельном ограниченном пуле потоков.
+
+bcrypt специально медленный - в event loop он остановил бы все запросы, поэтому
+хэшируем в пуле из PASSWORD_HASH_WORKERS потоков (bcrypt отпускает GIL), а очередь
+к пулу ограничена PASSWORD_HASH_QUEUE: при шторме логинов ждут на семафоре, а не
+копят задачи в executor'е. Старые хэши (голый SHA-256) проверяются как раньше и
+заменяются на bcrypt при первом удачном входе.
+"""
+import asyncio
+import hashlib
+import hmac
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "64"))
+
+# deprecated="auto" + смена BCRYPT_ROUNDS -> verify_and_update вернёт новый хэш
+_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+# Создаются при первом хэше и сбрасываются в shutdown() - на каждый lifespan свои
+_executor: Optional[ThreadPoolExecutor] = None
+_slots: Optional[asyncio.Semaphore] = None
+
+_LEGACY_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def _verify(password: str, stored: str) -> Tuple[bool, Optional[str]]:
+    if _LEGACY_RE.match(stored):
+        legacy = hashlib.sha256(password.encode("utf-8")).hexdigest()
+        if not hmac.compare_digest(stored, legacy):
+            return False, None
+        return True, _context.hash(password)
+    return _context.verify_and_update(password, stored)
+
+
+def _pool() -> Tuple[ThreadPoolExecutor, asyncio.Semaphore]:
+    global _executor, _slots
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+        _slots = asyncio.Semaphore(PASSWORD_HASH_QUEUE)
+    return _executor, _slots
+
+
+async def _run(fn, *args):
+    executor, slots = _pool()
+    async with slots:
+        return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+
+async def hash_password(password: str) -> str:
+    return await _run(_context.hash, password)
+
+
+async def verify_password(password: str, stored: Optional[str]) -> Tuple[bool, Optional[str]]:
+    """(пароль верный?, новый хэш или None) - новый хэш надо сохранить в users.password_hash"""
+    if not stored:
+        return False, None
+    return await _run(_verify, password, stored)
+
+
+def shutdown():
+    """Остановить пул. Следующий хэш (новый lifespan в том же процессе) создаст новый"""
+    global _executor, _slots
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+    _executor = _slots = None
@@ -15,7 +15,7 @@ class UserOut(BaseModel):
 class FileOut(BaseModel):
     id: int
     filename: str
-    filepath: str
+    filepath: Optional[str]
     size_bytes: Optional[int]
 
 class LessonOut(BaseModel):
@@ -24,9 +24,9 @@ class LessonOut(BaseModel):
     subject: str
     teacher: str
     room: str
-    files: List[FileOut]
+    files: List[int]
 
 class ScheduleOut(BaseModel):
     date: str
-    notes: Optional[str]
+    notes: str
     lessons: List[LessonOut]
@@ -0,0 +1,396 @@
+"""Файлы пар на диске.
+
+Содержимое хранится один раз по sha256 (UPLOAD_DIR/blobs/ab/abcd...), строки files
+ссылаются на blobs с числом ссылок. Загрузка пишется потоково прямо из тела запроса
+во временный файл в UPLOAD_DIR (receive_form), по пути считается хэш, потом файл
+атомарно переезжает на место блоба.
+Старые строки без блоба хранят свой путь в files.filepath.
+"""
+import hashlib
+import os
+import tempfile
+import time
+from typing import NamedTuple
+
+from fastapi.responses import JSONResponse
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.concurrency import run_in_threadpool
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "/app/uploads")
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# По умолчанию как client_max_body_size в nginx.conf
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(1024 ** 3)))
+# Обычные (не файловые) поля формы загрузки держим в памяти - они короткие
+UPLOAD_MAX_FIELD_SIZE = int(os.getenv("UPLOAD_MAX_FIELD_SIZE", str(64 * 1024)))
+
+
+class FileTooLarge(ValueError):
+    pass
+
+
+class StoredUpload(NamedTuple):
+    tmp_path: str  # ещё не на месте - см. place_blobs / discard_all
+    size: int
+    sha256: str
+
+
+def path_for(filepath: str) -> str:
+    """Старый формат 'uploads/2025-03-19_18-33-13_x.png' из базы -> полный путь на диске"""
+    return os.path.join(UPLOAD_DIR, os.path.basename(filepath))
+
+
+def blob_relpath(sha256: str) -> str:
+    return f"blobs/{sha256[:2]}/{sha256}"
+
+
+def blob_path(sha256: str) -> str:
+    return os.path.join(UPLOAD_DIR, blob_relpath(sha256))
+
+
+def file_path(file) -> str:
+    """Путь на диске для models.File - через блоб, либо старый filepath"""
+    if file.blob_sha256:
+        return blob_path(file.blob_sha256)
+    return path_for(file.filepath)
+
+
+def upload_relpath(file) -> str:
+    """Путь models.File относительно UPLOAD_DIR"""
+    if file.blob_sha256:
+        return blob_relpath(file.blob_sha256)
+    return os.path.basename(file.filepath)
+
+
+def file_relpath(file) -> str:
+    return f"uploads/{upload_relpath(file)}"
+
+
+class UploadFormError(ValueError):
+    """Битая или неподходящая multipart-форма - 400"""
+
+
+class ReceivedFile(NamedTuple):
+    filename: str
+    result: object  # StoredUpload или FileTooLarge
+
+
+class UploadForm(NamedTuple):
+    fields: dict  # обычные поля формы: имя -> строка
+    files: list  # [ReceivedFile] в порядке формы
+
+    def stored(self) -> list:
+        return [f.result for f in self.files if isinstance(f.result, StoredUpload)]
+
+
+class _PartWriter:
+    """Одна файловая часть формы -> .part в UPLOAD_DIR, по пути размер и sha256.
+
+    feed вызывается из парсера в event loop и только копит куски, на диск
+    (flush / finish / abort) пишем в пуле потоков
+    """
+
+    def __init__(self, filename: str, max_size: int):
+        self.filename = filename
+        self.max_size = max_size
+        self.size = 0
+        self.error = None
+        self.tmp_path = None
+        self.pending = []
+        self.pending_size = 0
+        self._out = None
+        self._digest = hashlib.sha256()
+
+    def feed(self, data: bytes):
+        if self.error is not None:
+            return
+        self.size += len(data)
+        if self.size > self.max_size:
+            # Остаток части парсер всё равно прочитает - просто не пишем его
+            self.error = FileTooLarge(f"Файл больше {self.max_size} байт")
+            self.pending.clear()
+            self.pending_size = 0
+            return
+        self.pending.append(data)
+        self.pending_size += len(data)
+
+    def flush(self):
+        data = b"".join(self.pending)
+        self.pending.clear()
+        self.pending_size = 0
+        if self.error is not None:
+            self.abort()
+            return
+        if self._out is None:
+            os.makedirs(UPLOAD_DIR, exist_ok=True)
+            fd, self.tmp_path = tempfile.mkstemp(dir=UPLOAD_DIR, prefix=".upload-", suffix=".part")
+            self._out = os.fdopen(fd, "wb")
+        self._digest.update(data)
+        self._out.write(data)
+
+    def finish(self) -> ReceivedFile:
+        self.flush()
+        if self.error is not None:
+            return ReceivedFile(self.filename, self.error)
+        self._out.flush()
+        os.fsync(self._out.fileno())
+        self._out.close()
+        self._out = None
+        return ReceivedFile(self.filename, StoredUpload(self.tmp_path, self.size, self._digest.hexdigest()))
+
+    def abort(self):
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+        if self.tmp_path is not None:
+            unlink(self.tmp_path)
+            self.tmp_path = None
+
+
+def _decode_header(value: bytes) -> str:
+    try:
+        return value.decode("utf-8")
+    except UnicodeDecodeError:
+        return value.decode("latin-1")
+
+
+async def receive_form(request, file_field: str, max_files: int, max_size: int = MAX_UPLOAD_SIZE,
+                       max_field_size: int = UPLOAD_MAX_FIELD_SIZE) -> UploadForm:
+    """Разобрать multipart-тело прямо из потока запроса: файлы (только в поле file_field)
+    сразу пишутся во временные файлы в UPLOAD_DIR (см. _PartWriter), без промежуточной
+    копии, которую делает request.form(). Файл больше max_size не пишется - в его
+    ReceivedFile лежит FileTooLarge.
+
+    При любой ошибке уже записанное удаляется. Удачный результат - StoredUpload'ы,
+    которые дальше надо разложить (place_blobs) или убрать (discard_all)
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type.lower() != b"multipart/form-data" or not boundary:
+        raise UploadFormError("Нужна форма multipart/form-data")
+
+    fields, files = {}, []
+    part = {"headers": {}, "field": b"", "value": b""}
+    writers, finished = [], []
+    state = {"writer": None, "name": None, "value": None, "files": 0, "ended": False}
+
+    def on_part_begin():
+        part["headers"] = {}
+
+    def on_header_field(data, start, end):
+        part["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["field"].lower()] = part["value"]
+        part["field"], part["value"] = b"", b""
+
+    def on_headers_finished():
+        _, options = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        if b"name" not in options:
+            raise UploadFormError("У части формы нет name")
+        state["name"] = _decode_header(options[b"name"])
+        if b"filename" in options:
+            if state["name"] != file_field:
+                raise UploadFormError(f"Файлы принимаются только в поле {file_field}")
+            state["files"] += 1
+            if state["files"] > max_files:
+                raise UploadFormError(f"Слишком много файлов, максимум {max_files}")
+            state["writer"] = _PartWriter(_decode_header(options[b"filename"]), max_size)
+            writers.append(state["writer"])
+        else:
+            state["value"] = bytearray()
+
+    def on_part_data(data, start, end):
+        if state["writer"] is not None:
+            state["writer"].feed(data[start:end])
+        else:
+            state["value"] += data[start:end]
+            if len(state["value"]) > max_field_size:
+                raise UploadFormError(f"Поле {state['name']} длиннее {max_field_size} байт")
+
+    def on_part_end():
+        if state["writer"] is not None:
+            finished.append(state["writer"])
+            state["writer"] = None
+        else:
+            fields[state["name"]] = _decode_header(bytes(state["value"]))
+
+    def on_end():
+        state["ended"] = True
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_end": on_end,
+    })
+
+    def write(current, done: list) -> list:
+        if current is not None:
+            current.flush()
+        return [writer.finish() for writer in done]
+
+    try:
+        async for chunk in request.stream():
+            try:
+                parser.write(chunk)
+            except UploadFormError:
+                raise
+            except Exception as e:
+                raise UploadFormError(f"Не удалось разобрать форму: {e}")
+            # На диск - кусками от UPLOAD_CHUNK_SIZE и по концу каждого файла
+            current = state["writer"]
+            if current is not None and current.pending_size < UPLOAD_CHUNK_SIZE:
+                current = None
+            if current is not None or finished:
+                done = finished[:]
+                finished.clear()
+                files.extend(await run_in_threadpool(write, current, done))
+        parser.finalize()
+        if not state["ended"]:
+            raise UploadFormError("Форма оборвана")
+    except BaseException:
+        await run_in_threadpool(_abort_all, writers)
+        raise
+    return UploadForm(fields, files)
+
+
+def _place_blob(upload: StoredUpload):
+    dest = blob_path(upload.sha256)
+    if os.path.exists(dest):
+        # Такое содержимое уже есть - второй копии не будет
+        os.unlink(upload.tmp_path)
+        return
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    # rename в пределах одного тома атомарен - недописанный блоб никто не увидит
+    os.replace(upload.tmp_path, dest)
+
+
+def _place_blobs(uploads: list):
+    for upload in uploads:
+        _place_blob(upload)
+
+
+async def place_blobs(uploads: list):
+    """Разложить загрузки по блобам - одним заходом в пул потоков"""
+    await run_in_threadpool(_place_blobs, uploads)
+
+
+def unlink(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _abort_all(writers: list):
+    for writer in writers:
+        writer.abort()
+
+
+def _discard_all(uploads: list):
+    for upload in uploads:
+        unlink(upload.tmp_path)
+
+
+async def discard_all(uploads: list):
+    """Удалить временные файлы; уже переехавшие на место блоба пропускаются"""
+    if uploads:
+        await run_in_threadpool(_discard_all, uploads)
+
+
+class UploadsListing(NamedTuple):
+    blobs: dict  # префикс 'ab' -> (все sha256 в blobs/ab, те из них, что старше grace)
+    legacy: list  # старые файлы в корне UPLOAD_DIR, старше grace
+    stale_uploads: list  # недописанные .upload-*.part, старше grace - полные пути
+
+
+def scan_uploads(grace: float) -> UploadsListing:
+    """Содержимое UPLOAD_DIR для сборки мусора (jobs.gc). Блокирующее - в пул потоков"""
+    cutoff = time.time() - grace
+    blobs = {f"{i:02x}": (set(), set()) for i in range(256)}
+    legacy, stale = [], []
+    if not os.path.isdir(UPLOAD_DIR):
+        return UploadsListing(blobs, legacy, stale)
+
+    for entry in os.scandir(UPLOAD_DIR):
+        if entry.is_file():
+            old = entry.stat().st_mtime < cutoff
+            if entry.name.startswith(".upload-"):
+                if old:
+                    stale.append(entry.path)
+            elif not entry.name.startswith(".") and old:
+                legacy.append(entry.name)
+
+    blobs_dir = os.path.join(UPLOAD_DIR, "blobs")
+    for prefix, (names, old) in blobs.items():
+        try:
+            entries = list(os.scandir(os.path.join(blobs_dir, prefix)))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if entry.is_file() and entry.name.startswith(prefix) and len(entry.name) == 64:
+                names.add(entry.name)
+                if entry.stat().st_mtime < cutoff:
+                    old.add(entry.name)
+    return UploadsListing(blobs, legacy, stale)
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+class MaxBodySizeMiddleware:
+    """413 на тело больше max_size. По Content-Length - сразу, ещё до чтения тела;
+    без него (chunked) или если заголовок врёт - считаем байты, которые читает приложение"""
+
+    def __init__(self, app, max_size: int):
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        response = JSONResponse({"detail": "Слишком большой файл"}, status_code=413)
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > self.max_size:
+                await response(scope, receive, send)
+                return
+
+        received = 0
+        too_large = False
+        started = False
+
+        async def receive_wrapper():
+            nonlocal received, too_large
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_size:
+                    too_large = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def send_wrapper(message):
+            nonlocal started
+            if too_large:
+                return  # приложение отвечает на оборванное тело (часто 400) - вместо этого будет 413
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        except Exception:
+            # FastAPI может завернуть _BodyTooLarge в свою ошибку разбора тела - смотрим на флаг
+            if not too_large or started:
+                raise
+        if too_large and not started:
+            await response(scope, receive, send)
@@ -0,0 +1,333 @@
+"""Расписание в файлах: разбор дат, сетка пар и потоковый разбор импорта (CSV / JSON / iCal)"""
+import codecs
+import csv
+import io
+import json
+import re
+from datetime import date, datetime, time
+from typing import BinaryIO, Iterator, Optional
+
+# Сетка пар ВГУ: номер пары -> (начало, конец)
+LESSON_TIMES = {
+    1: (time(8, 0), time(9, 35)),
+    2: (time(9, 45), time(11, 20)),
+    3: (time(11, 30), time(13, 5)),
+    4: (time(13, 25), time(15, 0)),
+    5: (time(15, 10), time(16, 45)),
+    6: (time(16, 55), time(18, 30)),
+    7: (time(18, 40), time(20, 0)),
+    8: (time(20, 10), time(21, 30)),
+}
+
+FORMATS = ("csv", "json", "ics")
+
+_READ_SIZE = 64 * 1024
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+def parse_day(date_str: str) -> date:
+    """Парсит ЛЮБОЙ формат: DD.MM.YYYY, YYYY-MM-DD, YYYY.MM.DD"""
+    date_str = date_str.strip()
+
+    # YYYY-MM-DD (ISO)
+    try:
+        return date.fromisoformat(date_str)
+    except ValueError:
+        pass
+
+    # DD.MM.YYYY
+    match = re.match(r'(\d{1,2})\.(\d{1,2})\.(\d{4})', date_str)
+    if match:
+        day, month, year = map(int, match.groups())
+        return date(year, month, day)
+
+    # YYYY.MM.DD
+    match = re.match(r'(\d{4})\.(\d{1,2})\.(\d{1,2})', date_str)
+    if match:
+        year, month, day = map(int, match.groups())
+        return date(year, month, day)
+
+    raise ValueError(f"Неверный формат даты: '{date_str}'. Используй DD.MM.YYYY, YYYY-MM-DD или YYYY.MM.DD")
+
+
+def lesson_number_at(start: time) -> int:
+    """Номер пары по времени начала - ближайшая по сетке LESSON_TIMES"""
+    minutes = start.hour * 60 + start.minute
+    return min(
+        LESSON_TIMES,
+        key=lambda n: abs(LESSON_TIMES[n][0].hour * 60 + LESSON_TIMES[n][0].minute - minutes),
+    )
+
+
+def detect_format(filename: Optional[str], content_type: Optional[str]) -> Optional[str]:
+    name = (filename or "").lower()
+    for fmt, suffixes in (("csv", (".csv",)), ("json", (".json", ".ndjson", ".jsonl")), ("ics", (".ics", ".ical"))):
+        if name.endswith(suffixes):
+            return fmt
+    content_type = (content_type or "").lower()
+    if "csv" in content_type:
+        return "csv"
+    if "json" in content_type:
+        return "json"
+    if "calendar" in content_type:
+        return "ics"
+    return None
+
+
+def _record(raw: dict) -> dict:
+    """Строка импорта -> {date, lesson_number, subject, teacher, room}"""
+    try:
+        day = raw["date"] if isinstance(raw.get("date"), date) else parse_day(str(raw["date"]))
+        lesson_number = int(raw["lesson_number"])
+    except KeyError as e:
+        raise ImportRowError(f"нет поля {e.args[0]}")
+    except (TypeError, ValueError) as e:
+        raise ImportRowError(str(e))
+    if lesson_number < 1:
+        raise ImportRowError(f"неверный номер пары: {lesson_number}")
+    return {
+        "date": day,
+        "lesson_number": lesson_number,
+        "subject": _text(raw.get("subject"), 100),
+        "teacher": _text(raw.get("teacher"), 100),
+        "room": _text(raw.get("room"), 20),
+    }
+
+
+def _text(value, limit: int) -> str:
+    # В JSON аудитория бывает числом: {"room": 305}
+    return "" if value is None else str(value)[:limit]
+
+
+def _iter_csv(text: io.TextIOBase) -> Iterator[dict]:
+    # Excel в русской локали сохраняет CSV через ';'
+    first = text.readline()
+    delimiter = ";" if first.count(";") > first.count(",") else ","
+    header = next(csv.reader([first], delimiter=delimiter))
+    for row in csv.DictReader(text, fieldnames=[h.strip().lower() for h in header], delimiter=delimiter):
+        yield row
+
+
+def _iter_json(text: io.TextIOBase) -> Iterator[dict]:
+    """Массив объектов или NDJSON - объекты выдаются по одному, файл целиком не читается"""
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,[]":
+            pos += 1
+        if pos == len(buf):
+            chunk = text.read(_READ_SIZE)
+            if not chunk:
+                return
+            buf, pos = chunk, 0
+            continue
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            chunk = text.read(_READ_SIZE)
+            if not chunk:
+                raise ImportRowError("битый JSON в конце файла")
+            buf, pos = buf[pos:] + chunk, 0
+            continue
+        if not isinstance(obj, dict):
+            raise ImportRowError("ожидается массив объектов")
+        yield obj
+        pos = end
+
+
+def _ics_unescape(value: str) -> str:
+    return re.sub(r"\\(.)", lambda m: "\n" if m.group(1) in "nN" else m.group(1), value)
+
+
+def _ics_datetime(value: str) -> datetime:
+    value = value.rstrip("Z")
+    if "T" in value:
+        return datetime.strptime(value[:15], "%Y%m%dT%H%M%S")
+    return datetime.strptime(value[:8], "%Y%m%d")
+
+
+def _iter_ics(text: io.TextIOBase) -> Iterator[dict]:
+    """VEVENT -> пара: DTSTART, SUMMARY (предмет), LOCATION (аудитория), преподаватель из
+    X-TEACHER, ORGANIZER;CN= или DESCRIPTION, номер пары из X-LESSON-NUMBER или по времени"""
+    event = None
+
+    def handle(line: str):
+        nonlocal event
+        name, _, value = line.partition(":")
+        key, *params = name.split(";")
+        key = key.upper()
+        if key == "BEGIN" and value.upper() == "VEVENT":
+            event = {}
+        elif key == "END" and value.upper() == "VEVENT" and event is not None:
+            finished, event = event, None
+            return finished
+        elif event is not None:
+            if key == "ORGANIZER":
+                for param in params:
+                    if param.upper().startswith("CN="):
+                        event.setdefault("ORGANIZER", param[3:].strip('"'))
+            else:
+                event[key] = value
+        return None
+
+    def to_raw(ev: dict) -> dict:
+        # Ошибки не бросаем - пусть _record отклонит только это событие
+        raw = {
+            "subject": _ics_unescape(ev.get("SUMMARY", "")),
+            "teacher": _ics_unescape(ev.get("X-TEACHER") or ev.get("ORGANIZER") or ev.get("DESCRIPTION", "")),
+            "room": _ics_unescape(ev.get("LOCATION", "")),
+        }
+        if "DTSTART" not in ev:
+            return raw
+        try:
+            start = _ics_datetime(ev["DTSTART"])
+        except ValueError:
+            raw["date"] = ev["DTSTART"]
+            raw["lesson_number"] = ev.get("X-LESSON-NUMBER", 1)
+            return raw
+        raw["date"] = start.date()
+        raw["lesson_number"] = ev.get("X-LESSON-NUMBER") or lesson_number_at(start.time())
+        return raw
+
+    # Строки iCal бывают «сложены»: продолжение начинается с пробела или таба
+    current = None
+    for raw_line in text:
+        line = raw_line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            finished = handle(current)
+            if finished is not None:
+                yield to_raw(finished)
+        current = line
+    if current is not None:
+        finished = handle(current)
+        if finished is not None:
+            yield to_raw(finished)
+
+
+def detect_encoding(fileobj: BinaryIO) -> str:
+    """utf-8 (с BOM или без), а если файл в нём не читается - cp1251: так сохраняет CSV русский Excel"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    fileobj.seek(0)
+    try:
+        while chunk := fileobj.read(_READ_SIZE):
+            decoder.decode(chunk)
+        decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        return "cp1251"
+    finally:
+        fileobj.seek(0)
+    return "utf-8-sig"
+
+
+def iter_import(fileobj: BinaryIO, fmt: str) -> Iterator:
+    """Записи импорта по одной: dict записи или ImportRowError для строки, которую пропускаем.
+
+    Синхронный генератор - крутить его нужно в пуле потоков (см. read_batch).
+    """
+    encoding = detect_encoding(fileobj)
+    text = io.TextIOWrapper(fileobj, encoding=encoding, newline="" if fmt == "csv" else None)
+    rows = {"csv": _iter_csv, "json": _iter_json, "ics": _iter_ics}[fmt](text)
+    while True:
+        try:
+            raw = next(rows)
+        except StopIteration:
+            break
+        except ImportRowError as e:
+            # Дальше такой поток не разобрать
+            yield e
+            break
+        except UnicodeDecodeError:
+            yield ImportRowError(f"файл не читается ни в UTF-8, ни в {encoding}")
+            break
+        try:
+            yield _record(raw)
+        except ImportRowError as e:
+            yield e
+    text.detach()
+
+
+def read_batch(records: Iterator, size: int) -> list:
+    batch = []
+    for item in records:
+        batch.append(item)
+        if len(batch) >= size:
+            break
+    return batch
+
+
+# --- Экспорт ---
+
+EXPORT_COLUMNS = ("date", "lesson_number", "subject", "teacher", "room")
+ICS_TIMEZONE = "Europe/Moscow"
+
+
+def _ics_escape(value: str) -> str:
+    return (value or "").replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+def _ics_fold(line: str) -> str:
+    """Строки iCal не длиннее 75 октетов, продолжение - с пробела (RFC 5545, 3.1)"""
+    raw = line.encode("utf-8")
+    if len(raw) <= 75:
+        return line + "\r\n"
+    parts = []
+    while raw:
+        limit = 75 if not parts else 74
+        cut = min(limit, len(raw))
+        # Не режем многобайтовый символ пополам
+        while cut < len(raw) and (raw[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(raw[:cut].decode("utf-8"))
+        raw = raw[cut:]
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def ics_header() -> str:
+    return (
+        "BEGIN:VCALENDAR\r\n"
+        "VERSION:2.0\r\n"
+        "PRODID:-//VSU//Schedule//RU\r\n"
+        "CALSCALE:GREGORIAN\r\n"
+        f"X-WR-TIMEZONE:{ICS_TIMEZONE}\r\n"
+    )
+
+
+def ics_footer() -> str:
+    return "END:VCALENDAR\r\n"
+
+
+def ics_event(lesson_id: int, day: date, lesson_number: int, subject: str, teacher: str, room: str,
+              stamp: str) -> str:
+    """VEVENT пары. Время - «плавающее» местное по сетке LESSON_TIMES, импорт понимает его обратно"""
+    lines = ["BEGIN:VEVENT", f"UID:lesson-{lesson_id}@schedule", f"DTSTAMP:{stamp}"]
+    if lesson_number in LESSON_TIMES:
+        start, end = LESSON_TIMES[lesson_number]
+        lines.append(f"DTSTART:{datetime.combine(day, start):%Y%m%dT%H%M%S}")
+        lines.append(f"DTEND:{datetime.combine(day, end):%Y%m%dT%H%M%S}")
+    else:
+        lines.append(f"DTSTART;VALUE=DATE:{day:%Y%m%d}")
+    lines.append(f"SUMMARY:{_ics_escape(subject) or f'Пара {lesson_number}'}")
+    if room:
+        lines.append(f"LOCATION:{_ics_escape(room)}")
+    if teacher:
+        lines.append(f"DESCRIPTION:{_ics_escape(teacher)}")
+        lines.append(f"X-TEACHER:{_ics_escape(teacher)}")
+    lines.append(f"X-LESSON-NUMBER:{lesson_number}")
+    lines.append("END:VEVENT")
+    return "".join(_ics_fold(line) for line in lines)
+
+
+def csv_rows(rows) -> str:
+    """Кусок CSV (те же колонки, что понимает импорт) для партии строк выгрузки"""
+    out = io.StringIO()
+    writer = csv.writer(out)
+    for row in rows:
+        writer.writerow((row.date.isoformat(), row.lesson_number, row.subject or "", row.teacher or "", row.room or ""))
+    return out.getvalue()
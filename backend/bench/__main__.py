@@ -0,0 +1,230 @@
+"""python -m bench --help"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date
+
+ENV_KNOBS = ("DB_POOL_SIZE", "DB_MAX_OVERFLOW", "METRICS_ENABLED", "SCHEDULE_CACHE_ENABLED", "BCRYPT_ROUNDS",
+             "COMPRESSION_ENABLED")
+
+
+def _flag(value: str) -> bool:
+    return value.lower() not in ("0", "false", "no", "off")
+
+
+def _set_pool_size(value):
+    from app import database
+    database.DB_POOL_SIZE = int(value)
+
+
+def _set_max_overflow(value):
+    from app import database
+    database.DB_MAX_OVERFLOW = int(value)
+
+
+def _set_metrics(value):
+    from app import metrics
+    metrics.METRICS_ENABLED = _flag(value)
+
+
+def _set_schedule_cache(value):
+    from app.cache import schedule_cache
+    schedule_cache.clear()
+    schedule_cache.enabled = _flag(value)
+
+
+def _set_compression(value):
+    from app import encoding
+    encoding.COMPRESSION_ENABLED = _flag(value)
+
+
+# Что можно менять между прогонами --sweep: приложение перезапускается (lifespan), так что
+# пул и инструментирование движка создаются заново уже с новым значением
+SWEEP_KNOBS = {
+    "DB_POOL_SIZE": _set_pool_size,
+    "DB_MAX_OVERFLOW": _set_max_overflow,
+    "METRICS_ENABLED": _set_metrics,
+    "SCHEDULE_CACHE_ENABLED": _set_schedule_cache,
+    "COMPRESSION_ENABLED": _set_compression,
+}
+
+
+def parse_sweep(value: str) -> tuple:
+    knob, _, values = (value or "").partition("=")
+    values = [v.strip() for v in values.split(",") if v.strip()]
+    if knob not in SWEEP_KNOBS or not values:
+        raise ValueError(f"--sweep: нужно NAME=v1,v2, NAME - одно из {', '.join(SWEEP_KNOBS)}")
+    return knob, values
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Нагрузочный прогон API расписания")
+    parser.add_argument("--database", help="DATABASE_URL; по умолчанию SQLite (aiosqlite) во временной папке")
+    parser.add_argument("--upload-dir", help="UPLOAD_DIR; по умолчанию временная папка")
+    parser.add_argument("--url", help="гонять запущенный сервер (uvicorn) вместо приложения в процессе")
+    parser.add_argument("--dates", type=int, default=60, help="дней в расписании")
+    parser.add_argument("--files", type=int, default=2, help="файлов на пару")
+    parser.add_argument("--file-size", type=int, default=64 * 1024, help="размер файла, байт")
+    parser.add_argument("--requests", type=int, default=500, help="запросов на сценарий")
+    parser.add_argument("--concurrency", type=int, default=16, help="одновременных клиентов")
+    parser.add_argument("--warmup", type=int, default=20, help="запросов прогрева (не считаются)")
+    parser.add_argument("--scenarios", default="all", help="через запятую; all - все, кроме тяжёлых "
+                        "(upload_large, export_csv, export_ics)")
+    parser.add_argument("--heavy-requests", type=int, default=10, help="запросов на тяжёлый сценарий")
+    parser.add_argument("--large-file-size", type=int, default=256 * 1024 ** 2,
+                        help="размер файла upload_large, байт")
+    parser.add_argument("--sweep", help="прогнать сценарии для каждого значения настройки, например "
+                        f"METRICS_ENABLED=1,0 или DB_POOL_SIZE=5,10,20; можно: {', '.join(SWEEP_KNOBS)}")
+    parser.add_argument("--explain", action="store_true", help="показать планы горячих запросов")
+    parser.add_argument("--seed", type=int, default=1, help="seed генератора данных и запросов")
+    parser.add_argument("--reset", action="store_true", help="удалить все таблицы перед заполнением")
+    parser.add_argument("--out", help="записать результаты в JSON")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=10.0, help="порог регрессии, %%")
+    parser.add_argument("--fail-on-regression", action="store_true", help="код выхода 1 при регрессии")
+    return parser.parse_args(argv)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def safe_url(url: str) -> str:
+    from sqlalchemy.engine import make_url
+    return make_url(url).render_as_string(hide_password=True)
+
+
+async def run_all(app, args, names: list, ds, scenarios: dict) -> dict:
+    import httpx
+    from . import runner
+
+    if args.url:
+        client_options = {"base_url": args.url}
+    else:
+        client_options = {"transport": httpx.ASGITransport(app=app), "base_url": "http://bench"}
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=600, limits=limits, **client_options) as client:
+        response = await client.post("/login", data={"username": ds.username, "password": ds.password})
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['token']}"}
+
+        results = {}
+        for name in names:
+            scenario = scenarios[name](ds, headers, args)
+            requests, warmup = (args.heavy_requests, 0) if scenario.heavy else (args.requests, args.warmup)
+            results[name] = await runner.run_scenario(
+                client, scenario, requests, args.concurrency, warmup, args.seed)
+        return results
+
+
+async def main(args) -> int:
+    # Настройки приложения читаются при импорте - env выставляем до него
+    from app import database
+    from app.main import app
+    from . import explain, runner, seed
+    from .scenarios import SCENARIOS
+
+    if args.scenarios == "all":
+        names = [name for name, cls in SCENARIOS.items() if not cls.heavy]
+    else:
+        names = [s.strip() for s in args.scenarios.split(",")]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        print(f"Нет таких сценариев: {', '.join(unknown)}. Есть: {', '.join(SCENARIOS)}", file=sys.stderr)
+        return 2
+    try:
+        knob, values = parse_sweep(args.sweep) if args.sweep else (None, [None])
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    if args.reset:
+        engine = database.make_engine(database.DATABASE_URL)
+        async with engine.begin() as conn:
+            await conn.run_sync(database.Base.metadata.drop_all)
+        await engine.dispose()
+
+    plans = None
+    async with app.router.lifespan_context(app):
+        async with database.sessionmaker() as db:
+            if not await seed.is_empty(db):
+                print("База не пустая: запустите с --reset (все данные будут удалены)", file=sys.stderr)
+                return 2
+
+        started = time.perf_counter()
+        ds = await seed.seed(database.sessionmaker, args.dates, args.files, args.file_size,
+                             date(2030, 1, 1), random.Random(args.seed))
+        print(f"Данные: {len(ds.days)} дней, {len(ds.lesson_ids)} пар, {len(ds.file_ids)} файлов "
+              f"за {time.perf_counter() - started:.1f} с")
+        if args.explain:
+            plans = await explain.explain(database.engine, database.sessionmaker, ds)
+            explain.print_plans(plans)
+
+    results, by_value = {}, {}
+    for value in values:
+        if knob is not None:
+            SWEEP_KNOBS[knob](value)
+            print(f"\n{knob}={value}")
+        # Своё приложение на каждое значение: пул, кэши и метрики начинают с нуля
+        async with app.router.lifespan_context(app):
+            current = await run_all(app, args, names, ds, SCENARIOS)
+        by_value[value] = current
+        suffix = f"@{knob}={value}" if knob is not None else ""
+        results.update({name + suffix: r for name, r in current.items()})
+
+    print()
+    runner.print_table(results)
+    for value in values[1:]:
+        print(f"\n{knob}: {values[0]} -> {value}")
+        runner.compare(by_value[values[0]], by_value[value], float("inf"))
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "database": safe_url(database.DATABASE_URL),
+            "target": args.url or "in-process",
+            "args": {k: v for k, v in vars(args).items() if k not in ("database", "out", "compare")},
+            "env": {k: os.environ[k] for k in ENV_KNOBS if k in os.environ},
+        },
+        "results": results,
+    }
+    if plans is not None:
+        report["explain"] = plans
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    failed = any(r["errors"] or r.get("problems") for r in results.values())
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = runner.compare(baseline["results"], results, args.threshold)
+        if regressions:
+            print(f"\nРегрессия больше {args.threshold}%: {', '.join(regressions)}")
+            if args.fail_on_regression:
+                failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ["DATABASE_URL"] = args.database or f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["UPLOAD_DIR"] = args.upload_dir or os.path.join(workdir, "uploads")
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(asyncio.run(main(args)))
@@ -0,0 +1,93 @@
+"""Планы горячих запросов на засеянной базе (--explain): идут ли они по индексам.
+
+Планы снимаются с того SQL, который реально отправляют crud и jobs (перехват
+before_cursor_execute), так что ORDER BY от relationship и прочее не теряются.
+На Postgres - EXPLAIN, на SQLite - EXPLAIN QUERY PLAN. На маленьких таблицах
+Postgres законно выбирает Seq Scan - смотреть имеет смысл от нескольких тысяч
+дней (--dates)."""
+import contextlib
+
+from sqlalchemy import event
+
+from app import crud, jobs
+from .seed import Dataset
+
+
+def hot_calls(ds: Dataset, sessionmaker) -> dict:
+    """имя -> async (db) -> None, вызов приложения с реальными id из датасета"""
+    lesson_id = ds.lesson_ids[len(ds.lesson_ids) // 2]
+    day = ds.days[len(ds.days) // 2]
+    date_from, date_to = ds.days[0], ds.days[min(30, len(ds.days) - 1)]
+
+    async def schedule_date(db):
+        await crud.get_schedule_date(db, day)
+
+    async def schedule_range(db):
+        await crud.get_schedule_range(db, date_from, date_to)
+
+    async def lesson_files(db):
+        await crud.get_lesson_files(db, lesson_id)
+
+    async def export_range(db):
+        async for _ in crud.stream_schedule_rows(db, date_from, date_to):
+            pass
+
+    async def next_job(db):
+        worker = jobs.Worker()
+        worker._sessionmaker = sessionmaker
+        await worker.run_one()
+
+    return {
+        "schedule_date": schedule_date,
+        "schedule_range": schedule_range,
+        "lesson_files": lesson_files,
+        "export_range": export_range,
+        "next_job": next_job,
+    }
+
+
+@contextlib.contextmanager
+def capture_sql(engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+
+
+def _uses_index(dialect: str, plan: str) -> bool:
+    if dialect == "postgresql":
+        return "Index" in plan and "Seq Scan" not in plan
+    return "USING" in plan and "SCAN" not in plan.replace("SCAN CONSTANT ROW", "")
+
+
+async def explain(engine, sessionmaker, ds: Dataset) -> dict:
+    """имя (с номером запроса, если их несколько) -> {"sql", "plan", "index": идут ли все таблицы по индексу}"""
+    result = {}
+    for name, call in hot_calls(ds, sessionmaker).items():
+        with capture_sql(engine) as statements:
+            async with sessionmaker() as db:
+                await call(db)
+        async with engine.connect() as conn:
+            dialect = conn.dialect.name
+            prefix = "EXPLAIN" if dialect == "postgresql" else "EXPLAIN QUERY PLAN"
+            for i, (statement, parameters) in enumerate(statements, 1):
+                rows = (await conn.exec_driver_sql(f"{prefix} {statement}", parameters)).all()
+                plan = "\n".join(str(row[-1]) for row in rows)
+                key = name if len(statements) == 1 else f"{name}#{i}"
+                result[key] = {"sql": " ".join(statement.split()), "plan": plan,
+                               "index": _uses_index(dialect, plan) and "TEMP B-TREE" not in plan}
+    return result
+
+
+def print_plans(plans: dict):
+    for name, item in plans.items():
+        print(f"\n{name}: {'индекс' if item['index'] else 'БЕЗ ИНДЕКСА'}")
+        print(f"    {item['sql'][:200]}")
+        for line in item["plan"].splitlines():
+            print(f"    {line}")
@@ -0,0 +1,161 @@
+"""Прогон сценариев: N запросов с заданной параллельностью, пропускная способность и перцентили"""
+import asyncio
+import itertools
+import os
+import random
+import resource
+import time
+from typing import List
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Nearest-rank по уже отсортированному списку"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(p / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies: List[float], errors: int, statuses: dict, wall: float) -> dict:
+    latencies = sorted(latencies)
+    ms = lambda seconds: round(seconds * 1000, 3)  # noqa: E731
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "statuses": dict(sorted(statuses.items())),
+        "seconds": round(wall, 3),
+        "rps": round(len(latencies) / wall, 1) if wall else 0.0,
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else 0.0,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "max_ms": ms(latencies[-1]) if latencies else 0.0,
+    }
+
+
+def rss_bytes() -> int:
+    """Текущий RSS процесса; где нет /proc - пиковый за всё время (getrusage)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class LoopMonitor:
+    """Пока идёт замер: на сколько опаздывает sleep(interval) в event loop и пиковый RSS.
+
+    Приложение в процессе (без --url) живёт в том же loop - опоздание и есть
+    время, на которое его заблокировали. С --url это loop клиента, не сервера
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.lags = []
+        self.rss_start = self.rss_peak = 0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, time.perf_counter() - started - self.interval))
+            self.rss_peak = max(self.rss_peak, rss_bytes())
+
+    def start(self):
+        self.rss_start = self.rss_peak = rss_bytes()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> dict:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        lags = sorted(self.lags)
+        mb = lambda n: round(n / 1024 ** 2, 1)  # noqa: E731
+        return {
+            "loop_lag_p99_ms": round(percentile(lags, 99) * 1000, 3),
+            "loop_lag_max_ms": round(lags[-1] * 1000, 3) if lags else 0.0,
+            "rss_start_mb": mb(self.rss_start),
+            "rss_peak_mb": mb(self.rss_peak),
+        }
+
+
+async def run_scenario(client, scenario, requests: int, concurrency: int, warmup: int, seed: int) -> dict:
+    # Один счётчик на прогрев и замер: номера запросов не повторяются (важно для first_access)
+    counter = itertools.count()
+
+    async def drive(limit: int, latencies: list, statuses: dict, worker: int):
+        rng = random.Random(seed * 1000 + worker)
+        errors = 0
+        while (i := next(counter)) < limit:
+            started = time.perf_counter()
+            try:
+                response = await scenario.request(client, rng, i)
+                status = response.status_code
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+            if not isinstance(status, int) or status >= 400:
+                errors += 1
+        return errors
+
+    if warmup:
+        await asyncio.gather(*(drive(warmup, [], {}, w) for w in range(concurrency)))
+        counter = itertools.count(warmup)
+    scenario.reset()
+
+    latencies, statuses = [], {}
+    monitor = LoopMonitor()
+    monitor.start()
+    started = time.perf_counter()
+    errors = await asyncio.gather(*(drive(warmup + requests, latencies, statuses, w) for w in range(concurrency)))
+    wall = time.perf_counter() - started
+    loop_stats = await monitor.stop()
+
+    result = summarize(latencies, sum(errors), {str(k): v for k, v in statuses.items()}, wall)
+    result.update(loop_stats)
+    result.update(scenario.report())
+    problems = await scenario.verify(client)
+    if problems:
+        result["problems"] = problems
+    return result
+
+
+def print_table(results: dict):
+    width = max([16] + [len(name) + 2 for name in results])
+    header = (f"{'scenario':<{width}}{'req':>7}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+              f"{'lag p99':>10}{'rss MB':>9}")
+    print(header)
+    print("-" * len(header))
+    for name, r in results.items():
+        print(f"{name:<{width}}{r['requests']:>7}{r['errors']:>6}{r['rps']:>9}{r['p50_ms']:>10}{r['p95_ms']:>10}"
+              f"{r['p99_ms']:>10}{r.get('loop_lag_p99_ms', ''):>10}{r.get('rss_peak_mb', ''):>9}")
+        extra = {k: v for k, v in r.items() if k not in SUMMARY_KEYS}
+        if extra:
+            print("  " + ", ".join(f"{k}={v}" for k, v in extra.items()))
+        for problem in r.get("problems", ()):
+            print(f"  ! {problem}")
+
+
+SUMMARY_KEYS = {"requests", "errors", "statuses", "seconds", "rps", "mean_ms", "p50_ms", "p95_ms", "p99_ms",
+                "max_ms", "loop_lag_p99_ms", "loop_lag_max_ms", "rss_start_mb", "rss_peak_mb", "problems"}
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    """Печатает разницу с прошлым прогоном; возвращает сценарии, где стало хуже больше threshold %"""
+    regressions = []
+    print(f"\n{'scenario':<16}{'rps':>18}{'p95 ms':>22}")
+    for name, r in current.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        rps_delta = (r["rps"] - base["rps"]) / base["rps"] * 100 if base["rps"] else 0.0
+        p95_delta = (r["p95_ms"] - base["p95_ms"]) / base["p95_ms"] * 100 if base["p95_ms"] else 0.0
+        print(f"{name:<16}{base['rps']:>8} -> {r['rps']:<8}{rps_delta:+.1f}%"
+              f"{base['p95_ms']:>10} -> {r['p95_ms']:<8}{p95_delta:+.1f}%")
+        if rps_delta < -threshold or p95_delta > threshold:
+            regressions.append(name)
+    return regressions
@@ -0,0 +1,288 @@
+"""Сценарии нагрузки: один запрос сценария = один вызов request()"""
+import itertools
+import random
+import time
+from datetime import timedelta
+
+from .runner import percentile
+from .seed import SUBJECTS, TEACHERS, Dataset
+
+# Номер экземпляра сценария: при --sweep один сценарий гоняется несколько раз на тех же
+# данных - загрузки и «первый доступ» не должны попадать в уже созданное прошлым прогоном
+_runs = itertools.count()
+
+
+class Scenario:
+    name = ""
+    # Тяжёлые (выгрузка всего расписания, загрузка сотен МБ) не входят в all,
+    # идут без прогрева и --heavy-requests запросов вместо --requests
+    heavy = False
+
+    def __init__(self, ds: Dataset, headers: dict, options):
+        self.ds = ds
+        self.headers = headers
+        self.options = options
+        self.file_size = options.file_size
+        self.concurrency = options.concurrency
+        self.run = next(_runs)
+
+    async def request(self, client, rng: random.Random, i: int):
+        raise NotImplementedError
+
+    def reset(self):
+        """Перед замером, после прогрева"""
+
+    def report(self) -> dict:
+        """Свои показатели сценария - попадут в результат рядом с перцентилями"""
+        return {}
+
+    async def verify(self, client) -> list:
+        """Проверка результата после прогона - список проблем"""
+        return []
+
+
+class ScheduleDay(Scenario):
+    name = "schedule_day"
+
+    async def request(self, client, rng, i):
+        return await client.get(f"/schedule/{rng.choice(self.ds.days)}", headers=self.headers)
+
+
+class ScheduleWeek(Scenario):
+    name = "schedule_week"
+
+    async def request(self, client, rng, i):
+        start = rng.choice(self.ds.days)
+        params = {"from": start.isoformat(), "to": (start + timedelta(days=6)).isoformat()}
+        return await client.get("/schedule", params=params, headers=self.headers)
+
+
+class Dates(Scenario):
+    name = "dates"
+
+    async def request(self, client, rng, i):
+        return await client.get("/dates", params={"aggregate": "true", "limit": 31}, headers=self.headers)
+
+
+class Login(Scenario):
+    name = "login"
+
+    async def request(self, client, rng, i):
+        return await client.post("/login", data={"username": self.ds.username, "password": self.ds.password})
+
+
+class LoginStorm(Scenario):
+    """Вход вперемешку с чтением расписания: половина клиентов логинится (bcrypt в пуле
+    потоков), половина читает дни. Показывает, не встаёт ли чтение, пока идут логины.
+    200 одновременных логинов: --concurrency 400"""
+    name = "login_storm"
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.reset()
+
+    def reset(self):
+        self.latencies = {"login": [], "read": []}
+
+    async def request(self, client, rng, i):
+        kind = "login" if i % 2 == 0 else "read"
+        started = time.perf_counter()
+        if kind == "login":
+            response = await client.post("/login", data={"username": self.ds.username, "password": self.ds.password})
+        else:
+            response = await client.get(f"/schedule/{rng.choice(self.ds.days)}", headers=self.headers)
+        self.latencies[kind].append(time.perf_counter() - started)
+        return response
+
+    def report(self):
+        result = {}
+        for kind, latencies in self.latencies.items():
+            latencies.sort()
+            result[f"{kind}_p50_ms"] = round(percentile(latencies, 50) * 1000, 3)
+            result[f"{kind}_p99_ms"] = round(percentile(latencies, 99) * 1000, 3)
+        return result
+
+
+class Upload(Scenario):
+    name = "upload"
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.payload = random.Random(0).randbytes(self.file_size)
+
+    async def request(self, client, rng, i):
+        # Уникальное содержимое - иначе сработает дедупликация блобов и диск не пишется
+        content = self.run.to_bytes(4, "big") + i.to_bytes(8, "big") + self.payload
+        return await client.post(
+            f"/lessons/{rng.choice(self.ds.lesson_ids)}/files",
+            files={"file": (f"bench_{i}.bin", content, "application/octet-stream")},
+            headers=self.headers,
+        )
+
+
+class UploadBatch(Upload):
+    """POST /upload: BATCH_FILES файлов к паре одним запросом"""
+    name = "upload_batch"
+    BATCH_FILES = 10
+
+    async def request(self, client, rng, i):
+        files = [
+            ("files", (f"bench_{i}_{n}.bin",
+                       self.run.to_bytes(4, "big") + (i * self.BATCH_FILES + n).to_bytes(8, "big") + self.payload,
+                       "application/octet-stream"))
+            for n in range(self.BATCH_FILES)
+        ]
+        return await client.post("/upload", data={"lesson_id": rng.choice(self.ds.lesson_ids)}, files=files,
+                                 headers=self.headers)
+
+
+class UploadLarge(Scenario):
+    """Большие файлы (--large-file-size) потоком: клиент не держит файл в памяти целиком,
+    так что рост rss_peak_mb и loop_lag - это сервер. Например:
+    --scenarios upload_large --large-file-size 268435456 --concurrency 8 --heavy-requests 16"""
+    name = "upload_large"
+    heavy = True
+    BOUNDARY = "bench-large-upload"
+    BLOCK = 1024 * 1024
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.size = self.options.large_file_size
+        self.block = random.Random(0).randbytes(self.BLOCK)
+
+    async def request(self, client, rng, i):
+        head = (f"--{self.BOUNDARY}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"large_{i}.bin\"\r\n"
+                "Content-Type: application/octet-stream\r\n\r\n").encode()
+        tail = f"\r\n--{self.BOUNDARY}--\r\n".encode()
+        size = self.size
+
+        async def body():
+            yield head
+            yield self.run.to_bytes(4, "big") + i.to_bytes(4, "big")  # своё содержимое - без дедупликации
+            left = size
+            while left > 0:
+                chunk = self.block[:min(left, self.BLOCK)]
+                left -= len(chunk)
+                yield chunk
+            yield tail
+
+        headers = {
+            **self.headers,
+            "Content-Type": f"multipart/form-data; boundary={self.BOUNDARY}",
+            "Content-Length": str(len(head) + 8 + size + len(tail)),
+        }
+        return await client.post(f"/lessons/{rng.choice(self.ds.lesson_ids)}/files", content=body(),
+                                 headers=headers)
+
+
+class Download(Scenario):
+    name = "download"
+
+    async def request(self, client, rng, i):
+        return await client.get(f"/files/download/{rng.choice(self.ds.file_ids)}", headers=self.headers)
+
+
+class DownloadRange(Scenario):
+    name = "download_range"
+
+    async def request(self, client, rng, i):
+        headers = {**self.headers, "Range": "bytes=0-16383"}
+        return await client.get(f"/files/download/{rng.choice(self.ds.file_ids)}", headers=headers)
+
+
+class Search(Scenario):
+    name = "search"
+
+    async def request(self, client, rng, i):
+        word = rng.choice(SUBJECTS + TEACHERS).split()[0]
+        # Префикс: поиск по началу слова - самый частый случай в поисковой строке
+        q = word[:max(4, len(word) - 2)]
+        return await client.get("/search", params={"q": q}, headers=self.headers)
+
+
+class Export(Scenario):
+    """Выгрузка всего засеянного диапазона потоком; считает строки на лету, не копя тело.
+    100k пар: --dates 12500 --files 0 --scenarios export_csv,export_ics"""
+    heavy = True
+    path = ""
+    marker = b""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.reset()
+
+    def reset(self):
+        self.counts = []
+
+    async def request(self, client, rng, i):
+        params = {"from": self.ds.days[0].isoformat(), "to": self.ds.days[-1].isoformat()}
+        count, carry = 0, b""
+        async with client.stream("GET", self.path, params=params, headers=self.headers) as response:
+            async for chunk in response.aiter_bytes():
+                data = carry + chunk
+                count += data.count(self.marker)
+                # Маркер мог разрезаться между кусками
+                carry = data[-(len(self.marker) - 1):]
+        self.counts.append(self.rows(count))
+        return response
+
+    def rows(self, count: int) -> int:
+        return count
+
+    def report(self):
+        return {"lessons_exported": max(self.counts, default=0)}
+
+    async def verify(self, client):
+        expected = len(self.ds.lesson_ids)
+        wrong = sorted({n for n in self.counts if n != expected})
+        return [f"выгружено {n} пар вместо {expected}" for n in wrong]
+
+
+class ExportCsv(Export):
+    name = "export_csv"
+    path = "/schedule/export.csv"
+    marker = b"\r\n"
+
+    def rows(self, count):
+        return count - 1  # заголовок
+
+
+class ExportIcs(Export):
+    name = "export_ics"
+    path = "/schedule/export.ics"
+    marker = b"BEGIN:VEVENT"
+
+
+class FirstAccess(Scenario):
+    """concurrency одновременных POST /schedule/{день} на ещё не существующий день.
+    После прогона в каждом таком дне должно быть ровно 8 пар"""
+    name = "first_access"
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.max_i = -1
+
+    def day(self, i: int):
+        return self.ds.fresh_day + timedelta(days=1000 * self.run + i // self.concurrency)
+
+    async def request(self, client, rng, i):
+        self.max_i = max(self.max_i, i)
+        return await client.post(f"/schedule/{self.day(i)}", headers=self.headers)
+
+    async def verify(self, client):
+        problems = []
+        last_day = self.day(self.max_i)
+        day = self.day(0)
+        while day <= last_day:
+            response = await client.get(f"/schedule/{day}", headers=self.headers)
+            lessons = response.json().get("lessons", []) if response.status_code == 200 else None
+            if lessons is None or len(lessons) != 8:
+                problems.append(f"{day}: {response.status_code}, пар: {None if lessons is None else len(lessons)}")
+            day += timedelta(days=1)
+        return problems
+
+
+SCENARIOS = {cls.name: cls for cls in (
+    ScheduleDay, ScheduleWeek, Dates, Login, LoginStorm, Upload, UploadBatch, UploadLarge, Download, DownloadRange,
+    Search, ExportCsv, ExportIcs, FirstAccess,
+)}
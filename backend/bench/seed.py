@@ -0,0 +1,97 @@
+"""Синтетическое расписание: N дней x 8 пар x M файлов на пару, через модели приложения"""
+import hashlib
+import os
+import random
+from datetime import date, timedelta
+from typing import List, NamedTuple
+
+from sqlalchemy import func, select
+
+from app import crud, models, storage
+
+BENCH_USERNAME = "bench"
+BENCH_PASSWORD = "bench-password"
+
+SUBJECTS = [
+    "Математический анализ", "Линейная алгебра", "Дискретная математика", "Программирование",
+    "Базы данных", "Операционные системы", "Физика", "Английский язык", "История", "Философия",
+    "Компьютерные сети", "Теория вероятностей",
+]
+TEACHERS = [
+    "Иванов И.И.", "Петрова А.С.", "Сидоров П.П.", "Кузнецова Е.В.", "Смирнов Д.А.",
+    "Попова О.Н.", "Волков С.Г.", "Соколова М.И.",
+]
+FILE_NAMES = ["лекция", "конспект", "задание", "презентация", "lab", "slides"]
+FILE_EXTENSIONS = [".pdf", ".docx", ".pptx", ".zip", ".txt"]
+
+
+class Dataset(NamedTuple):
+    days: List[date]
+    lesson_ids: List[int]
+    file_ids: List[int]
+    fresh_day: date  # первый день после данных - для сценария первого обращения
+    username: str
+    password: str
+
+
+async def is_empty(db) -> bool:
+    return (await db.execute(select(func.count()).select_from(models.ScheduleDate))).scalar_one() == 0
+
+
+def _write_blob(content: bytes) -> str:
+    sha256 = hashlib.sha256(content).hexdigest()
+    path = storage.blob_path(sha256)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+    return sha256
+
+
+async def seed(sessionmaker, dates: int, files_per_lesson: int, file_size: int, start: date,
+               rng: random.Random) -> Dataset:
+    days = [start + timedelta(days=i) for i in range(dates)]
+    lesson_ids, file_ids = [], []
+
+    async with sessionmaker() as db:
+        user = await crud.create_user(db, BENCH_USERNAME, "Bench", BENCH_PASSWORD)
+
+        # Пачками по месяцу - один flush на пачку, а не на строку
+        for offset in range(0, dates, 30):
+            schedule_dates = [models.ScheduleDate(date=day, notes="") for day in days[offset:offset + 30]]
+            db.add_all(schedule_dates)
+            await db.flush()
+
+            lessons = [
+                models.Lesson(
+                    date_id=sd.id,
+                    lesson_number=number,
+                    subject=rng.choice(SUBJECTS),
+                    teacher=rng.choice(TEACHERS),
+                    room=str(rng.randint(100, 520)),
+                )
+                for sd in schedule_dates for number in range(1, crud.DEFAULT_LESSONS + 1)
+            ]
+            db.add_all(lessons)
+            await db.flush()
+
+            files = []
+            for lesson in lessons:
+                for _ in range(files_per_lesson):
+                    content = rng.randbytes(file_size)
+                    sha256 = _write_blob(content)
+                    db.add(models.Blob(sha256=sha256, size_bytes=file_size, refcount=1))
+                    files.append(models.File(
+                        user_id=user.id,
+                        lesson_id=lesson.id,
+                        blob_sha256=sha256,
+                        filename=rng.choice(FILE_NAMES) + f"_{lesson.id}" + rng.choice(FILE_EXTENSIONS),
+                        size_bytes=file_size,
+                    ))
+            db.add_all(files)
+            await db.flush()
+
+            lesson_ids += [lesson.id for lesson in lessons]
+            file_ids += [file.id for file in files]
+        await db.commit()
+
+    return Dataset(days, lesson_ids, file_ids, days[-1] + timedelta(days=1), BENCH_USERNAME, BENCH_PASSWORD)
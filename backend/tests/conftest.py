@@ -0,0 +1,75 @@
+"""Приложение целиком на SQLite во временной папке: один lifespan на все тесты,
+один пользователь, у каждого теста свой день расписания (фикстура day)"""
+import contextlib
+import itertools
+import os
+import tempfile
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import event
+
+# Настройки приложения читаются при импорте - env выставляем до него
+_workdir = tempfile.mkdtemp(prefix="tests-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(_workdir, 'test.db')}"
+os.environ["UPLOAD_DIR"] = os.path.join(_workdir, "uploads")
+os.environ["CACHE_BACKEND"] = "memory"
+os.environ["BCRYPT_ROUNDS"] = "4"
+# Фоновый воркер ходит в ту же базу и сбивал бы подсчёт запросов
+os.environ["JOBS_ENABLED"] = "0"
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app import database  # noqa: E402
+from app.main import app  # noqa: E402
+
+_days = itertools.count()
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as c:
+        yield c
+
+
+def login(client, username: str) -> dict:
+    """Заголовки с токеном пользователя username (создаётся при первом вызове)"""
+    client.post("/register", data={"name": "Тест", "username": username, "password": "secret1"})
+    response = client.post("/login", data={"username": username, "password": "secret1"})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['token']}"}
+
+
+@pytest.fixture(scope="session")
+def headers(client):
+    return login(client, "tester")
+
+
+@pytest.fixture
+def day(client, headers) -> str:
+    """Новый день с 8 пустыми парами"""
+    value = (date(2031, 1, 1) + timedelta(days=next(_days))).isoformat()
+    client.post(f"/schedule/{value}", headers=headers).raise_for_status()
+    return value
+
+
+def upload(client, headers, lesson_id: int, content: bytes, filename: str = "notes.txt") -> int:
+    response = client.post(f"/lessons/{lesson_id}/files", headers=headers, files={"file": (filename, content)})
+    response.raise_for_status()
+    return response.json()["id"]
+
+
+@contextlib.contextmanager
+def capture_sql():
+    """(statement, parameters) всех запросов, ушедших в базу внутри блока"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    engine = database.engine.sync_engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
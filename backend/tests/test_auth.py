@@ -0,0 +1,57 @@
+"""Отзыв токена (POST /logout) виден всем воркерам, в том числе запущенным позже"""
+from datetime import datetime
+
+from app import auth, database, jobs, models
+from conftest import login
+
+
+def test_logout_survives_worker_restart(client):
+    headers = login(client, "logout_user")
+    assert client.get("/dates", headers=headers).status_code == 200
+
+    assert client.post("/logout", headers=headers).status_code == 200
+    assert client.get("/dates", headers=headers).status_code == 401
+
+    # Новый воркер: в памяти ни проверенных токенов, ни полученных отзывов
+    auth._verified_tokens.clear()
+    auth._revoked.clear()
+    response = client.get("/dates", headers=headers)
+    assert response.status_code == 401
+    assert response.json()["detail"] == "Токен отозван"
+
+    # Повторный выход тем же токеном не падает на уже записанном отзыве
+    auth._revoked.clear()
+    client.portal.call(auth.revoke_token, headers["Authorization"].removeprefix("Bearer "))
+
+
+def test_gc_prunes_expired_revocations(client):
+    async def run():
+        async with database.sessionmaker() as db:
+            db.add(models.RevokedToken(token_hash="0" * 64, expires_at=datetime(2000, 1, 1)))
+            await db.commit()
+            report = await jobs.gc(db, {})
+            await db.commit()
+            return report, await db.get(models.RevokedToken, "0" * 64)
+
+    report, row = client.portal.call(run)
+    assert report["pruned_revocations"] >= 1
+    assert row is None
+
+
+def test_stream_ticket_instead_of_token_in_url(client, headers, monkeypatch):
+    response = client.post("/schedule/stream/ticket", headers=headers)
+    assert response.status_code == 200
+    ticket = response.json()["ticket"]
+    user_id = client.portal.call(auth.verify_token, headers["Authorization"].removeprefix("Bearer "))
+    assert client.portal.call(auth.stream_user_id, ticket, None) == user_id
+
+    # Сам токен в URL больше не принимается, а билет - не токен для остального API
+    token = headers["Authorization"].removeprefix("Bearer ")
+    stream = "/schedule/stream?dates=2031-01-01"
+    assert client.get(f"{stream}&token={token}").status_code == 401
+    assert client.get(f"{stream}&ticket={token}").status_code == 401
+    assert client.get("/dates", headers={"Authorization": f"Bearer {ticket}"}).status_code == 401
+
+    monkeypatch.setattr(auth, "STREAM_TICKET_TTL", -1)
+    expired = auth.create_stream_ticket(user_id)
+    assert client.get(f"{stream}&ticket={expired}").status_code == 401
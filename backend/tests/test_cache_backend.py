@@ -0,0 +1,253 @@
+"""PostgresNotifyBackend на поддельном asyncpg: доставка между воркерами, обрыв LISTEN, размер NOTIFY"""
+import asyncio
+import json
+from datetime import date, timedelta
+
+import pytest
+
+from app import cache, events
+
+_sleep = asyncio.sleep  # до monkeypatch в тесте паузы переподключения
+# Что воркер получает после переподключения LISTEN
+RESYNC = [cache.RESYNC_ALL, {"kind": "token", "flush": True}]
+
+
+class FakePostgres:
+    """Один канал NOTIFY на всех, как у общего сервера Postgres"""
+
+    def __init__(self):
+        self.connections = []
+        self.fail_connects = 0
+        self.connects = 0
+        self.notifies = []
+
+    async def connect(self):
+        self.connects += 1
+        if self.fail_connects:
+            self.fail_connects -= 1
+            raise ConnectionRefusedError("postgres недоступен")
+        conn = FakeConnection(self)
+        self.connections.append(conn)
+        return conn
+
+    def notify(self, channel: str, payload: str):
+        if len(payload.encode()) >= 8000:
+            raise ValueError("payload string too long")  # как pg_notify
+        self.notifies.append(payload)
+        for conn in list(self.connections):
+            for callback in conn.listeners.get(channel, ()):
+                callback(conn, 1, channel, payload)
+
+
+class FakeConnection:
+    """То, чем PostgresNotifyBackend пользуется у asyncpg.Connection"""
+
+    def __init__(self, server: FakePostgres):
+        self.server = server
+        self.listeners = {}
+        self.termination_listeners = []
+        self.dead = False
+
+    async def add_listener(self, channel, callback):
+        self.listeners.setdefault(channel, []).append(callback)
+
+    async def remove_listener(self, channel, callback):
+        self.listeners[channel].remove(callback)
+
+    def add_termination_listener(self, callback):
+        self.termination_listeners.append(callback)
+
+    def remove_termination_listener(self, callback):
+        self.termination_listeners.remove(callback)
+
+    async def execute(self, query, *args):
+        if self.dead:
+            raise ConnectionResetError("connection is closed")
+        if query == "SELECT pg_notify($1, $2)":
+            self.server.notify(*args)
+
+    async def close(self):
+        self.dead = True
+        if self in self.server.connections:
+            self.server.connections.remove(self)
+
+    def terminate(self):
+        """Сервер закрыл соединение (asyncpg зовёт termination listeners)"""
+        self.dead = True
+        self.server.connections.remove(self)
+        for callback in list(self.termination_listeners):
+            callback(self)
+
+    def drop(self):
+        """Соединение молча умерло: ни FIN, ни termination listener"""
+        self.dead = True
+        self.server.connections.remove(self)
+
+
+async def _until(condition, timeout: float = 2.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "не дождались"
+        await _sleep(0.001)
+
+
+async def _worker(server: FakePostgres):
+    backend = cache.PostgresNotifyBackend("test_channel", connect=server.connect)
+    received = []
+    backend.subscribe(received.append)
+    await backend.start()
+    return backend, received
+
+
+def test_other_workers_get_message_sender_applies_once():
+    async def run():
+        server = FakePostgres()
+        (a, a_got), (b, b_got) = await _worker(server), await _worker(server)
+        try:
+            message = {"kind": "schedule", "date": "2031-01-01", "event": {"type": "date"}}
+            await a.publish(message)
+            # Своё сообщение - сразу и один раз, эхо из NOTIFY отбрасывается по origin
+            assert a_got == [message]
+            assert b_got == [message]
+            assert json.loads(server.notifies[0])["origin"] == a.origin
+        finally:
+            await a.stop()
+            await b.stop()
+
+    asyncio.run(run())
+
+
+def test_termination_reconnects_and_resyncs(monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_RECONNECT_DELAY", 0.001)
+
+    async def run():
+        server = FakePostgres()
+        a, a_got = await _worker(server)
+        broadcaster = events.Broadcaster()
+        a.subscribe(broadcaster.apply_message)
+        subscription = broadcaster.subscribe(["2031-01-01", "2031-01-02"])
+        cache.schedule_cache.set(date(2031, 1, 1), 1, [1, 2], b"{}")
+        a.subscribe(cache._apply_schedule_invalidation)
+        try:
+            server.connections[0].terminate()
+            await _until(lambda: a.reconnects == 1)
+
+            assert a_got == RESYNC
+            assert cache.schedule_cache.get(date(2031, 1, 1)) is None
+            assert subscription.queue.get_nowait() == {"type": "resync", "dates": ["2031-01-01", "2031-01-02"]}
+            assert len(server.connections) == 1
+
+            # После переподключения снова слушаем
+            b, _ = await _worker(server)
+            await b.publish({"kind": "schedule", "date": "2031-01-03"})
+            assert a_got[-1] == {"kind": "schedule", "date": "2031-01-03"}
+            await b.stop()
+        finally:
+            await a.stop()
+
+    asyncio.run(run())
+
+
+def test_silent_drop_found_by_ping(monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_LISTEN_CHECK_INTERVAL", 0.01)
+    monkeypatch.setattr(cache, "CACHE_RECONNECT_DELAY", 0.001)
+
+    async def run():
+        server = FakePostgres()
+        a, a_got = await _worker(server)
+        try:
+            server.connections[0].drop()
+            await _until(lambda: a.reconnects == 1)
+            assert a_got == RESYNC
+            assert server.connects == 2
+        finally:
+            await a.stop()
+
+    asyncio.run(run())
+
+
+def test_reconnect_backs_off_while_connect_fails(monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_RECONNECT_DELAY", 1)
+    delays = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+        await _sleep(0)
+
+    async def run():
+        server = FakePostgres()
+        a, a_got = await _worker(server)
+        monkeypatch.setattr(cache.asyncio, "sleep", fake_sleep)
+        try:
+            server.fail_connects = 7
+            server.connections[0].terminate()
+            await _until(lambda: a.reconnects == 1)
+            assert delays == [1, 2, 4, 8, 16, 30, 30]
+            assert server.connects == 1 + 8
+            assert a_got == RESYNC
+        finally:
+            await a.stop()
+
+    asyncio.run(run())
+
+
+def test_publish_while_disconnected_applies_locally(monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_RECONNECT_DELAY", 0.001)
+
+    async def run():
+        server = FakePostgres()
+        a, a_got = await _worker(server)
+        server.fail_connects = 10 ** 6
+        try:
+            server.connections[0].terminate()
+            await _until(lambda: server.connects > 2)
+            await a.publish({"kind": "schedule", "date": "2031-01-01"})
+            assert a_got == [{"kind": "schedule", "date": "2031-01-01"}]
+            assert server.notifies == []
+        finally:
+            await a.stop()
+
+    asyncio.run(run())
+
+
+def test_large_date_list_split_under_notify_limit():
+    days = [(date(2031, 1, 1) + timedelta(days=i)).isoformat() for i in range(1000)]
+
+    async def run():
+        server = FakePostgres()
+        (a, _), (b, b_got) = await _worker(server), await _worker(server)
+        broadcaster = events.Broadcaster()
+        b.subscribe(broadcaster.apply_message)
+        subscription = broadcaster.subscribe(days[:3] + days[-3:])
+        try:
+            await a.publish({"kind": "schedule", "dates": days, "date_id": 7, "event": {"type": "import"}})
+            assert len(server.notifies) > 1
+            assert [d for m in b_got for d in m["dates"]] == days
+            assert [m.get("date_id") for m in b_got] == [7] + [None] * (len(b_got) - 1)
+            got = [subscription.queue.get_nowait()["date"] for _ in range(subscription.queue.qsize())]
+            assert sorted(got) == sorted(days[:3] + days[-3:])
+        finally:
+            await a.stop()
+            await b.stop()
+
+    asyncio.run(run())
+
+
+def test_unsplittable_message_falls_back_to_resync():
+    async def run():
+        server = FakePostgres()
+        (a, a_got), (b, b_got) = await _worker(server), await _worker(server)
+        try:
+            message = {"kind": "schedule", "date": "2031-01-01", "event": {"type": "lesson", "note": "x" * 9000}}
+            await a.publish(message)
+            assert a_got == [message]
+            assert b_got == [cache.RESYNC_ALL]
+
+            with pytest.raises(ValueError):
+                a._payloads({"kind": "token", "flush": "x" * 9000})
+        finally:
+            await a.stop()
+            await b.stop()
+
+    asyncio.run(run())
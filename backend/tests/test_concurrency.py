@@ -0,0 +1,57 @@
+"""Первый одновременный доступ к дню: одна строка даты и ровно 8 пар"""
+import asyncio
+
+import httpx
+from sqlalchemy import func, select
+
+from app import database, models
+from app.main import app
+
+REQUESTS = 100
+
+
+def _fire(client, requests):
+    """Все запросы разом - в event loop приложения (client.portal), иначе engine не тот"""
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await asyncio.gather(*(http.request(method, url, headers=headers)
+                                          for method, url, headers in requests))
+    return client.portal.call(run)
+
+
+def _counts(client, day: str):
+    async def run():
+        async with database.sessionmaker() as db:
+            dates = (await db.execute(
+                select(func.count()).select_from(models.ScheduleDate).where(models.ScheduleDate.date == day)
+            )).scalar()
+            lessons = (await db.execute(
+                select(func.count()).select_from(models.Lesson)
+                .join(models.ScheduleDate).where(models.ScheduleDate.date == day)
+            )).scalar()
+            return dates, lessons
+    return client.portal.call(run)
+
+
+def test_concurrent_first_post(client, headers):
+    day = "2032-03-01"
+    responses = _fire(client, [("POST", f"/schedule/{day}", headers)] * REQUESTS)
+    assert [r.status_code for r in responses] == [200] * REQUESTS
+
+    lesson_ids = {tuple(lesson["id"] for lesson in r.json()["lessons"]) for r in responses}
+    assert len(lesson_ids) == 1
+    assert [lesson["lesson_number"] for lesson in responses[0].json()["lessons"]] == list(range(1, 9))
+    assert _counts(client, day) == (1, 8)
+
+
+def test_concurrent_first_get_and_post(client, headers):
+    day = "2032-03-02"
+    requests = [("GET" if i % 2 else "POST", f"/schedule/{day}", headers) for i in range(REQUESTS)]
+    responses = _fire(client, requests)
+    assert [r.status_code for r in responses] == [200] * REQUESTS
+    seeded = {tuple(lesson["id"] for lesson in r.json()["lessons"]) for r in responses[::2]}
+    assert len(seeded) == 1
+    # GET мог успеть раньше первого POST - тогда день ещё без пар
+    assert {tuple(lesson["id"] for lesson in r.json()["lessons"]) for r in responses[1::2]} <= seeded | {()}
+    assert _counts(client, day) == (1, 8)
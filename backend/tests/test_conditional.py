@@ -0,0 +1,143 @@
+"""Range / If-None-Match / If-Range на скачивании и ETag расписания"""
+from conftest import upload
+
+CONTENT = bytes(range(256)) * 40  # 10240 байт
+
+
+def _file(client, headers, day) -> int:
+    lesson_id = client.get(f"/schedule/{day}", headers=headers).json()["lessons"][0]["id"]
+    return upload(client, headers, lesson_id, CONTENT, "data.bin")
+
+
+def test_download_full(client, headers, day):
+    file_id = _file(client, headers, day)
+    response = client.get(f"/files/download/{file_id}", headers=headers)
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers["accept-ranges"] == "bytes"
+    assert "content-encoding" not in response.headers
+
+
+def test_range_206(client, headers, day):
+    file_id = _file(client, headers, day)
+    response = client.get(f"/files/download/{file_id}", headers={**headers, "Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes 100-199/{len(CONTENT)}"
+    assert response.content == CONTENT[100:200]
+
+    response = client.get(f"/files/download/{file_id}", headers={**headers, "Range": "bytes=-16"})
+    assert response.status_code == 206
+    assert response.content == CONTENT[-16:]
+
+
+def test_range_416(client, headers, day):
+    file_id = _file(client, headers, day)
+    response = client.get(f"/files/download/{file_id}", headers={**headers, "Range": "bytes=20000-20010"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(CONTENT)}"
+
+
+def test_multiple_ranges(client, headers, day):
+    file_id = _file(client, headers, day)
+    response = client.get(f"/files/download/{file_id}", headers={**headers, "Range": "bytes=0-9,100-109"})
+    assert response.status_code == 206
+    content_type = response.headers["content-type"]
+    assert content_type.startswith("multipart/byteranges; boundary=")
+    boundary = content_type.split("boundary=")[1]
+    parts = response.content.split(f"--{boundary}".encode())
+    assert parts[-1].strip() == b"--"
+    bodies = [part.split(b"\r\n\r\n", 1) for part in parts[1:-1]]
+    assert [head.split(b"Content-Range: ")[1] for head, _ in bodies] == [
+        f"bytes 0-9/{len(CONTENT)}".encode(), f"bytes 100-109/{len(CONTENT)}".encode()]
+    assert [body.removesuffix(b"\r\n") for _, body in bodies] == [CONTENT[0:10], CONTENT[100:110]]
+    assert int(response.headers["content-length"]) == len(response.content)
+
+
+def test_overlapping_ranges_are_merged(client, headers, day):
+    file_id = _file(client, headers, day)
+    # Раньше - 16 копий файла в одном ответе
+    response = client.get(f"/files/download/{file_id}", headers={**headers, "Range": "bytes=" + ",".join(["0-"] * 16)})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes 0-{len(CONTENT) - 1}/{len(CONTENT)}"
+    assert response.content == CONTENT
+
+    # Соседние и вложенные склеиваются, порядок - по возрастанию
+    response = client.get(f"/files/download/{file_id}",
+                          headers={**headers, "Range": "bytes=20-29,0-9,10-19,5-6,-10"})
+    assert response.status_code == 206
+    assert "multipart/byteranges" in response.headers["content-type"]
+    assert response.content.count(b"Content-Range") == 2
+    assert f"bytes 0-29/{len(CONTENT)}".encode() in response.content
+
+
+def test_range_416_when_no_range_fits(client, headers, day):
+    file_id = _file(client, headers, day)
+    response = client.get(f"/files/download/{file_id}",
+                          headers={**headers, "Range": f"bytes={len(CONTENT)}-,20000-20001"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(CONTENT)}"
+
+
+def test_if_range_mismatch_gives_full_body(client, headers, day):
+    file_id = _file(client, headers, day)
+    response = client.get(f"/files/download/{file_id}",
+                          headers={**headers, "Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert response.status_code == 200
+    assert response.content == CONTENT
+
+
+def test_download_304(client, headers, day):
+    file_id = _file(client, headers, day)
+    etag = client.get(f"/files/download/{file_id}", headers=headers).headers["etag"]
+    response = client.get(f"/files/download/{file_id}", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+
+
+def test_schedule_304_until_changed(client, headers, day):
+    response = client.get(f"/schedule/{day}", headers=headers)
+    etag = response.headers["etag"]
+    lesson_id = response.json()["lessons"][0]["id"]
+
+    response = client.get(f"/schedule/{day}", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+
+    client.put(f"/lessons/{lesson_id}", headers=headers, data={"subject": "Матанализ"}).raise_for_status()
+    response = client.get(f"/schedule/{day}", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert response.json()["lessons"][0]["subject"] == "Матанализ"
+
+
+def test_schedule_304_with_compressed_etag(client, headers, day, monkeypatch):
+    from app import encoding
+    monkeypatch.setattr(encoding, "COMPRESSION_MIN_SIZE", 1)
+    response = client.get(f"/schedule/{day}", headers={**headers, "Accept-Encoding": "br"})
+    assert response.headers["content-encoding"] == "br"
+    etag = response.headers["etag"]
+    assert etag.endswith('-br"')
+
+    base = etag.removesuffix('-br"') + '"'
+    for accept, expected in (("br", etag), ("gzip", base[:-1] + '-gzip"'), ("identity", base)):
+        response = client.get(f"/schedule/{day}",
+                              headers={**headers, "Accept-Encoding": accept, "If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["etag"] == expected
+
+    # Несжатая копия (тело меньше порога) - и 304 с голым тегом
+    monkeypatch.setattr(encoding, "COMPRESSION_MIN_SIZE", 10 ** 9)
+    response = client.get(f"/schedule/{day}", headers={**headers, "Accept-Encoding": "br"})
+    assert response.headers["etag"] == base
+    response = client.get(f"/schedule/{day}", headers={**headers, "Accept-Encoding": "br", "If-None-Match": base})
+    assert (response.status_code, response.headers["etag"]) == (304, base)
+
+
+def test_dates_304_with_compressed_etag(client, headers, day, monkeypatch):
+    from app import encoding
+    monkeypatch.setattr(encoding, "COMPRESSION_MIN_SIZE", 1)
+    response = client.get("/dates", headers={**headers, "Accept-Encoding": "gzip"})
+    etag = response.headers["etag"]
+    assert etag.endswith('-gzip"')
+    response = client.get("/dates", headers={**headers, "Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert (response.status_code, response.headers["etag"]) == (304, etag)
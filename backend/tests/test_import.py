@@ -0,0 +1,108 @@
+"""POST /schedule/import: отчёт created/updated/skipped, повторный импорт, кодировки, плохие строки"""
+import json
+from datetime import date
+
+from app import crud, database
+
+CSV = (
+    "date,lesson_number,subject,teacher,room\r\n"
+    "2040-02-03,1,Матанализ,Иванов И.И.,305\r\n"
+    "2040-02-03,2,Алгебра,Петров П.П.,306\r\n"
+    "04.02.2040,1,Физика,Сидоров С.С.,101\r\n"
+)
+
+
+def _import(client, headers, filename: str, content: bytes) -> dict:
+    response = client.post("/schedule/import", headers=headers, files={"file": (filename, content)})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def _lessons(client, headers, day: str) -> list:
+    lessons = client.get(f"/schedule/{day}", headers=headers).json()["lessons"]
+    return [(l["lesson_number"], l["subject"], l["teacher"], l["room"]) for l in lessons]
+
+
+def test_csv_import_and_reimport(client, headers):
+    report = _import(client, headers, "sem.csv", CSV.encode())
+    assert report == {"dates_created": 2, "created": 3, "updated": 0, "skipped": 0, "errors": []}
+    assert _lessons(client, headers, "2040-02-03") == [
+        (1, "Матанализ", "Иванов И.И.", "305"), (2, "Алгебра", "Петров П.П.", "306"),
+    ]
+
+    # Тот же файл ещё раз ничего не меняет - и ETag дня остаётся прежним
+    etag = client.get("/schedule/2040-02-03", headers=headers).headers["etag"]
+    report = _import(client, headers, "sem.csv", CSV.encode())
+    assert report == {"dates_created": 0, "created": 0, "updated": 0, "skipped": 3, "errors": []}
+    assert client.get("/schedule/2040-02-03", headers=headers).headers["etag"] == etag
+
+    changed = CSV.replace("Алгебра", "Геометрия") + "2040-02-03,3,Химия,,\r\n"
+    report = _import(client, headers, "sem.csv", changed.encode())
+    assert (report["created"], report["updated"], report["skipped"]) == (1, 1, 2)
+    assert _lessons(client, headers, "2040-02-03")[1:] == [(2, "Геометрия", "Петров П.П.", "306"), (3, "Химия", "", "")]
+
+
+def test_cp1251_semicolon_csv(client, headers):
+    # Так сохраняет CSV русский Excel
+    content = "Date;Lesson_Number;Subject;Teacher;Room\r\n2040-03-01;1;Информатика;Кузнецова А.А.;ВЦ-2\r\n"
+    report = _import(client, headers, "excel.csv", content.encode("cp1251"))
+    assert (report["created"], report["errors"]) == (1, [])
+    assert _lessons(client, headers, "2040-03-01") == [(1, "Информатика", "Кузнецова А.А.", "ВЦ-2")]
+
+    bom = "\ufeffdate,lesson_number,subject\r\n2040-03-02,1,Логика\r\n".encode("utf-8")
+    assert _import(client, headers, "bom.csv", bom)["created"] == 1
+    assert _lessons(client, headers, "2040-03-02") == [(1, "Логика", "", "")]
+
+
+def test_invalid_rows_are_skipped_with_errors(client, headers):
+    content = (
+        "date,lesson_number,subject\r\n"
+        "2040-04-01,1,Хорошая\r\n"
+        "2040-13-01,1,Плохая дата\r\n"
+        "2040-04-01,,Без номера\r\n"
+        "2040-04-01,0,Нулевой номер\r\n"
+        "2040-04-01,2,Тоже хорошая\r\n"
+    )
+    report = _import(client, headers, "bad.csv", content.encode())
+    assert (report["created"], report["skipped"]) == (2, 3)
+    assert [e["row"] for e in report["errors"]] == [2, 3, 4]
+    assert _lessons(client, headers, "2040-04-01") == [(1, "Хорошая", "", ""), (2, "Тоже хорошая", "", "")]
+
+
+def test_json_and_ndjson(client, headers):
+    rows = [{"date": "2040-05-01", "lesson_number": 1, "subject": "Английский", "room": 305},
+            {"date": "2040-05-01", "lesson_number": "2", "subject": "Немецкий", "teacher": None}]
+    report = _import(client, headers, "sem.json", json.dumps(rows, ensure_ascii=False).encode())
+    assert (report["created"], report["errors"]) == (2, [])
+    assert _lessons(client, headers, "2040-05-01") == [(1, "Английский", "", "305"), (2, "Немецкий", "", "")]
+
+    ndjson = "\n".join(json.dumps(r, ensure_ascii=False) for r in rows).encode()
+    assert _import(client, headers, "sem.ndjson", ndjson)["skipped"] == 2
+
+    report = _import(client, headers, "broken.json", b'[{"date": "2040-05-02", "lesson_number": 1}, {"date": ')
+    assert (report["created"], report["skipped"]) == (1, 1)
+
+
+def test_ics_roundtrip_is_idempotent(client, headers):
+    _import(client, headers, "sem.csv", CSV.encode())
+    response = client.get("/schedule/export.ics", headers=headers, params={"from": "2040-02-03", "to": "2040-02-04"})
+    assert response.status_code == 200
+    report = _import(client, headers, "sem.ics", response.content)
+    assert (report["created"], report["updated"], report["errors"]) == (0, 0, [])
+    assert report["skipped"] >= 3
+
+
+def test_unknown_format(client, headers):
+    response = client.post("/schedule/import", headers=headers, files={"file": ("sem.xlsx", b"PK\x03\x04")})
+    assert response.status_code == 400
+
+
+def test_create_lesson_conflict_and_missing_day(client, headers, day):
+    async def date_id():
+        async with database.sessionmaker() as db:
+            return (await crud.get_schedule_version(db, date.fromisoformat(day))).id
+
+    data = {"date_id": client.portal.call(date_id), "lesson_number": 1, "subject": "Дубль"}
+    assert client.post("/create-lesson", headers=headers, data=data).status_code == 409
+    assert client.post("/create-lesson", headers=headers, data={**data, "lesson_number": 9}).status_code == 200
+    assert client.post("/create-lesson", headers=headers, data={**data, "date_id": 10 ** 9}).status_code == 404
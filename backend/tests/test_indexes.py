@@ -0,0 +1,78 @@
+"""Горячие запросы идут по индексам: EXPLAIN QUERY PLAN на той же SQLite, что и тесты.
+
+Планы снимаем с SQL, который приложение реально отправляет (crud, jobs), а не с
+переписанных вручную копий - иначе легко потерять, например, ORDER BY от relationship.
+"""
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import text
+
+from app import crud, database, jobs
+from conftest import capture_sql, upload
+
+
+async def _schedule_date(db, day, lesson_id):
+    await crud.get_schedule_date(db, day)
+
+
+async def _schedule_range(db, day, lesson_id):
+    await crud.get_schedule_range(db, day, day + timedelta(days=30))
+
+
+async def _lesson_files(db, day, lesson_id):
+    await crud.get_lesson_files(db, lesson_id)
+
+
+async def _next_job(db, day, lesson_id):
+    # Опрос очереди задач (jobs.Worker.run_one), частичный индекс по pending
+    worker = jobs.Worker()
+    worker._sessionmaker = database.sessionmaker
+    await worker.run_one()
+
+
+async def _files_by_blob(db, day, lesson_id):
+    # Такой запрос шлёт сама база - проверка FK при удалении блоба (в Postgres ещё FOR KEY SHARE)
+    await db.execute(text("SELECT 1 FROM files WHERE blob_sha256 = :sha256"), {"sha256": "0" * 64})
+
+
+HOT_CALLS = {
+    "schedule_date": (_schedule_date, ["sqlite_autoindex_schedule_dates", "sqlite_autoindex_lessons",
+                                       "ix_files_lesson_id_uploaded_at"]),
+    "schedule_range": (_schedule_range, ["sqlite_autoindex_schedule_dates", "sqlite_autoindex_lessons",
+                                         "ix_files_lesson_id_uploaded_at"]),
+    "lesson_files": (_lesson_files, ["ix_files_lesson_id_uploaded_at"]),
+    "next_job": (_next_job, ["ix_jobs_pending_run_at"]),
+    "files_by_blob": (_files_by_blob, ["ix_files_blob_sha256"]),
+}
+
+
+def _plans(client, call, day, lesson_id) -> list:
+    async def run():
+        with capture_sql() as statements:
+            async with database.sessionmaker() as db:
+                await call(db, day, lesson_id)
+        async with database.engine.connect() as conn:
+            plans = []
+            for statement, parameters in statements:
+                rows = await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+                plans.append((statement, " | ".join(row[-1] for row in rows)))
+            return plans
+    return client.portal.call(run)
+
+
+@pytest.mark.parametrize("name", HOT_CALLS)
+def test_hot_query_uses_index(client, headers, day, name):
+    lesson_id = client.get(f"/schedule/{day}", headers=headers).json()["lessons"][0]["id"]
+    upload(client, headers, lesson_id, f"{name}-1".encode())
+    upload(client, headers, lesson_id, f"{name}-2".encode())
+
+    call, indexes = HOT_CALLS[name]
+    plans = _plans(client, call, date.fromisoformat(day), lesson_id)
+    assert plans
+    text = "\n".join(f"{statement}\n    {plan}" for statement, plan in plans)
+    for index in indexes:
+        assert index in text, text
+    for statement, plan in plans:
+        assert "SCAN" not in plan.replace("SCAN CONSTANT ROW", ""), text
+        assert "TEMP B-TREE" not in plan, text  # сортировка тоже по индексу
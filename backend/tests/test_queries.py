@@ -0,0 +1,34 @@
+"""Число SQL-запросов на чтение расписания не зависит от числа пар и файлов"""
+from app.cache import schedule_cache
+from conftest import capture_sql as count_queries, upload
+
+
+def _schedule_queries(client, headers, day) -> int:
+    schedule_cache.clear()  # мимо кэша - считаем именно загрузку из базы
+    with count_queries() as statements:
+        response = client.get(f"/schedule/{day}", headers=headers)
+    assert response.status_code == 200
+    return len(statements)
+
+
+def test_schedule_query_count_is_constant(client, headers, day):
+    empty = _schedule_queries(client, headers, day)
+    assert empty <= 2
+
+    lessons = client.get(f"/schedule/{day}", headers=headers).json()["lessons"]
+    for i, lesson in enumerate(lessons):
+        for n in range(3):
+            upload(client, headers, lesson["id"], f"{day}-{i}-{n}".encode())
+
+    response = client.get(f"/schedule/{day}", headers=headers)
+    assert sum(len(lesson["files"]) for lesson in response.json()["lessons"]) == 3 * len(lessons)
+    assert _schedule_queries(client, headers, day) == empty
+
+
+def test_schedule_range_query_count_is_constant(client, headers, day):
+    schedule_cache.clear()
+    with count_queries() as one_day:
+        client.get("/schedule", params={"from": day, "to": day}, headers=headers).raise_for_status()
+    with count_queries() as many_days:
+        client.get("/schedule", params={"from": "2031-01-01", "to": "2031-02-28"}, headers=headers).raise_for_status()
+    assert len(many_days) == len(one_day) <= 2
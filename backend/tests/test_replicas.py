@@ -0,0 +1,124 @@
+"""Маршрутизация чтения на реплики (database.SessionRouter) с двумя SQLite вместо реплик Postgres"""
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from datetime import date
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app import database, models
+from app.cache import schedule_cache
+from conftest import login, upload
+
+
+def test_round_robin_and_stickiness():
+    router = database.SessionRouter(window=0.05)
+    assert router.reader(1) is database.sessionmaker  # реплик нет - всё на primary
+    replicas = [object(), object()]
+    router.configure(replicas)
+    assert [router.reader(None) for _ in range(4)] == replicas * 2
+
+    router.mark_write(1)
+    assert router.reader(1) is database.sessionmaker
+    assert router.reader(2) in replicas
+    assert router.replicas_may_lag()
+    time.sleep(0.06)
+    assert router.reader(1) in replicas
+    assert not router.replicas_may_lag()
+
+
+def test_write_from_other_worker_via_message():
+    router = database.SessionRouter(window=60)
+    router.configure([object()])
+    router.apply_message({"kind": "schedule", "date": "2031-01-01"})
+    assert not router.replicas_may_lag()
+
+    router.apply_message({"kind": "write", "user_id": None})
+    assert router.replicas_may_lag()
+    assert not router.is_sticky(None)
+
+    router.apply_message({"kind": "write", "user_id": 7})
+    assert router.is_sticky(7) and router.reader(7) is database.sessionmaker
+
+
+def test_sticky_memory_is_bounded():
+    router = database.SessionRouter(window=60, maxsize=2)
+    for user_id in (1, 2, 3):
+        router.mark_write(user_id)
+    assert not router.is_sticky(1)
+    assert router.is_sticky(2) and router.is_sticky(3)
+
+
+@pytest.fixture
+def replicas(client, monkeypatch):
+    """Две пустые SQLite-«реплики» (схема есть, данных нет) на время теста"""
+    workdir = tempfile.mkdtemp(prefix="replicas-")
+    engines = [database.make_engine(f"sqlite+aiosqlite:///{os.path.join(workdir, f'r{i}.db')}") for i in (1, 2)]
+
+    async def create():
+        for engine in engines:
+            async with engine.begin() as conn:
+                await conn.run_sync(database.Base.metadata.create_all)
+
+    async def dispose():
+        for engine in engines:
+            await engine.dispose()
+
+    client.portal.call(create)
+    monkeypatch.setattr(database.router, "_last_write", OrderedDict())
+    monkeypatch.setattr(database.router, "_last_any_write", float("-inf"))
+    database.router.configure([
+        async_sessionmaker(e, class_=AsyncSession, expire_on_commit=False, info={"replica": True}) for e in engines
+    ])
+    yield engines
+    database.router.configure([])
+    client.portal.call(dispose)
+
+
+def test_reads_go_to_replica_until_own_write(client, headers, day, replicas, monkeypatch):
+    lesson_id = client.get(f"/schedule/{day}", headers=headers).json()["lessons"][0]["id"]
+    file_id = upload(client, headers, lesson_id, b"replica")
+    reader = login(client, "replica_reader")
+
+    # Файл есть только на primary: чтение ушло на пустую реплику
+    assert client.get(f"/files/{file_id}", headers=reader).status_code == 404
+
+    # После своей записи читаем с primary (read-your-writes), пока не кончится окно
+    monkeypatch.setattr(database.router, "window", 0.3)
+    client.post("/schedule/2035-05-05", headers=reader).raise_for_status()
+    assert client.get(f"/files/{file_id}", headers=reader).status_code == 200
+    time.sleep(0.35)
+    assert client.get(f"/files/{file_id}", headers=reader).status_code == 404
+
+
+def test_schedule_missing_on_replica_is_read_from_primary(client, headers, day, replicas):
+    reader = login(client, "replica_reader")
+    schedule_cache.clear()
+    response = client.get(f"/schedule/{day}", headers=reader)
+    assert response.status_code == 200
+    assert len(response.json()["lessons"]) == 8
+
+
+def test_lagging_replica_answer_is_not_cached(client, headers, day, replicas, monkeypatch):
+    async def stale_copy():
+        for engine in replicas:
+            async with engine.begin() as conn:
+                await conn.execute(models.ScheduleDate.__table__.insert().values(
+                    date=date.fromisoformat(day), notes="старая копия", version=1))
+    client.portal.call(stale_copy)
+    reader = login(client, "replica_reader")
+    target = date.fromisoformat(day)
+
+    # Кто-то только что писал (в любом воркере) - реплика может отставать
+    monkeypatch.setattr(database.router, "window", 60)
+    database.router.apply_message({"kind": "write", "user_id": None})
+    schedule_cache.clear()
+    assert client.get(f"/schedule/{day}", headers=reader).json()["notes"] == "старая копия"
+    assert schedule_cache.get(target) is None
+
+    monkeypatch.setattr(database.router, "_last_any_write", float("-inf"))
+    client.get(f"/schedule/{day}", headers=reader).raise_for_status()
+    assert schedule_cache.get(target) is not None
+    schedule_cache.clear()
@@ -0,0 +1,67 @@
+"""Загрузки: поток прямо в UPLOAD_DIR, лимиты размера, без хвостов .part"""
+import functools
+import os
+
+from app import storage
+from conftest import upload
+
+
+def _lesson(client, headers, day) -> int:
+    return client.get(f"/schedule/{day}", headers=headers).json()["lessons"][0]["id"]
+
+
+def _leftovers() -> list:
+    return [name for name in os.listdir(storage.UPLOAD_DIR) if name.startswith(".upload-")]
+
+
+def test_batch_upload_with_one_file_too_large(client, headers, day, monkeypatch):
+    monkeypatch.setattr(storage, "receive_form", functools.partial(storage.receive_form, max_size=1000))
+    files = [("files", ("ok.txt", "привет".encode())), ("files", ("big.bin", b"x" * 1001)),
+             ("files", ("empty.txt", b""))]
+    response = client.post("/upload", headers=headers, data={"lesson_id": _lesson(client, headers, day)}, files=files)
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["uploaded"], body["failed"]) == (2, 1)
+    assert [f.get("error") is not None for f in body["files"]] == [False, True, False]
+    assert _leftovers() == []
+
+
+def test_upload_content_and_dedup(client, headers, day):
+    lesson_id = _lesson(client, headers, day)
+    content = os.urandom(3 * storage.UPLOAD_CHUNK_SIZE + 17)
+    first = upload(client, headers, lesson_id, content, "a.bin")
+    second = upload(client, headers, lesson_id, content, "b.bin")
+    for file_id in (first, second):
+        assert client.get(f"/files/download/{file_id}", headers=headers).content == content
+
+
+def test_upload_errors_leave_nothing_behind(client, headers, day):
+    lesson_id = _lesson(client, headers, day)
+    cases = [
+        ({"lesson_id": "999999"}, [("files", ("a.txt", b"1"))], 404),
+        ({"lesson_id": "x"}, [("files", ("a.txt", b"1"))], 422),
+        ({"lesson_id": str(lesson_id)}, [("other", ("a.txt", b"1"))], 400),
+    ]
+    for data, files, status in cases:
+        assert client.post("/upload", headers=headers, data=data, files=files).status_code == status
+    assert _leftovers() == []
+
+
+def test_chunked_body_over_limit_is_413(client, headers, day, monkeypatch):
+    lesson_id = _lesson(client, headers, day)
+    middleware = next(m for m in client.app.user_middleware if m.cls is storage.MaxBodySizeMiddleware)
+    limit = middleware.kwargs["max_size"]
+
+    def body():
+        yield ("--b\r\nContent-Disposition: form-data; name=\"file\"; filename=\"big.bin\"\r\n\r\n").encode()
+        chunk = b"x" * (1024 * 1024)
+        for _ in range(limit // len(chunk) + 2):
+            yield chunk
+        yield b"\r\n--b--\r\n"
+
+    # Без Content-Length (chunked) - лимит считается по прочитанным байтам, а не файлом в receive_form
+    monkeypatch.setattr(storage, "receive_form", functools.partial(storage.receive_form, max_size=limit * 2))
+    response = client.post(f"/lessons/{lesson_id}/files", content=body(),
+                           headers={**headers, "Content-Type": "multipart/form-data; boundary=b"})
+    assert response.status_code == 413
+    assert _leftovers() == []
@@ -89,6 +89,11 @@ export const scheduleAPI = {
     return response.data;
   },
 
+  getScheduleRange: async (fromStr, toStr) => {
+    const response = await api.get('/schedule', { params: { from: fromStr, to: toStr } });
+    return response.data;
+  },
+
   createOrGetSchedule: async (dateStr) => {
     const response = await api.post(`/schedule/${dateStr}`);
     return response.data;
@@ -115,6 +120,62 @@ export const scheduleAPI = {
     const response = await api.get('/dates');
     return response.data;
   },
+
+  // Поиск пар и файлов: { type: all|lessons|files, from, to, limit, offset }
+  search: async (q, params = {}) => {
+    const response = await api.get('/search', { params: { q, ...params } });
+    return response.data;
+  },
+
+  // Лента изменений дней (SSE). EventSource не умеет заголовки, а URL попадает в логи и историю,
+  // поэтому в query не токен, а билет на минуту. Билет истёк и сервер отказал - берём новый и
+  // подключаемся заново; после переподключения шлём resync: события за обрыв могли пропасть
+  subscribe: (dates, onEvent) => {
+    let source = null;
+    let timer = null;
+    let closed = false;
+    let connected = false;
+
+    const open = async () => {
+      let ticket;
+      try {
+        const response = await api.post('/schedule/stream/ticket');
+        ticket = response.data.ticket;
+      } catch (err) {
+        if (!closed) timer = setTimeout(open, 5000);
+        return;
+      }
+      if (closed) return;
+      const params = new URLSearchParams({ dates: dates.join(','), ticket });
+      source = new EventSource(`${API_URL}/schedule/stream?${params}`);
+      source.addEventListener('ready', () => {
+        if (connected) onEvent({ type: 'resync', dates });
+        connected = true;
+      });
+      ['lesson', 'file', 'date', 'import', 'resync'].forEach((type) =>
+        source.addEventListener(type, (e) => onEvent(JSON.parse(e.data)))
+      );
+      source.onerror = () => {
+        // CONNECTING - браузер переподключится сам, CLOSED - сервер отказал (истёк билет)
+        if (source.readyState === EventSource.CLOSED && !closed) timer = setTimeout(open, 3000);
+      };
+    };
+
+    open();
+    return {
+      close: () => {
+        closed = true;
+        clearTimeout(timer);
+        if (source) source.close();
+      },
+    };
+  },
+
+  // Страница дней: { limit, before, from, to, aggregate }; nextCursor - для следующей страницы
+  getDatesPage: async (params = {}) => {
+    const response = await api.get('/dates', { params });
+    return { dates: response.data, nextCursor: response.headers['x-next-cursor'] || null };
+  },
 };
 
 // API для файлов
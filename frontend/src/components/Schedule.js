@@ -46,6 +46,23 @@ const Schedule = () => {
     loadSchedule();
   }, [selectedDate]);
 
+  // Правки других пользователей приходят по SSE - перечитываем день без спиннера.
+  // День уже создан первой загрузкой, так что хватает GET: POST на каждое событие
+  // гонял бы всех подписчиков в primary и плодил записи и NOTIFY
+  useEffect(() => {
+    const source = scheduleAPI.subscribe([selectedDate], () => refreshSchedule());
+    return () => source.close();
+  }, [selectedDate]);
+
+  const refreshSchedule = async () => {
+    try {
+      const data = await scheduleAPI.getSchedule(selectedDate);
+      setSchedule(data);
+    } catch (err) {
+      // Фоновое обновление: ошибку не показываем, следующее событие перечитает ещё раз
+    }
+  };
+
   const loadSchedule = async () => {
     setLoading(true);
     setError('');
@@ -85,9 +102,15 @@ const Schedule = () => {
 
   const handleFileUpload = async (lessonId, files) => {
     try {
-      await filesAPI.uploadToLesson(lessonId, files[0]);
+      // Все выбранные файлы - одним запросом
+      const result = await filesAPI.uploadFile(lessonId, files);
       loadSchedule();
-      setUploadDialogOpen(false);
+      if (result.failed) {
+        const names = result.files.filter((f) => f.error).map((f) => f.filename).join(', ');
+        setError(`Не загружены файлы: ${names}`);
+      } else {
+        setUploadDialogOpen(false);
+      }
     } catch (err) {
       setError('Ошибка загрузки файла');
     }
@@ -309,9 +332,10 @@ const Schedule = () => {
         open={uploadDialogOpen}
         onClose={() => setUploadDialogOpen(false)}
       >
-        <DialogTitle>Загрузить файл для пары</DialogTitle>
+        <DialogTitle>Загрузить файлы для пары</DialogTitle>
         <DialogContent>
           <FileUpload
+            multiple
             onUpload={(files) => handleFileUpload(selectedLessonId, files)}
           />
         </DialogContent>